@@ -30,4 +30,5 @@ admin.site.register(CollectionNote)
 admin.site.register(CollectionSource)
 admin.site.register(ConceptLabel)
 admin.site.register(ConceptNote)
-admin.site.register(ConceptSource)
\ No newline at end of file
+admin.site.register(ConceptSource)
+admin.site.register(ImportJob)
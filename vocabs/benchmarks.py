@@ -0,0 +1,102 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from .models import SkosConcept
+from .rdf_utils import graph_construct_qs
+from .skos_generator import write_vocab
+from .skos_import import SkosImporter, measure
+
+
+STAGES = ("import", "export", "concept_list", "concept_detail", "scheme_detail", "download")
+
+
+class QueryCounter(object):
+	"""
+	Execute wrapper counting database queries, unlike the query log of
+	CaptureQueriesContext it is not limited to the last 9000 queries
+	"""
+
+	def __init__(self):
+		self.count = 0
+
+	def __call__(self, execute, sql, params, many, context):
+		self.count += 1
+		return execute(sql, params, many, context)
+
+
+@contextmanager
+def benchmark_stage(results, concepts, name, memory=True):
+	"""
+	Records wall time, the number of database queries and peak memory (tracemalloc,
+	it slows Python code down, without memory only the time is measured) of a stage,
+	the yielded dictionary takes extra values of the stage
+	"""
+	stages = {}
+	extra = {}
+	counter = QueryCounter()
+	with connection.execute_wrapper(counter):
+		if memory:
+			with measure(stages, name):
+				yield extra
+		else:
+			start = time.time()
+			yield extra
+			stages[name] = {"seconds": time.time() - start, "peak_memory": None}
+	result = {"concepts": concepts, "stage": name, "queries": counter.count}
+	result.update(stages[name])
+	result.update(extra)
+	results.append(result)
+	logging.info("{concepts} concepts, {stage}: {seconds:.2f}s, {queries} queries".format(**result))
+
+
+def _get(client, url):
+	response = client.get(url)
+	# streaming responses are consumed inside the stage
+	content = b"".join(response.streaming_content) if response.streaming else response.content
+	return {"status": response.status_code, "bytes": len(content)}
+
+
+def run_benchmark(sizes, directory, user, stages=STAGES, memory=True, **kwargs):
+	"""
+	Generates a synthetic vocabulary per size (see skos_generator.generate_triples,
+	kwargs are passed to it) in directory and times the stages on it:
+	import with SkosImporter.upload_data, export with graph_construct_qs,
+	the concept list, concept detail, concept scheme detail and download views.
+	Peak memory is only measured with memory. Returns a list of results per size and stage
+	"""
+	results = []
+	languages = kwargs.get("languages") or ("en",)
+	client = Client()
+	client.force_login(user)
+	for size in sizes:
+		path = os.path.join(directory, "synthetic-{}.nt".format(size))
+		write_vocab(path, "nt", concepts=size, **kwargs)
+		with benchmark_stage(results, size, "import", memory) as extra:
+			importer = SkosImporter(file=path, file_format="nt", language=languages[0])
+			scheme = importer.upload_data(user=user.username)
+			extra["rows"] = sum(stat["rows"] for stat in importer.stats.values())
+		concepts = SkosConcept.objects.filter(scheme=scheme)
+		if "export" in stages:
+			with benchmark_stage(results, size, "export", memory) as extra:
+				extra["triples"] = len(graph_construct_qs(concepts))
+		# a top concept, the detail page lists its narrower concepts
+		concept = concepts.filter(broader_concept=None).order_by("pk").first()
+		urls = {
+			"concept_list": reverse("vocabs:browse_vocabs"),
+			"concept_detail": reverse("vocabs:skosconcept_detail", kwargs={"pk": concept.pk}),
+			"scheme_detail": reverse("vocabs:skosconceptscheme_detail", kwargs={"pk": scheme.pk}),
+			"download": "{}?scheme={}&format=turtle".format(reverse("vocabs:vocabs-download"), scheme.pk),
+		}
+		with override_settings(ALLOWED_HOSTS=["testserver"]):
+			for name, url in urls.items():
+				if name in stages:
+					with benchmark_stage(results, size, name, memory) as extra:
+						extra.update(_get(client, url))
+		# the next size starts with an empty database
+		scheme.delete()
+	return results
@@ -0,0 +1,95 @@
+import logging
+import time
+from collections import OrderedDict
+from django.db import connections, router
+
+
+# stays below the SQLite limit of query parameters
+READBACK_SIZE = 500
+
+
+class BulkWriter(object):
+	"""
+	Writes model instances with batched bulk_create and keeps
+	per table statistics (rows written, seconds spent, rows/sec)
+	"""
+
+	def __init__(self, batch_size=1000):
+		self.batch_size = batch_size
+		self.stats = OrderedDict()
+
+	def _record(self, table, rows, seconds):
+		stat = self.stats.setdefault(table, {"rows": 0, "seconds": 0.0})
+		stat["rows"] += rows
+		stat["seconds"] += seconds
+		if stat["seconds"] > 0:
+			stat["rows_per_sec"] = stat["rows"] / stat["seconds"]
+		else:
+			stat["rows_per_sec"] = float(stat["rows"])
+
+	def batch_size_for(self, model, objs):
+		"""
+		Returns batch_size limited by the backend (e.g. SQLite allows 999 query parameters
+		and 500 rows per insert), bulk_create of Django 2.2 does not limit a given batch_size
+		"""
+		ops = connections[router.db_for_write(model)].ops
+		fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+		return max(min(self.batch_size, ops.bulk_batch_size(fields, objs)), 1)
+
+	def create(self, model, objs, key=None, queryset=None):
+		"""
+		Bulk creates objs of a model. If key is given, returns a dictionary key -> pk.
+		Backends that do not return ids from bulk inserts (e.g. SQLite)
+		get their pks read back from queryset in batches of key values
+		"""
+		start = time.time()
+		objs = model.objects.bulk_create(objs, batch_size=self.batch_size_for(model, objs))
+		if key is not None:
+			if any(obj.pk is None for obj in objs):
+				keys = [getattr(obj, key) for obj in objs]
+				pk_map = {}
+				for i in range(0, len(keys), READBACK_SIZE):
+					pk_map.update(queryset.filter(
+						**{'{}__in'.format(key): keys[i:i + READBACK_SIZE]}).values_list(key, 'pk'))
+				for obj in objs:
+					obj.pk = pk_map.get(getattr(obj, key))
+			else:
+				pk_map = {getattr(obj, key): obj.pk for obj in objs}
+		else:
+			pk_map = None
+		self._record(model._meta.db_table, len(objs), time.time() - start)
+		return pk_map
+
+	def update(self, model, objs, fields):
+		"""
+		Bulk updates fields of objs in batches
+		"""
+		start = time.time()
+		model.objects.bulk_update(objs, fields, batch_size=self.batch_size)
+		self._record("{} (update)".format(model._meta.db_table), len(objs), time.time() - start)
+
+	def delete(self, model, pks, field="pk"):
+		"""
+		Deletes rows of a model whose field is in pks, in batches
+		"""
+		start = time.time()
+		pks = list(pks)
+		rows = 0
+		for i in range(0, len(pks), READBACK_SIZE):
+			rows += model.objects.filter(**{'{}__in'.format(field): pks[i:i + READBACK_SIZE]}).delete()[1].get(
+				model._meta.label, 0)
+		self._record("{} (delete)".format(model._meta.db_table), rows, time.time() - start)
+
+	def report(self):
+		"""
+		Returns a list of human readable lines with rows/sec per table
+		"""
+		lines = []
+		for table, stat in self.stats.items():
+			lines.append("{}: {} rows in {:.2f}s ({:.0f} rows/sec)".format(
+				table, stat["rows"], stat["seconds"], stat["rows_per_sec"]))
+		return lines
+
+	def log_report(self):
+		for line in self.report():
+			logging.info(line)
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.cache import caches
+
+
+# formats of the download view whose dumps of a whole concept scheme are cached
+CACHED_FORMATS = ("pretty-xml", "turtle", "nt", "json-ld")
+
+try:
+	EXPORT_CACHE = settings.VOCABS_SETTINGS['export_cache']
+except KeyError:
+	EXPORT_CACHE = "default"
+
+try:
+	EXPORT_CACHE_MAX_SIZE = settings.VOCABS_SETTINGS['export_cache_max_size']
+except KeyError:
+	# bytes, a larger dump is streamed on every download
+	EXPORT_CACHE_MAX_SIZE = 50 * 1024 * 1024
+
+
+def _cache():
+	return caches[EXPORT_CACHE]
+
+
+def _key(scheme_pk, file_format):
+	return "vocabs-export:{}:{}".format(scheme_pk, file_format)
+
+
+def etag(scheme_pk, file_format, stamp):
+	"""
+	Returns the ETag of a dump from the modification stamp of its concept scheme,
+	a conditional request is answered without reading the dump
+	"""
+	return '"{}-{}-{}"'.format(scheme_pk, file_format, int(stamp.timestamp() * 1000000))
+
+
+def get_dump(scheme_pk, file_format, stamp):
+	"""
+	Returns the cached dump of a concept scheme in a format,
+	None if there is none or it was rendered before the stamp
+	"""
+	entry = _cache().get(_key(scheme_pk, file_format))
+	if entry is not None and entry[0] == stamp:
+		return entry[1]
+	return None
+
+
+def set_dump(scheme_pk, file_format, stamp, content):
+	"""
+	Stores a dump (bytes) of a concept scheme rendered at the stamp, unless it is too large
+	"""
+	if len(content) <= EXPORT_CACHE_MAX_SIZE:
+		_cache().set(_key(scheme_pk, file_format), (stamp, content), None)
+
+
+def cache_stream(chunks, scheme_pk, file_format, stamp):
+	"""
+	Yields the chunks (bytes) of a streamed dump and stores the dump once all of it is sent.
+	A dump which grows over EXPORT_CACHE_MAX_SIZE or is not sent to the end is not stored
+	"""
+	parts = []
+	size = 0
+	for data in chunks:
+		if parts is not None:
+			size += len(data)
+			if size <= EXPORT_CACHE_MAX_SIZE:
+				parts.append(data)
+			else:
+				parts = None
+		yield data
+	if parts is not None:
+		set_dump(scheme_pk, file_format, stamp, b"".join(parts))
+
+
+def invalidate(scheme_pks):
+	"""
+	Drops the cached dumps of concept schemes in every format
+	"""
+	_cache().delete_many([_key(pk, file_format) for pk in scheme_pks for file_format in CACHED_FORMATS])
@@ -0,0 +1,125 @@
+import datetime
+import logging
+import time
+from functools import partial
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import ImportJob
+from .skos_import import SkosImporter
+
+try:
+	JOB_TIMEOUT = settings.VOCABS_SETTINGS['import_job_timeout']
+except KeyError:
+	# seconds without a heartbeat after which a running job is claimed again
+	JOB_TIMEOUT = 15 * 60
+
+try:
+	JOB_MAX_ATTEMPTS = settings.VOCABS_SETTINGS['import_job_max_attempts']
+except KeyError:
+	JOB_MAX_ATTEMPTS = 3
+
+
+class JobProgress(object):
+	"""
+	Progress callback of SkosImporter which stores the phase, rows
+	written so far and the heartbeat of an import job, at most once per interval seconds
+	"""
+
+	def __init__(self, job, interval=1.0):
+		self.job = job
+		self.interval = interval
+		self.phase = None
+		self.last_update = 0
+
+	def __call__(self, phase, rows_done):
+		now = time.time()
+		if phase != self.phase or now - self.last_update >= self.interval:
+			self.phase = phase
+			self.last_update = now
+			ImportJob.objects.filter(pk=self.job.pk).update(
+				phase=phase, rows_done=rows_done, date_heartbeat=timezone.now())
+
+
+def delete_job_file(job):
+	"""
+	Deletes the uploaded file of a job which is done or failed for good,
+	the name of the file stays on the job
+	"""
+	if job.file:
+		job.file.storage.delete(job.file.name)
+
+
+def _stale_jobs(now):
+	"""
+	Returns the filter of running jobs without a heartbeat for JOB_TIMEOUT seconds
+	"""
+	before = now - datetime.timedelta(seconds=JOB_TIMEOUT)
+	return Q(status='running') & (Q(date_heartbeat__lt=before) | Q(date_heartbeat=None, date_started__lt=before))
+
+
+def claim_next_job():
+	"""
+	Marks the oldest queued job, or running job without a heartbeat for JOB_TIMEOUT seconds
+	(its worker stopped), as running and returns it, a job claimed by another worker is skipped.
+	A job whose worker stopped JOB_MAX_ATTEMPTS times is failed
+	"""
+	now = timezone.now()
+	stale = _stale_jobs(now)
+	for job in ImportJob.objects.filter(stale, attempts__gte=JOB_MAX_ATTEMPTS):
+		failed = ImportJob.objects.filter(stale, pk=job.pk).update(
+			status='failed', error='The worker stopped {} times'.format(JOB_MAX_ATTEMPTS), date_finished=now)
+		if failed:
+			delete_job_file(job)
+	jobs = ImportJob.objects.filter(Q(status='queued') | stale).order_by('id')
+	for pk, status, heartbeat in jobs.values_list('pk', 'status', 'date_heartbeat'):
+		# the heartbeat of a stale job is compared, another worker claiming it first changes it
+		claimed = ImportJob.objects.filter(pk=pk, status=status, date_heartbeat=heartbeat).update(
+			status='running', date_started=now, date_heartbeat=now, attempts=F('attempts') + 1)
+		if claimed:
+			return ImportJob.objects.get(pk=pk)
+	return None
+
+
+def wait_for_identical_jobs(job, content_hash, interval=1.0):
+	"""
+	Stores the hash of the parsed triples on a job and waits while a job of the same user
+	with the same content, which got its hash first, is running.
+	SkosImporter then returns the concept scheme of that job instead of writing it again.
+	A job without a heartbeat for JOB_TIMEOUT seconds is not waited for, the file is imported
+	as if there was no such job
+	"""
+	ImportJob.objects.filter(pk=job.pk).update(content_hash=content_hash, date_hashed=timezone.now())
+	while True:
+		first = ImportJob.objects.filter(
+			content_hash=content_hash, created_by=job.created_by, status='running').exclude(
+			_stale_jobs(timezone.now())).order_by('date_hashed', 'pk').first()
+		if first is None or first.pk == job.pk:
+			return
+		ImportJob.objects.filter(pk=job.pk).update(phase='waiting', date_heartbeat=timezone.now())
+		time.sleep(interval)
+
+
+def run_import_job(job):
+	"""
+	Imports the file of a job, stores the result or the error on the job and deletes the file,
+	a job claimed again after its worker stopped continues after its last committed chunk.
+	An identical file imported before or by a concurrent job is not imported again
+	"""
+	skos_vocab = SkosImporter(
+		file=job.file.path, file_format=job.file_format or None,
+		language=job.language, progress=JobProgress(job), resume=True,
+		on_content_hash=partial(wait_for_identical_jobs, job))
+	try:
+		scheme = skos_vocab.upload_data(user=job.created_by.username)
+	except Exception as error:
+		logging.exception("Import job %s failed", job.pk)
+		ImportJob.objects.filter(pk=job.pk).update(
+			status='failed', error=str(error), date_finished=timezone.now())
+	else:
+		rows = sum(stat["rows"] for stat in skos_vocab.stats.values())
+		ImportJob.objects.filter(pk=job.pk).update(
+			status='done', phase='', rows_done=rows, scheme=scheme, date_finished=timezone.now())
+	delete_job_file(job)
+	job.refresh_from_db()
+	return job
@@ -0,0 +1,93 @@
+import datetime
+import json
+import os
+import platform
+import shutil
+import tempfile
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from vocabs.benchmarks import STAGES, run_benchmark
+
+
+class Command(BaseCommand):
+
+	help = 'Times import, export and views on synthetic SKOS vocabularies in a test database'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--sizes', type=str, default='1000,10000,100000',
+			help='Comma separated numbers of concepts')
+		parser.add_argument('--stages', type=str, default=','.join(STAGES),
+			help='Comma separated stages, import always runs: {}'.format(', '.join(STAGES)))
+		parser.add_argument('--output', type=str, default='benchmark-results.json',
+			help='JSON file the results are added to')
+		parser.add_argument('--depth', type=int, default=4,
+			help='Maximum number of levels of a concept tree')
+		parser.add_argument('--fan-out', type=int, default=10,
+			help='Maximum number of narrower concepts of a concept')
+		parser.add_argument('--languages', type=str, default='en,de',
+			help='Comma separated languages of labels')
+		parser.add_argument('--notes', type=int, default=1,
+			help='Number of notes per concept')
+		parser.add_argument('--collections', type=int, default=10,
+			help='Number of collections')
+		parser.add_argument('--collection-size', type=int, default=50,
+			help='Number of members of a collection')
+		parser.add_argument('--no-memory', action='store_true',
+			help='Do not measure peak memory, tracing allocations slows the stages down')
+		parser.add_argument('--label', type=str, default='',
+			help='Label of the run in the results, e.g. a release')
+
+	def _read_runs(self, output):
+		if not os.path.exists(output):
+			return []
+		with open(output) as f:
+			runs = json.load(f)
+		if not isinstance(runs, list):
+			raise CommandError('{} is not a list of benchmark runs'.format(output))
+		return runs
+
+	def handle(self, *args, **kwargs):
+		"""E.g. command: python manage.py benchmark_vocabs --sizes 1000,10000 --label 1.2
+		or with Postgres settings: python manage.py benchmark_vocabs --settings=vocabseditor.settings.production"""
+		sizes = [int(size) for size in kwargs['sizes'].split(',') if size.strip()]
+		stages = [stage.strip() for stage in kwargs['stages'].split(',') if stage.strip()]
+		unknown = set(stages) - set(STAGES)
+		if unknown:
+			raise CommandError('Unknown stages: {}'.format(', '.join(sorted(unknown))))
+		parameters = {
+			'depth': kwargs['depth'], 'fan_out': kwargs['fan_out'],
+			'languages': [lang.strip() for lang in kwargs['languages'].split(',') if lang.strip()],
+			'notes': kwargs['notes'], 'collections': kwargs['collections'],
+			'collection_size': kwargs['collection_size'],
+		}
+		runs = self._read_runs(kwargs['output'])
+		directory = tempfile.mkdtemp()
+		# the benchmark writes to a test database like the test runner, not to the configured one
+		old_name = connection.settings_dict['NAME']
+		connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+		try:
+			user = User.objects.create_user('benchmark', 'benchmark@example.org', 'benchmark')
+			results = run_benchmark(
+				sizes, directory, user, stages, memory=not kwargs['no_memory'], **parameters)
+		finally:
+			connection.creation.destroy_test_db(old_name, verbosity=0)
+			shutil.rmtree(directory)
+		runs.append({
+			'label': kwargs['label'],
+			'date': datetime.datetime.now().isoformat(),
+			'database': connection.vendor,
+			'python': platform.python_version(),
+			'django': django.get_version(),
+			'parameters': parameters,
+			'results': results,
+		})
+		with open(kwargs['output'], 'w') as f:
+			json.dump(runs, f, indent=2)
+		for result in results:
+			line = '{concepts} concepts, {stage}: {seconds:.2f}s, {queries} queries'.format(**result)
+			if result['peak_memory'] is not None:
+				line += ', peak memory {:.1f} MB'.format(result['peak_memory'] / 1024 / 1024)
+			self.stdout.write(line)
+		self.stdout.write(self.style.SUCCESS('Results are added to {}'.format(kwargs['output'])))
@@ -0,0 +1,48 @@
+import datetime
+import json
+import os
+from django.core.management.base import BaseCommand, CommandError
+from vocabs.models import SkosConceptScheme
+from vocabs.rdf_utils import EXPORT_FORMATS
+from vocabs.skos_export import export_schemes
+
+
+class Command(BaseCommand):
+
+	help = 'Exports concept schemes to SKOS files with a manifest of their triple counts and checksums'
+
+	def add_arguments(self, parser):
+		parser.add_argument('schemes', type=int, nargs='*',
+			help='Ids of the concept schemes to export, all concept schemes if none are given')
+		parser.add_argument('--output', type=str, default='exports',
+			help='Directory the files and manifest.json are written to')
+		parser.add_argument('--formats', type=str, default='turtle',
+			help='Comma separated formats: {}'.format(', '.join(EXPORT_FORMATS)))
+		parser.add_argument('--no-gzip', action='store_true',
+			help='Write the files without compressing them')
+		parser.add_argument('--workers', type=int, default=1,
+			help='Number of processes writing files')
+
+	def handle(self, *args, **kwargs):
+		"""E.g. command: python manage.py export_skos_vocab --formats turtle,nt,pretty-xml,json-ld --workers 4
+		or python manage.py export_skos_vocab 3 7 --output backup/"""
+		formats = [f.strip() for f in kwargs['formats'].split(',') if f.strip()]
+		unknown = set(formats) - set(EXPORT_FORMATS)
+		if unknown:
+			raise CommandError('Unknown formats: {}'.format(', '.join(sorted(unknown))))
+		scheme_pks = kwargs['schemes'] or list(SkosConceptScheme.objects.values_list('pk', flat=True))
+		missing = set(scheme_pks) - set(
+			SkosConceptScheme.objects.filter(pk__in=scheme_pks).values_list('pk', flat=True))
+		if missing:
+			raise CommandError('Concept schemes not found: {}'.format(', '.join(str(pk) for pk in sorted(missing))))
+		output = kwargs['output']
+		os.makedirs(output, exist_ok=True)
+		files = []
+		for entry in export_schemes(
+				scheme_pks, formats, output, compress=not kwargs['no_gzip'], workers=kwargs['workers']):
+			files.append(entry)
+			self.stdout.write('{file}: {triples} triples, {bytes} bytes'.format(**entry))
+		with open(os.path.join(output, 'manifest.json'), 'w') as f:
+			json.dump({'date': datetime.datetime.now().isoformat(), 'files': files}, f, indent=2)
+		self.stdout.write(self.style.SUCCESS(
+			'Exported {} concept schemes to {} files in {}'.format(len(scheme_pks), len(files), output)))
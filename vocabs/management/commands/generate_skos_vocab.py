@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from vocabs.skos_generator import write_vocab
+
+
+class Command(BaseCommand):
+
+	help = 'Writes a synthetic SKOS vocabulary for tests and benchmarks'
+
+	def add_arguments(self, parser):
+		parser.add_argument('file', type=str,
+			help='The file name to write')
+		parser.add_argument('--format', type=str, default='nt',
+			help='The format of SKOS file: nt (written line by line), ttl, rdf, jsonld ...')
+		parser.add_argument('--concepts', type=int, default=1000,
+			help='Number of concepts')
+		parser.add_argument('--depth', type=int, default=4,
+			help='Maximum number of levels of a concept tree')
+		parser.add_argument('--fan-out', type=int, default=10,
+			help='Maximum number of narrower concepts of a concept')
+		parser.add_argument('--languages', type=str, default='en,de',
+			help='Comma separated languages of labels')
+		parser.add_argument('--notes', type=int, default=1,
+			help='Number of notes per concept')
+		parser.add_argument('--collections', type=int, default=0,
+			help='Number of collections')
+		parser.add_argument('--collection-size', type=int, default=50,
+			help='Number of members of a collection')
+		parser.add_argument('--namespace', type=str, default='http://example.org/synthetic/',
+			help='Namespace of the concept scheme, concepts and collections')
+		parser.add_argument('--seed', type=int, default=0,
+			help='Seed of the random members of collections')
+
+	def handle(self, *args, **kwargs):
+		"""E.g. command: python manage.py generate_skos_vocab vocab.nt --concepts 10000 --depth 5"""
+		triples = write_vocab(
+			kwargs['file'], kwargs['format'],
+			concepts=kwargs['concepts'], depth=kwargs['depth'], fan_out=kwargs['fan_out'],
+			languages=[lang.strip() for lang in kwargs['languages'].split(',') if lang.strip()],
+			notes=kwargs['notes'], collections=kwargs['collections'],
+			collection_size=kwargs['collection_size'], namespace=kwargs['namespace'], seed=kwargs['seed'])
+		self.stdout.write(self.style.SUCCESS('Wrote {} triples to {}'.format(triples, kwargs['file'])))
@@ -1,5 +1,10 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from django.core.management.base import BaseCommand, CommandError
-from vocabs.skos_import import SkosImporter
+from django.db import connections
+from vocabs.skos_import import SkosImporter, parse_file, validate_file
+from vocabs.skos_stream import format_name, guess_source_format
 
 
 class Command(BaseCommand):
@@ -8,21 +13,150 @@ class Command(BaseCommand):
 
 	def add_arguments(self, parser):
 		parser.add_argument('file', type=str,
-			help='The file name to import')
+			help='The file name to import, or a directory or glob pattern (quoted) of files')
 		parser.add_argument('lang', type=str,
 			help='The main language of a vocabulary to be imported')
 		parser.add_argument('format', type=str,
-			help='The format of SKOS file: accepts only one of the two options - rdf or ttl')
+			help='The format of SKOS file: rdf, ttl, nt, nq, jsonld or trig, with --stream nt, nq, ttl or rdf. '
+			'Files ending with .gz, .bz2, .xz or .zip are decompressed while they are read')
 		parser.add_argument('user', type=str,
 			help='Username')
+		parser.add_argument('--stream', action='store_true',
+			help='Read the file in chunks without building an RDF graph, '
+			'triples of a subject must be next to each other (e.g. sorted N-Triples)')
+		parser.add_argument('--chunk-size', type=int, default=1000,
+			help='Number of concepts written and committed at once')
+		parser.add_argument('--resume', action='store_true',
+			help='Continue an interrupted import of the same file after its last committed chunk')
+		parser.add_argument('--merge', action='store_true',
+			help='Update the concept scheme with the same identifier instead of creating a new one, '
+			'concepts are matched by their URI')
+		parser.add_argument('--force', action='store_true',
+			help='Import the file even if a vocabulary with identical triples was imported by the user before')
+		parser.add_argument('--dry-run', action='store_true',
+			help='Parse and check the files and report counts, timings and peak memory '
+			'without writing to the database')
+		parser.add_argument('--workers', type=int, default=1,
+			help='Number of processes parsing files, the database is written by the main process')
+
+	def _files(self, path, _format):
+		"""
+		Returns the files of a file name, a directory (files with
+		an extension of the format, also compressed) or a glob pattern
+		"""
+		if os.path.isdir(path):
+			files = [
+				f for f in glob.glob(os.path.join(path, '*'))
+				if os.path.isfile(f) and guess_source_format(f) == format_name(_format)]
+		elif glob.has_magic(path):
+			files = [f for f in glob.glob(path) if os.path.isfile(f)]
+		else:
+			files = [path]
+		if not files:
+			raise CommandError('No files found: {}'.format(path))
+		return sorted(files)
+
+	def _report(self, skos_vocab):
+		for scheme in skos_vocab.schemes:
+			if scheme in skos_vocab.duplicates:
+				self.stdout.write('Concept scheme: {} (imported before from identical triples)'.format(scheme))
+			else:
+				self.stdout.write('Concept scheme: {}'.format(scheme))
+		for table, stat in skos_vocab.stats.items():
+			self.stdout.write('{}: {} rows ({:.0f} rows/sec)'.format(
+				table, stat['rows'], stat['rows_per_sec']))
+		for name, counts in skos_vocab.diff.items():
+			self.stdout.write('{}: {inserted} inserted, {updated} updated, {deleted} deleted, {unchanged} unchanged'.format(
+				name, **counts))
+		for legacy_id, broader_id in skos_vocab.dangling_broader:
+			self.stdout.write(self.style.WARNING(
+				'Broader concept {} of {} is not found'.format(broader_id, legacy_id)))
+		for legacy_id, broader_id in skos_vocab.cyclic_broader:
+			self.stdout.write(self.style.WARNING(
+				'Broader concept {} of {} makes a cycle and is skipped'.format(broader_id, legacy_id)))
+		for legacy_id in skos_vocab.unassigned:
+			self.stdout.write(self.style.WARNING(
+				'{} is not in any concept scheme of the file and is skipped'.format(legacy_id)))
+
+	def _report_validation(self, report):
+		self.stdout.write('concept schemes: {}'.format(report['schemes']))
+		self.stdout.write('concepts: {}'.format(report['concepts']))
+		self.stdout.write('collections: {}'.format(report['collections']))
+		for lang, count in sorted(report['labels'].items()):
+			self.stdout.write('labels ({}): {}'.format(lang, count))
+		for note_type, count in sorted(report['notes'].items()):
+			self.stdout.write('notes ({}): {}'.format(note_type, count))
+		for name, stage in report['stages'].items():
+			self.stdout.write('{}: {:.2f}s, peak memory {:.1f} MB'.format(
+				name, stage['seconds'], stage['peak_memory'] / 1024 / 1024))
+		for legacy_id, broader_id in report['dangling_broader']:
+			self.stdout.write(self.style.WARNING(
+				'Broader concept {} of {} is not found'.format(broader_id, legacy_id)))
+		for legacy_id, broader_id in report['cyclic_broader']:
+			self.stdout.write(self.style.WARNING(
+				'Broader concept {} of {} makes a cycle'.format(broader_id, legacy_id)))
+		for legacy_id in report['duplicate_legacy_ids']:
+			self.stdout.write(self.style.WARNING('Concept {} is found twice'.format(legacy_id)))
+		for legacy_id in report['unassigned']:
+			self.stdout.write(self.style.WARNING('{} is not in any concept scheme'.format(legacy_id)))
+		for notation, legacy_ids in sorted(report['notation_collisions'].items()):
+			self.stdout.write(self.style.WARNING(
+				'Notation {} is used by {}'.format(notation, ', '.join(legacy_ids))))
 
 	def handle(self, *args, **kwargs):
-		"""E.g. command: python manage.py import_skos_vocab test.ttl en ttl username"""
-		file = kwargs['file']
+		"""E.g. command: python manage.py import_skos_vocab test.ttl en ttl username
+		or python manage.py import_skos_vocab vocabularies/ en ttl username --workers 4"""
 		lang = kwargs['lang']
 		_format = kwargs['format']
 		user = kwargs['user']
-		skos_vocab = SkosImporter(
-			file=file, language=lang, file_format=_format)
-		skos_vocab.upload_data(user=user)
-		self.stdout.write(self.style.SUCCESS('Successfully imported SKOS vocabulary'))
+		workers = kwargs['workers']
+		files = self._files(kwargs['file'], _format)
+		if kwargs['dry_run']:
+			if workers <= 1:
+				reports = (validate_file(f, _format, lang, kwargs['stream']) for f in files)
+				for file, report in zip(files, reports):
+					self.stdout.write('{}:'.format(file))
+					self._report_validation(report)
+			else:
+				with ProcessPoolExecutor(max_workers=workers) as pool:
+					futures = [pool.submit(validate_file, f, _format, lang, kwargs['stream']) for f in files]
+					for file, future in zip(files, futures):
+						self.stdout.write('{}:'.format(file))
+						self._report_validation(future.result())
+			return
+		if len(files) == 1 and workers <= 1:
+			skos_vocab = SkosImporter(
+				file=files[0], language=lang, file_format=_format,
+				streaming=kwargs['stream'], chunk_size=kwargs['chunk_size'], merge=kwargs['merge'],
+				resume=kwargs['resume'], deduplicate=not kwargs['force'])
+			skos_vocab.upload_data(user=user)
+			self._report(skos_vocab)
+			self.stdout.write(self.style.SUCCESS('Successfully imported SKOS vocabulary'))
+			return
+		if kwargs['stream']:
+			raise CommandError('--stream imports one file at a time, it can not be used with several files')
+		# files are parsed in the pool and written one by one as soon as they are parsed,
+		# each file is committed in chunks and can be resumed on its own,
+		# forked workers must not share the database connection of the main process
+		connections.close_all()
+		failed = []
+		with ProcessPoolExecutor(max_workers=max(workers, 1)) as pool:
+			futures = {pool.submit(parse_file, f, _format, lang): f for f in files}
+			for future in as_completed(futures):
+				file = futures[future]
+				try:
+					concept_schemes = future.result()
+					skos_vocab = SkosImporter(
+						file=file, language=lang, file_format=_format,
+						chunk_size=kwargs['chunk_size'], merge=kwargs['merge'], resume=kwargs['resume'],
+						deduplicate=not kwargs['force'])
+					skos_vocab.upload_data(user=user, concept_schemes=concept_schemes)
+				except Exception as error:
+					failed.append(file)
+					self.stdout.write(self.style.ERROR('{}: {}'.format(file, error)))
+					continue
+				self.stdout.write('{}:'.format(file))
+				self._report(skos_vocab)
+		if failed:
+			raise CommandError('{} of {} files are not imported'.format(len(failed), len(files)))
+		self.stdout.write(self.style.SUCCESS('Successfully imported {} SKOS vocabularies'.format(len(files))))
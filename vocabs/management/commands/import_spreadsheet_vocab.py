@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from vocabs.spreadsheet_import import SpreadsheetImporter
+
+
+class Command(BaseCommand):
+
+	help = 'Imports the concept schemes of a spreadsheet (xlsx, xls or csv) to database'
+
+	def add_arguments(self, parser):
+		parser.add_argument('file', type=str,
+			help='The spreadsheet to import, see vocabs/data/spreadsheets/vocabs_sample.xlsx')
+		parser.add_argument('lang', type=str,
+			help='The main language of the vocabularies, as in the column headers (e.g. eng)')
+		parser.add_argument('user', type=str,
+			help='Username')
+		parser.add_argument('--namespace', type=str,
+			help='Namespace of the concept scheme identifiers, followed by the slug of a title')
+		parser.add_argument('--sheet', type=str, default=0,
+			help='Name of the sheet, the first one by default')
+		parser.add_argument('--chunk-size', type=int, default=1000,
+			help='Number of concepts written and committed at once')
+		parser.add_argument('--dry-run', action='store_true',
+			help='Validate the sheet and report the concept schemes without writing to the database')
+
+	def handle(self, *args, **kwargs):
+		"""E.g. command: python manage.py import_spreadsheet_vocab vocabs_sample.xlsx eng username"""
+		importer = SpreadsheetImporter(
+			file=kwargs['file'], language=kwargs['lang'], namespace=kwargs['namespace'],
+			sheet_name=kwargs['sheet'], chunk_size=kwargs['chunk_size'])
+		if kwargs['dry_run']:
+			for concept_scheme in importer.concept_schemes():
+				self.stdout.write('{}: {} concepts'.format(
+					concept_scheme['identifier'], len(concept_scheme['has_concepts'])))
+		else:
+			for scheme in importer.upload_data(user=kwargs['user']):
+				self.stdout.write('Concept scheme: {}'.format(scheme))
+			# the concept schemes are written by one importer, statistics are per table
+			for table, stat in importer.stats.items():
+				self.stdout.write('{}: {} rows ({:.0f} rows/sec)'.format(
+					table, stat['rows'], stat['rows_per_sec']))
+		for key, broader in importer.dangling_broader:
+			self.stdout.write(self.style.WARNING(
+				'Broader concept {} of {} is not found'.format(broader, key)))
+		if not kwargs['dry_run']:
+			self.stdout.write(self.style.SUCCESS('Successfully imported the spreadsheet'))
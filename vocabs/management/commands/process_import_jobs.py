@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from vocabs.import_jobs import claim_next_job, run_import_job
+
+
+class Command(BaseCommand):
+
+	help = 'Runs queued SKOS import jobs of the upload page'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--once', action='store_true',
+			help='Run the queued jobs and exit instead of waiting for new ones')
+		parser.add_argument('--sleep', type=float, default=2.0,
+			help='Seconds to wait before looking for new jobs')
+
+	def handle(self, *args, **kwargs):
+		"""E.g. command: python manage.py process_import_jobs"""
+		while True:
+			job = claim_next_job()
+			if job is None:
+				if kwargs['once']:
+					break
+				time.sleep(kwargs['sleep'])
+				continue
+			self.stdout.write('Importing {}'.format(job.file.name))
+			job = run_import_job(job)
+			if job.status == 'done':
+				self.stdout.write(self.style.SUCCESS(
+					'Imported {} ({} rows)'.format(job.scheme, job.rows_done)))
+			else:
+				self.stdout.write(self.style.ERROR(
+					'Import of {} failed: {}'.format(job.file.name, job.error)))
@@ -1,15 +1,24 @@
+import threading
+from contextlib import contextmanager
 from django.conf import settings
-from django.db import models
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, models, transaction
+from django.db.models import Max
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.functional import cached_property
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models.signals import post_delete, post_save, pre_save, m2m_changed
+from guardian.models import UserObjectPermission
 from guardian.shortcuts import assign_perm, remove_perm
 from django.dispatch import receiver
 import reversion
+from mptt.managers import TreeManager
 from mptt.models import MPTTModel, TreeForeignKey
+from . import export_cache
+from .notations import NotationAllocator
 
 
 DEFAULT_URI = "https://vocabs.acdh.oeaw.ac.at/"
@@ -138,11 +147,20 @@ class SkosConceptScheme(models.Model):
         blank=True, null=True,
         help_text="Date of official publication of this concept scheme"
     )
+    # last change of the scheme, its concepts, collections and their labels, notes and sources,
+    # cached downloads (export_cache) are keyed by it
+    date_content_modified = models.DateTimeField(
+        editable=False, default=timezone.now
+    )
     created_by = models.ForeignKey(
         User, related_name="skos_cs_created",
         blank=True, null=True,
         on_delete=models.SET_NULL
     )
+    # hash of the parsed triples of an imported file, an identical upload returns this scheme
+    content_hash = models.CharField(
+        max_length=40, blank=True, editable=False, db_index=True
+    )
     curator = models.ManyToManyField(
         User, related_name="skos_cs_curated",
         blank=True,
@@ -157,6 +175,7 @@ class SkosConceptScheme(models.Model):
         if not self.id:
             self.date_created = timezone.now()
         self.date_modified = timezone.now()
+        self.date_content_modified = self.date_modified
 
         if not self.identifier:
             self.identifier = DEFAULT_URI + slugify(self.title, allow_unicode=True)
@@ -332,6 +351,10 @@ class SkosCollection(models.Model):
     legacy_id = models.CharField(
         max_length=200, blank=True
     )
+    # hash of the imported content to find changes on re-import
+    content_hash = models.CharField(
+        max_length=40, blank=True, editable=False
+    )
     # meta autosaved fields
     date_created = models.DateTimeField(
         editable=False, default=timezone.now
@@ -485,6 +508,35 @@ class CollectionSource(models.Model):
 #
 ######################################################################
 
+class SkosConceptManager(TreeManager):
+    """
+    Tree ids of concepts are never shifted. A new root of the editor, or a concept
+    made a root, starts a tree with an id of the TreeIdCounter instead of being put
+    between the trees in the order of order_insertion_by, and a tree removed by a move
+    leaves a gap. Trees an import writes in several transactions keep their tree ids
+    """
+
+    def _get_next_tree_id(self):
+        # a new tree of the editor does not take a tree id reserved by an import
+        return reserve_tree_ids(1)
+
+    def _create_tree_space(self, target_tree_id, num_trees=1):
+        pass
+
+    def insert_node(self, node, target, position='last-child', save=False,
+                    allow_existing_pk=False, refresh_target=True):
+        if target is not None and position in ('left', 'right') and target.is_root_node():
+            target, position = None, 'last-child'
+        return super(SkosConceptManager, self).insert_node(
+            node, target, position=position, save=save,
+            allow_existing_pk=allow_existing_pk, refresh_target=refresh_target)
+
+    def _make_sibling_of_root_node(self, node, target, position):
+        # the roots are not ordered by tree id, a root stays in its tree
+        if node.is_child_node():
+            self._make_child_root_node(node)
+
+
 @reversion.register()
 class SkosConcept(MPTTModel):
     """
@@ -565,6 +617,10 @@ class SkosConcept(MPTTModel):
     ###########################################################################
     # if using legacy_id as URI change it for URLField
     legacy_id = models.CharField(max_length=200, blank=True)
+    # hash of the imported content to find changes on re-import
+    content_hash = models.CharField(
+        max_length=40, blank=True, editable=False
+    )
     creator = models.TextField(
         blank=True, verbose_name="dc:creator",
         help_text="Person or organisation that created this concept<br>"
@@ -594,8 +650,17 @@ class SkosConcept(MPTTModel):
         on_delete=models.SET_NULL
     )
 
+    objects = SkosConceptManager()
+
     class Meta:
         verbose_name = 'Concept'
+        indexes = [
+            # pattern operators let PostgreSQL use the index for notation__startswith (LIKE)
+            # in any collation, other databases ignore opclasses
+            models.Index(
+                fields=['scheme', 'notation'], name='vocabs_concept_scheme_notation',
+                opclasses=['int4_ops', 'varchar_pattern_ops']),
+        ]
 
     class MPTTMeta:
         order_insertion_by = ['pref_label']
@@ -605,20 +670,23 @@ class SkosConcept(MPTTModel):
         return "{}{}".format("https://whatever", self.get_absolute_url)
 
     def save(self, *args, **kwargs):
-        if self.notation == "":
-            temp_notation = slugify(self.pref_label, allow_unicode=True)
-            concepts = len(SkosConcept.objects.filter(notation=temp_notation))
-            if concepts < 1:
-                self.notation = temp_notation
+        with transaction.atomic():
+            if self.notation == "":
+                # the concept scheme row stays locked until the concept is saved,
+                # concurrent saves do not allocate the same notation
+                list(SkosConceptScheme.objects.select_for_update().filter(
+                    pk=self.scheme_id).values_list('pk', flat=True))
+                allocator = NotationAllocator.for_scheme(
+                    SkosConcept.objects.exclude(pk=self.pk), self.scheme_id,
+                    prefix=slugify(self.pref_label, allow_unicode=True))
+                self.notation = allocator.allocate(self.pref_label)
             else:
-                self.notation = "{}-{}".format(temp_notation, concepts)
-        else:
-            pass
+                pass
 
-        if not self.id:
-            self.date_created = timezone.now()
-        self.date_modified = timezone.now()
-        super(SkosConcept, self).save(*args, **kwargs)
+            if not self.id:
+                self.date_created = timezone.now()
+            self.date_modified = timezone.now()
+            super(SkosConcept, self).save(*args, **kwargs)
 
     # change for template tag
     def creator_as_list(self):
@@ -752,6 +820,159 @@ class ConceptSource(models.Model):
 
 
 
+######################################################################
+#
+# ImportJob
+#
+######################################################################
+
+IMPORT_JOB_STATUS = (
+    ('queued', 'queued'),
+    ('running', 'running'),
+    ('done', 'done'),
+    ('failed', 'failed'),
+)
+
+
+class ImportJob(models.Model):
+    """
+    An uploaded SKOS file waiting to be imported or being imported
+    by the process_import_jobs management command.
+    Progress is stored by the worker while the import runs,
+    a job whose worker stopped is continued by another worker.
+
+    """
+    file = models.FileField(upload_to='imports/')
+    file_format = models.CharField(
+        max_length=20, blank=True,
+        help_text="RDF format of the file"
+    )
+    language = models.CharField(
+        max_length=3,
+        help_text="Main language of the vocabulary"
+    )
+    status = models.CharField(
+        choices=IMPORT_JOB_STATUS, default='queued', max_length=10
+    )
+    phase = models.CharField(
+        max_length=20, blank=True,
+        help_text="Current phase: parse, write, tree or permissions"
+    )
+    rows_done = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # hash of the parsed triples, jobs with the same content wait for the first one
+    content_hash = models.CharField(
+        max_length=40, blank=True, editable=False, db_index=True
+    )
+    date_hashed = models.DateTimeField(
+        editable=False, blank=True, null=True
+    )
+    scheme = models.ForeignKey(
+        SkosConceptScheme, related_name="import_jobs",
+        blank=True, null=True,
+        on_delete=models.SET_NULL
+    )
+    created_by = models.ForeignKey(
+        User, related_name="import_jobs",
+        blank=True, null=True,
+        on_delete=models.SET_NULL
+    )
+    date_created = models.DateTimeField(
+        editable=False, default=timezone.now
+    )
+    date_started = models.DateTimeField(
+        editable=False, blank=True, null=True
+    )
+    # stored with the progress, a running job without it for too long is claimed again
+    date_heartbeat = models.DateTimeField(
+        editable=False, blank=True, null=True
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, editable=False)
+    date_finished = models.DateTimeField(
+        editable=False, blank=True, null=True
+    )
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Import Job'
+
+    def rows_per_sec(self):
+        if not self.date_started:
+            return 0
+        seconds = ((self.date_finished or timezone.now()) - self.date_started).total_seconds()
+        if seconds > 0:
+            return self.rows_done / seconds
+        return 0
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'phase': self.phase,
+            'rows_done': self.rows_done,
+            'rows_per_sec': round(self.rows_per_sec(), 1),
+            'error': self.error,
+            'scheme': self.scheme.get_absolute_url() if self.scheme else None,
+        }
+
+    def get_absolute_url(self):
+        return reverse('vocabs:importjob_detail', kwargs={'pk': self.id})
+
+    def __str__(self):
+        return "{} ({})".format(self.file.name, self.status)
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Progress of a chunked SKOS import: concepts of a file are committed in chunks
+    and concepts_done is committed with each chunk, so that an interrupted import
+    can be resumed. The legacy_id -> pk maps are read back from the committed rows.
+    The checkpoint is deleted when the import is finished.
+
+    """
+    key = models.CharField(
+        max_length=40, db_index=True,
+        help_text="sha1 of the imported file, its format, language and scheme identifier"
+    )
+    scheme = models.ForeignKey(
+        SkosConceptScheme, related_name="import_checkpoints",
+        on_delete=models.CASCADE
+    )
+    first_tree_id = models.PositiveIntegerField(blank=True, null=True)
+    concepts_done = models.PositiveIntegerField(default=0)
+    date_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return "{} ({} concepts done)".format(self.scheme, self.concepts_done)
+
+
+class TreeIdCounter(models.Model):
+    """
+    The last reserved tree id of concepts. An import reserves the tree ids of its trees
+    before the first chunk is committed and new trees of the editor take theirs here too
+    (see SkosConceptManager), so trees written in several transactions never share a tree id
+    """
+    last_tree_id = models.PositiveIntegerField(default=0)
+
+
+def reserve_tree_ids(count):
+    """
+    Reserves count tree ids above the tree ids of all concepts and all reserved ones,
+    returns the first one. The counter row is locked until the transaction commits
+    """
+    with transaction.atomic():
+        counter, created = TreeIdCounter.objects.select_for_update().get_or_create(pk=1)
+        used = SkosConcept.objects.aggregate(Max('tree_id'))['tree_id__max'] or 0
+        first_tree_id = max(counter.last_tree_id, used) + 1
+        if count:
+            counter.last_tree_id = first_tree_id + count - 1
+            counter.save()
+    return first_tree_id
+
+
 def get_all_children(self, include_self=True):
     # many thanks to https://stackoverflow.com/questions/4725343
     r = []
@@ -769,6 +990,50 @@ def get_all_children(self, include_self=True):
 #
 #############################################################################
 
+_bulk_import = threading.local()
+
+
+@contextmanager
+def bulk_import():
+    """
+    Suppresses the permission receivers of concepts and collections,
+    an importer assigns permissions of its objects with bulk_object_permissions
+    """
+    previous = getattr(_bulk_import, 'active', False)
+    _bulk_import.active = True
+    try:
+        yield
+    finally:
+        _bulk_import.active = previous
+
+
+def bulk_object_permissions(model, objs, scheme):
+    """
+    Returns unsaved UserObjectPermission rows of objs (concepts or collections of a scheme),
+    the same ones the post_save receivers assign: view, change and delete
+    for the creator of an object, curators and the creator of the scheme if there are curators
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    name = model.__name__.lower()
+    permissions = list(Permission.objects.filter(
+        content_type=content_type,
+        codename__in=['delete_' + name, 'change_' + name, 'view_' + name]))
+    curator_ids = list(scheme.curator.values_list('pk', flat=True))
+    if curator_ids:
+        curator_ids.append(scheme.created_by_id)
+    rows = []
+    for obj in objs:
+        user_ids = set(curator_ids)
+        user_ids.add(obj.created_by_id)
+        user_ids.discard(None)
+        for user_id in user_ids:
+            for permission in permissions:
+                rows.append(UserObjectPermission(
+                    user_id=user_id, permission=permission,
+                    content_type=content_type, object_pk=str(obj.pk)))
+    return rows
+
+
 
 @receiver(post_save, sender=SkosConceptScheme, dispatch_uid="create_perms_cs_created_by")
 def create_perms_cs_created_by(sender, instance, **kwargs):
@@ -779,6 +1044,8 @@ def create_perms_cs_created_by(sender, instance, **kwargs):
 
 @receiver(post_save, sender=SkosCollection, dispatch_uid="create_perms_collection_created_by")
 def create_perms_collection_created_by(sender, instance, **kwargs):
+    if getattr(_bulk_import, 'active', False):
+        return
     assign_perm('delete_skoscollection', instance.created_by, instance)
     assign_perm('change_skoscollection', instance.created_by, instance)
     assign_perm('view_skoscollection', instance.created_by, instance)
@@ -794,6 +1061,8 @@ def create_perms_collection_created_by(sender, instance, **kwargs):
 
 @receiver(post_save, sender=SkosConcept, dispatch_uid="create_perms_concept_created_by")
 def create_perms_concept_created_by(sender, instance, **kwargs):
+    if getattr(_bulk_import, 'active', False):
+        return
     assign_perm('delete_skosconcept', instance.created_by, instance)
     assign_perm('change_skosconcept', instance.created_by, instance)
     assign_perm('view_skosconcept', instance.created_by, instance)
@@ -840,3 +1109,98 @@ def create_perms_curator(sender, instance, **kwargs):
                 remove_perm('view_'+obj.__class__.__name__.lower(), curator, obj)
                 remove_perm('change_'+obj.__class__.__name__.lower(), curator, obj)
                 remove_perm('delete_'+obj.__class__.__name__.lower(), curator, obj)
+
+
+#############################################################################
+#
+# Modification stamps of cached downloads on signals
+#
+#############################################################################
+
+def _flush_changes():
+    pending = getattr(connection, 'vocabs_changes', None)
+    connection.vocabs_changes = None
+    if not pending:
+        return
+    scheme_ids = set(pending['schemes'])
+    for model, name in ((SkosConcept, 'concepts'), (SkosCollection, 'collections')):
+        pks = list(pending[name])
+        for i in range(0, len(pks), 500):
+            scheme_ids.update(model.objects.filter(pk__in=pks[i:i + 500]).values_list('scheme_id', flat=True))
+    scheme_ids.discard(None)
+    if scheme_ids:
+        SkosConceptScheme.objects.filter(pk__in=scheme_ids).update(date_content_modified=timezone.now())
+        export_cache.invalidate(scheme_ids)
+
+
+def content_changed(schemes=(), concepts=(), collections=()):
+    """
+    Records changes of concept schemes, by pk or through pks of their concepts or collections,
+    on the database connection. Once the transaction commits date_content_modified of the schemes
+    is set and their cached downloads are dropped, with one update for all changes of a transaction
+    """
+    pending = getattr(connection, 'vocabs_changes', None)
+    if pending is None:
+        pending = connection.vocabs_changes = {'schemes': set(), 'concepts': set(), 'collections': set()}
+    pending['schemes'].update(schemes)
+    pending['concepts'].update(concepts)
+    pending['collections'].update(collections)
+    # registered with every change: a rolled back transaction drops its hooks without notice.
+    # The first hook of a commit writes the pending changes, the others find none.
+    # Changes of a rolled back transaction are written with the next commit, which only
+    # sets the stamps and drops the cached downloads of schemes which did not change
+    transaction.on_commit(_flush_changes)
+
+
+def _changed_receiver(name, field):
+    def receiver(sender, instance, **kwargs):
+        # an importer sets the stamps of its concept schemes itself
+        if getattr(_bulk_import, 'active', False):
+            return
+        content_changed(**{name: [getattr(instance, field)]})
+    return receiver
+
+
+CHANGE_SENDERS = (
+    (SkosConceptScheme, 'schemes', 'pk'),
+    (ConceptSchemeTitle, 'schemes', 'concept_scheme_id'),
+    (ConceptSchemeDescription, 'schemes', 'concept_scheme_id'),
+    (ConceptSchemeSource, 'schemes', 'concept_scheme_id'),
+    (SkosCollection, 'schemes', 'scheme_id'),
+    (CollectionLabel, 'collections', 'collection_id'),
+    (CollectionNote, 'collections', 'collection_id'),
+    (CollectionSource, 'collections', 'collection_id'),
+    (SkosConcept, 'schemes', 'scheme_id'),
+    (ConceptLabel, 'concepts', 'concept_id'),
+    (ConceptNote, 'concepts', 'concept_id'),
+    (ConceptSource, 'concepts', 'concept_id'),
+)
+
+for _sender, _name, _field in CHANGE_SENDERS:
+    _receiver = _changed_receiver(_name, _field)
+    if _sender is not SkosConceptScheme:
+        # a concept scheme sets its stamp when it is saved
+        post_save.connect(_receiver, sender=_sender, weak=False,
+            dispatch_uid="content_changed_save_{}".format(_sender.__name__))
+    post_delete.connect(_receiver, sender=_sender, weak=False,
+        dispatch_uid="content_changed_delete_{}".format(_sender.__name__))
+
+
+def content_changed_scheme(sender, instance, **kwargs):
+    # a concept or collection moved to another concept scheme changes the one it leaves
+    if instance.pk is None or getattr(_bulk_import, 'active', False):
+        return
+    previous = sender.objects.filter(pk=instance.pk).values_list('scheme_id', flat=True).first()
+    if previous is not None and previous != instance.scheme_id:
+        content_changed(schemes=[previous])
+
+
+for _sender in SkosConcept, SkosCollection:
+    pre_save.connect(content_changed_scheme, sender=_sender,
+        dispatch_uid="content_changed_scheme_{}".format(_sender.__name__))
+
+
+@receiver(m2m_changed, sender=SkosConcept.collection.through, dispatch_uid="content_changed_members")
+def content_changed_members(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and not getattr(_bulk_import, 'active', False):
+        content_changed(schemes=[instance.scheme_id])
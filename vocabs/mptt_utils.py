@@ -0,0 +1,66 @@
+def compute_tree_fields(nodes, first_tree_id):
+	"""
+	Computes MPTT nested set values the way TreeManager.rebuild does,
+	but in memory and only for the given nodes.
+	nodes is a dictionary key -> (label, parent key or None), where
+	children and roots are ordered by label (order_insertion_by).
+	Parents which are not in nodes make a node a root.
+	Returns (fields, cut) where fields is a dictionary
+	key -> (lft, rght, tree_id, level) and cut is a list of keys whose parent link
+	had to be dropped because it is a part of a cycle
+	"""
+	children = {}
+	roots = []
+	for index, (key, (label, parent)) in enumerate(nodes.items()):
+		if parent is None or parent not in nodes:
+			roots.append((label, index, key))
+		else:
+			children.setdefault(parent, []).append((label, index, key))
+	for siblings in children.values():
+		siblings.sort()
+	roots.sort()
+
+	fields = {}
+	cut = []
+	tree_id = first_tree_id
+
+	def walk(root):
+		# iterative depth first traversal, deep trees do not hit the recursion limit
+		lft = {root: 1}
+		levels = {root: 0}
+		counter = 2
+		stack = [(root, iter(children.get(root, [])))]
+		while stack:
+			key, remaining = stack[-1]
+			child = next(remaining, None)
+			if child is None:
+				stack.pop()
+				fields[key] = (lft[key], counter, tree_id, levels[key])
+				counter += 1
+			else:
+				child_key = child[2]
+				lft[child_key] = counter
+				levels[child_key] = levels[key] + 1
+				counter += 1
+				stack.append((child_key, iter(children.get(child_key, []))))
+
+	for _label, _index, root in roots:
+		walk(root)
+		tree_id += 1
+	# nodes in a cycle, or below one, are not reachable from a root.
+	# The parents of such a node lead into the cycle, one node of the cycle
+	# becomes a root and the rest of the cycle and the nodes below it are walked from it
+	indexes = {key: index for index, key in enumerate(nodes)}
+	for key in nodes:
+		if key in fields:
+			continue
+		seen = set()
+		while key not in seen:
+			seen.add(key)
+			key = nodes[key][1]
+		label, parent = nodes[key]
+		cut.append(key)
+		children[parent].remove((label, indexes[key], key))
+		walk(key)
+		tree_id += 1
+	return fields, cut
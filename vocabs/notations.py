@@ -0,0 +1,44 @@
+from django.utils.text import slugify
+
+
+class NotationAllocator(object):
+	"""
+	Allocates default notations of concepts: the slug of the pref label,
+	followed by -1, -2, ... when the slug is taken in the concept scheme.
+	Notations allocated by one allocator are unique among each other,
+	so a batch of concepts needs only the lookup of the taken notations
+	"""
+
+	def __init__(self, taken=()):
+		self.taken = set(taken)
+		# last suffix tried per slug, a batch does not start over at -1 for every concept
+		self.suffixes = {}
+
+	@classmethod
+	def for_scheme(cls, concepts, scheme_id, prefix=None):
+		"""
+		Reads the notations of a concept scheme, with a prefix only the notations starting
+		with it. The prefix is a LIKE pattern, the (scheme, notation) index of SkosConcept
+		has pattern operators so that PostgreSQL reads the matching range of it
+		"""
+		taken = concepts.filter(scheme_id=scheme_id)
+		if prefix is not None:
+			taken = taken.filter(notation__startswith=prefix)
+		return cls(taken.values_list("notation", flat=True))
+
+	def reserve(self, notation):
+		"""
+		Marks an explicit notation as taken
+		"""
+		self.taken.add(notation)
+
+	def allocate(self, label):
+		slug = slugify(label, allow_unicode=True)
+		notation = slug
+		suffix = self.suffixes.get(slug, 0)
+		while notation in self.taken:
+			suffix += 1
+			notation = "{}-{}".format(slug, suffix)
+		self.suffixes[slug] = suffix
+		self.taken.add(notation)
+		return notation
@@ -1,6 +1,13 @@
+import re
 import rdflib
 from rdflib import Graph, Literal, Namespace, RDF, URIRef, RDFS, XSD
 from rdflib.namespace import DC, RDFS, SKOS
+from rdflib.plugins.serializers.nt import _nt_row, _quoteLiteral
+from django.db.models.query import QuerySet
+from .models import (
+	SkosConcept, SkosCollection, ConceptSchemeTitle, ConceptSchemeDescription, ConceptSchemeSource,
+	CollectionLabel, CollectionNote, CollectionSource, ConceptLabel, ConceptNote, ConceptSource
+)
 
 
 SKOS = Namespace("http://www.w3.org/2004/02/skos/core#")
@@ -10,215 +17,445 @@ RDFS = Namespace("http://www.w3.org/2000/01/rdf-schema#")
 OWL = Namespace("http://www.w3.org/2002/07/owl#")
 VOCABS = Namespace("https://vocabs.acdh.oeaw.ac.at/create-concept-scheme/")
 
+# concepts per chunk of a streamed export, every query of a chunk has its pks as parameters
+EXPORT_CHUNK_SIZE = 500
+TURTLE_PREFIXES = (
+	("skos", str(SKOS)), ("dc", str(DC)), ("dct", str(DCT)), ("rdfs", str(RDFS)),
+	("owl", str(OWL)), ("rdf", str(RDF)), ("xsd", str(XSD)),
+)
+# local names written as prefixed names, other URIs are written in full
+TURTLE_LOCAL_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_-]*$")
+
+
+def _grouped(rows, key):
+	"""
+	Returns a dictionary key of a row -> list of rows
+	"""
+	groups = {}
+	for row in rows:
+		groups.setdefault(key(row), []).append(row)
+	return groups
+
+
+class ExportPlan(object):
+	"""
+	Loads everything graph_construct_qs needs for concepts with the same number
+	of queries whatever the number of concepts: the concepts with their scheme and
+	broader concept, then one query per related table. Related rows are selected
+	with a subquery of the concepts, not with a list of pks as query parameters,
+	and grouped by the pk they belong to
+	"""
+
+	def __init__(self, results):
+		if not isinstance(results, QuerySet):
+			results = SkosConcept.objects.filter(pk__in=[obj.pk for obj in results])
+		self.concepts = list(results.select_related('scheme', 'broader_concept'))
+		pks = results.order_by().values('pk')
+		scheme_pks = results.order_by().values('scheme_id')
+		self.scheme_titles = _grouped(
+			ConceptSchemeTitle.objects.filter(concept_scheme__in=scheme_pks), lambda x: x.concept_scheme_id)
+		self.scheme_descriptions = _grouped(
+			ConceptSchemeDescription.objects.filter(concept_scheme__in=scheme_pks), lambda x: x.concept_scheme_id)
+		self.scheme_sources = _grouped(
+			ConceptSchemeSource.objects.filter(concept_scheme__in=scheme_pks), lambda x: x.concept_scheme_id)
+		# collections of the concepts
+		membership = SkosConcept.collection.through.objects
+		collection_pks = membership.filter(skosconcept__in=pks).values('skoscollection_id')
+		collections = {x.pk: x for x in SkosCollection.objects.filter(pk__in=collection_pks)}
+		self.collections = {}
+		for concept_pk, collection_pk in membership.filter(skosconcept__in=pks).order_by(
+				'skoscollection_id').values_list('skosconcept_id', 'skoscollection_id'):
+			self.collections.setdefault(concept_pk, []).append(collections[collection_pk])
+		self.collection_labels = _grouped(
+			CollectionLabel.objects.filter(collection__in=collection_pks), lambda x: x.collection_id)
+		self.collection_notes = _grouped(
+			CollectionNote.objects.filter(collection__in=collection_pks), lambda x: x.collection_id)
+		self.collection_sources = _grouped(
+			CollectionSource.objects.filter(collection__in=collection_pks), lambda x: x.collection_id)
+		# (collection pk, concept pk, legacy_id) of the members
+		self.collection_members = _grouped(
+			membership.filter(skoscollection__in=collection_pks).values_list(
+				'skoscollection_id', 'skosconcept_id', 'skosconcept__legacy_id'),
+			lambda x: x[0])
+		self.labels = _grouped(ConceptLabel.objects.filter(concept__in=pks), lambda x: x.concept_id)
+		self.notes = _grouped(ConceptNote.objects.filter(concept__in=pks), lambda x: x.concept_id)
+		self.sources = _grouped(ConceptSource.objects.filter(concept__in=pks), lambda x: x.concept_id)
+		# (broader pk, pk, legacy_id) of the narrower concepts
+		self.narrower = _grouped(
+			SkosConcept.objects.filter(broader_concept__in=pks).values_list(
+				'broader_concept_id', 'pk', 'legacy_id'),
+			lambda x: x[0])
+
+
+def _add_concept_scheme(g, plan, scheme, mainConceptScheme):
+	"""
+	Adds the triples of a concept scheme
+	"""
+	g.add((mainConceptScheme, RDF.type, SKOS.ConceptScheme))
+	# Concept Scheme properties
+	if scheme.title:
+		g.add((mainConceptScheme, DC.title, Literal(scheme.title, lang=scheme.title_lang)))
+		g.add((mainConceptScheme, RDFS.label, Literal(scheme.title, lang=scheme.title_lang)))
+	if plan.scheme_titles.get(scheme.id):
+		for title in plan.scheme_titles[scheme.id]:
+			g.add((mainConceptScheme, DC.title, Literal(title.name, lang=title.language)))
+	if plan.scheme_descriptions.get(scheme.id):
+		for desc in plan.scheme_descriptions[scheme.id]:
+			g.add((mainConceptScheme, DC.description, Literal(desc.name, lang=desc.language)))
+	if plan.scheme_sources.get(scheme.id):
+		for source in plan.scheme_sources[scheme.id]:
+			g.add((mainConceptScheme, DC.source, Literal(source.name, lang=source.language)))
+	# accessing lists with ; in TextField
+	if scheme.creator:
+		for i in scheme.creator.split(';'):
+			g.add((mainConceptScheme, DC.creator, Literal(i.strip())))
+	if scheme.contributor:
+		for i in scheme.contributor.split(';'):
+			g.add((mainConceptScheme, DC.contributor, Literal(i.strip())))
+	if scheme.language:
+		for i in scheme.language.split(';'):
+			g.add((mainConceptScheme, DC.language, Literal(i.strip())))
+	if scheme.subject:
+		for i in scheme.subject.split(';'):
+			g.add((mainConceptScheme, DC.subject, Literal(i.strip())))
+	if scheme.coverage:
+		for i in scheme.coverage.split(';'):
+			g.add((mainConceptScheme, DC.coverage, Literal(i.strip())))
+	# the rest of the properties
+	if scheme.license:
+		g.add((mainConceptScheme, DCT.license, Literal(scheme.license)))
+	if scheme.version:
+		g.add((mainConceptScheme, OWL.versionInfo, Literal(scheme.version)))
+	if scheme.publisher:
+		g.add((mainConceptScheme, DC.publisher, Literal(scheme.publisher)))
+	if scheme.relation:
+		g.add((mainConceptScheme, DC.relation, URIRef(scheme.relation)))
+	if scheme.owner:
+		g.add((mainConceptScheme, DCT.rightsHolder, Literal(scheme.owner)))
+	g.add((mainConceptScheme, DCT.created, Literal(scheme.date_created, datatype=XSD.dateTime)))
+	g.add((mainConceptScheme, DCT.modified, Literal(scheme.date_modified, datatype=XSD.dateTime)))
+	if scheme.date_issued:
+		g.add((mainConceptScheme, DCT.issued, Literal(scheme.date_issued, datatype=XSD.dateTime)))
+	else:
+		pass
+
+
+def _add_collection(g, plan, x, collection, mainConceptScheme):
+	"""
+	Adds the triples of a collection with all its members
+	"""
+	g.add((collection, RDF.type, SKOS.Collection))
+	g.add((collection, DCT.created, Literal(x.date_created, datatype=XSD.dateTime)))
+	g.add((collection, DCT.modified, Literal(x.date_modified, datatype=XSD.dateTime)))
+	if x.name:
+		g.add((collection, SKOS.prefLabel, Literal(x.name, lang=x.label_lang)))
+	# Collection labels
+	if plan.collection_labels.get(x.id):
+		for label in plan.collection_labels[x.id]:
+			if label.label_type == 'prefLabel':
+				g.add((collection, SKOS.prefLabel, Literal(label.name, lang=label.language)))
+			elif label.label_type == 'altLabel':
+				g.add((collection, SKOS.altLabel, Literal(label.name, lang=label.language)))
+			elif label.label_type == 'hiddenLabel':
+				g.add((collection, SKOS.hiddenLabel, Literal(label.name, lang=label.language)))
+			else:
+				g.add((collection, SKOS.altLabel, Literal(label.name, lang=label.language)))
+	# Collection notes
+	if plan.collection_notes.get(x.id):
+		for note in plan.collection_notes[x.id]:
+			if note.note_type == 'note':
+				g.add((collection, SKOS.note, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'scopeNote':
+				g.add((collection, SKOS.scopeNote, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'changeNote':
+				g.add((collection, SKOS.changeNote, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'editorialNote':
+				g.add((collection, SKOS.editorialNote, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'historyNote':
+				g.add((collection, SKOS.historyNote, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'definition':
+				g.add((collection, SKOS.definition, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'example':
+				g.add((collection, SKOS.example, Literal(note.name, lang=note.language)))
+			else:
+				g.add((collection, SKOS.note, Literal(note.name, lang=note.language)))
+	# Collection sources
+	if plan.collection_sources.get(x.id):
+		for source in plan.collection_sources[x.id]:
+			g.add((collection, DC.source, Literal(source.name, lang=source.language)))
+	if x.creator:
+		for i in x.creator.split(';'):
+			g.add((collection, DC.creator, Literal(i.strip())))
+	if x.contributor:
+		for i in x.contributor.split(';'):
+			g.add((collection, DC.contributor, Literal(i.strip())))
+	if plan.collection_members.get(x.id):
+		for _collection_id, member_id, member_legacy_id in plan.collection_members[x.id]:
+			if member_legacy_id:
+				g.add((collection, SKOS.member, URIRef(member_legacy_id)))
+			else:
+				g.add((collection, SKOS.member, URIRef(mainConceptScheme + "#concept" + str(member_id))))
+
+
+def _add_concept(g, plan, obj, schemes, collections):
+	"""
+	Adds the triples of a concept, and of its concept scheme and collections
+	unless their pks (schemes) or URIs (collections) are already in the sets
+	"""
+	# Creating Main Concept Scheme
+	if obj.scheme:
+		mainConceptScheme = URIRef(obj.scheme.identifier)
+		# triples of a concept scheme and a collection are added once per export
+		if obj.scheme_id not in schemes:
+			schemes.add(obj.scheme_id)
+			_add_concept_scheme(g, plan, obj.scheme, mainConceptScheme)
+	else:
+		mainConceptScheme = URIRef(VOCABS)
+		if None not in schemes:
+			schemes.add(None)
+			g.add((mainConceptScheme, RDF.type, SKOS.ConceptScheme))
+	# Concept properties
+	if obj.legacy_id:
+		concept = URIRef(obj.legacy_id)
+	else:
+		concept = URIRef(mainConceptScheme + "#concept" + str(obj.id))
+	g.add((concept, RDF.type, SKOS.Concept))
+	g.add((concept, SKOS.prefLabel, Literal(obj.pref_label, lang=obj.pref_label_lang)))
+	g.add((concept, SKOS.notation, Literal(obj.notation)))
+	# each concept must have skos:inScheme mainConceptScheme
+	g.add((concept, SKOS.inScheme, mainConceptScheme))
+	if plan.collections.get(obj.id):
+		for x in plan.collections[obj.id]:
+			collection = URIRef(mainConceptScheme + "#collection" + str(x.id))
+			if collection not in collections:
+				collections.add(collection)
+				_add_collection(g, plan, x, collection, mainConceptScheme)
+	# Concept properties
+	if plan.labels.get(obj.id):
+		for label in plan.labels[obj.id]:
+			if label.label_type == 'prefLabel':
+				g.add((concept, SKOS.prefLabel, Literal(label.name, lang=label.language)))
+			elif label.label_type == 'altLabel':
+				g.add((concept, SKOS.altLabel, Literal(label.name, lang=label.language)))
+			elif label.label_type == 'hiddenLabel':
+				g.add((concept, SKOS.hiddenLabel, Literal(label.name, lang=label.language)))
+			# if label.label_type is not set then make it altLabel
+			else:
+				g.add((concept, SKOS.altLabel, Literal(label.name, lang=label.language)))
+	if plan.notes.get(obj.id):
+		for note in plan.notes[obj.id]:
+			if note.note_type == 'note':
+				g.add((concept, SKOS.note, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'scopeNote':
+				g.add((concept, SKOS.scopeNote, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'changeNote':
+				g.add((concept, SKOS.changeNote, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'editorialNote':
+				g.add((concept, SKOS.editorialNote, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'historyNote':
+				g.add((concept, SKOS.historyNote, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'definition':
+				g.add((concept, SKOS.definition, Literal(note.name, lang=note.language)))
+			elif note.note_type == 'example':
+				g.add((concept, SKOS.example, Literal(note.name, lang=note.language)))
+			else:
+				g.add((concept, SKOS.note, Literal(note.name, lang=note.language)))
+	if plan.sources.get(obj.id):
+		for source in plan.sources[obj.id]:
+			g.add((concept, DC.source, Literal(source.name, lang=source.language)))
+	#top concepts
+	if not obj.broader_concept:
+		g.add((mainConceptScheme, SKOS.hasTopConcept, URIRef(concept)))
+		g.add((concept, SKOS.topConceptOf, mainConceptScheme ))
+	# modelling broader/narrower relationships
+	if obj.broader_concept:
+		if obj.broader_concept.legacy_id:
+			g.add((concept, SKOS.broader, URIRef(obj.broader_concept.legacy_id)))
+		else:
+			g.add((concept, SKOS.broader, URIRef(mainConceptScheme + "#concept"+ str(obj.broader_concept.id))))
+	if plan.narrower.get(obj.id):
+		for _broader_id, narrower_id, narrower_legacy_id in plan.narrower[obj.id]:
+			if narrower_legacy_id:
+				g.add((concept, SKOS.narrower, URIRef(narrower_legacy_id)))
+			else:
+				g.add((concept, SKOS.narrower, URIRef(mainConceptScheme + "#concept" + str(narrower_id))))
+	# modelling external matches
+	# skos:related
+	if obj.related:
+		for x in obj.related_as_list():
+			g.add((concept, SKOS.related, URIRef(x)))
+	# skos:broadMatch
+	if obj.broad_match:
+		for x in obj.broad_match_as_list():
+			g.add((concept, SKOS.broadMatch, URIRef(x)))
+	# skos:narrowMatch
+	if obj.narrow_match:
+		for x in obj.narrow_match_as_list():
+			g.add((concept, SKOS.narrowMatch, URIRef(x)))
+	# skos:exactMatch
+	if obj.exact_match:
+		for x in obj.exact_match_as_list():
+			g.add((concept, SKOS.exactMatch, URIRef(x)))
+	# skos:relatedMatch
+	if obj.related_match:
+		for x in obj.related_match_as_list():
+			g.add((concept, SKOS.relatedMatch, URIRef(x)))
+	# skos:closeMatch
+	if obj.close_match:
+		for x in obj.close_match_as_list():
+			g.add((concept, SKOS.closeMatch, URIRef(x)))
+	# meta
+	if obj.creator:
+		for i in obj.creator.split(';'):
+			g.add((concept, DC.creator, Literal(i.strip())))
+	if obj.contributor:
+		for i in obj.contributor.split(';'):
+			g.add((concept, DC.contributor, Literal(i.strip())))
+	if obj.date_created:
+		g.add((concept, DCT.created, Literal(obj.date_created, datatype=XSD.dateTime)))
+	if obj.date_modified:
+		g.add((concept, DCT.modified, Literal(obj.date_modified, datatype=XSD.dateTime)))
+
 
 def graph_construct_qs(results):
+	"""
+	Builds a graph of concepts (a queryset or a list), their concept schemes and collections,
+	see ExportPlan for the queries
+	"""
+	plan = ExportPlan(results)
 	g = rdflib.Graph()
 	g.bind('skos', SKOS)
 	g.bind('dc', DC)
 	g.bind('dct', DCT)
 	g.bind('rdfs', RDFS)
 	g.bind('owl', OWL)             
-	for obj in results:
-		# Creating Main Concept Scheme
-		if obj.scheme:
-			mainConceptScheme = URIRef(obj.scheme.identifier)
-			g.add((mainConceptScheme, RDF.type, SKOS.ConceptScheme))
-			# Concept Scheme properties
-			if obj.scheme.title:
-				g.add((mainConceptScheme, DC.title, Literal(obj.scheme.title, lang=obj.scheme.title_lang)))
-				g.add((mainConceptScheme, RDFS.label, Literal(obj.scheme.title, lang=obj.scheme.title_lang)))
-			if obj.scheme.has_titles.all():
-				for title in obj.scheme.has_titles.all():
-					g.add((mainConceptScheme, DC.title, Literal(title.name, lang=title.language)))
-			if obj.scheme.has_descriptions.all():
-				for desc in obj.scheme.has_descriptions.all():
-					g.add((mainConceptScheme, DC.description, Literal(desc.name, lang=desc.language)))
-			if obj.scheme.has_sources.all():
-				for source in obj.scheme.has_sources.all():
-					g.add((mainConceptScheme, DC.source, Literal(source.name, lang=source.language)))
-			# accessing lists with ; in TextField
-			if obj.scheme.creator:
-				for i in obj.scheme.creator.split(';'):              
-					g.add((mainConceptScheme, DC.creator, Literal(i.strip())))
-			if obj.scheme.contributor:
-				for i in obj.scheme.contributor.split(';'):              
-					g.add((mainConceptScheme, DC.contributor, Literal(i.strip())))
-			if obj.scheme.language:
-				for i in obj.scheme.language.split(';'):             
-					g.add((mainConceptScheme, DC.language, Literal(i.strip())))
-			if obj.scheme.subject:
-				for i in obj.scheme.subject.split(';'):              
-					g.add((mainConceptScheme, DC.subject, Literal(i.strip())))
-			if obj.scheme.coverage:
-				for i in obj.scheme.coverage.split(';'):              
-					g.add((mainConceptScheme, DC.coverage, Literal(i.strip())))
-		# the rest of the properties
-			if obj.scheme.license:
-				g.add((mainConceptScheme, DCT.license, Literal(obj.scheme.license)))
-			if obj.scheme.version:
-				g.add((mainConceptScheme, OWL.versionInfo, Literal(obj.scheme.version)))
-			if obj.scheme.publisher:
-				g.add((mainConceptScheme, DC.publisher, Literal(obj.scheme.publisher)))
-			if obj.scheme.relation:
-				g.add((mainConceptScheme, DC.relation, URIRef(obj.scheme.relation)))
-			if obj.scheme.owner:
-				g.add((mainConceptScheme, DCT.rightsHolder, Literal(obj.scheme.owner)))
-			g.add((mainConceptScheme, DCT.created, Literal(obj.scheme.date_created, datatype=XSD.dateTime)))
-			g.add((mainConceptScheme, DCT.modified, Literal(obj.scheme.date_modified, datatype=XSD.dateTime)))
-			if obj.scheme.date_issued:
-				g.add((mainConceptScheme, DCT.issued, Literal(obj.scheme.date_issued, datatype=XSD.dateTime)))
-			else:
-				pass   
-		else:
-			mainConceptScheme = URIRef(VOCABS)
-			g.add((mainConceptScheme, RDF.type, SKOS.ConceptScheme))
-		# Concept properties
-		if obj.legacy_id:
-			concept = URIRef(obj.legacy_id)
-		else:
-			concept = URIRef(mainConceptScheme + "#concept" + str(obj.id))
-		g.add((concept, RDF.type, SKOS.Concept))
-		g.add((concept, SKOS.prefLabel, Literal(obj.pref_label, lang=obj.pref_label_lang)))
-		g.add((concept, SKOS.notation, Literal(obj.notation)))
-		# each concept must have skos:inScheme mainConceptScheme
-		g.add((concept, SKOS.inScheme, mainConceptScheme))
-		if obj.collection.all():
-			for x in obj.collection.all():
-				collection = URIRef(mainConceptScheme + "#collection" + str(x.id))
-				g.add((collection, RDF.type, SKOS.Collection))
-				g.add((collection, DCT.created, Literal(x.date_created, datatype=XSD.dateTime)))
-				g.add((collection, DCT.modified, Literal(x.date_modified, datatype=XSD.dateTime)))
-				if x.name:
-					g.add((collection, SKOS.prefLabel, Literal(x.name, lang=x.label_lang)))
-				# Collection labels
-				if x.has_labels.all():
-					for label in x.has_labels.all():
-						if label.label_type == 'prefLabel':
-							g.add((collection, SKOS.prefLabel, Literal(label.name, lang=label.language)))
-						elif label.label_type == 'altLabel':
-							g.add((collection, SKOS.altLabel, Literal(label.name, lang=label.language)))
-						elif label.label_type == 'hiddenLabel':
-							g.add((collection, SKOS.hiddenLabel, Literal(label.name, lang=label.language)))
-						else:
-							g.add((collection, SKOS.altLabel, Literal(label.name, lang=label.language)))
-				# Collection notes
-				if x.has_notes.all():
-					for note in x.has_notes.all():
-						if note.note_type == 'note':
-							g.add((collection, SKOS.note, Literal(note.name, lang=note.language)))
-						elif note.note_type == 'scopeNote':
-							g.add((collection, SKOS.scopeNote, Literal(note.name, lang=note.language)))
-						elif note.note_type == 'changeNote':
-							g.add((collection, SKOS.changeNote, Literal(note.name, lang=note.language)))
-						elif note.note_type == 'editorialNote':
-							g.add((collection, SKOS.editorialNote, Literal(note.name, lang=note.language)))
-						elif note.note_type == 'historyNote':
-							g.add((collection, SKOS.historyNote, Literal(note.name, lang=note.language)))
-						elif note.note_type == 'definition':
-							g.add((collection, SKOS.definition, Literal(note.name, lang=note.language)))
-						elif note.note_type == 'example':
-							g.add((collection, SKOS.example, Literal(note.name, lang=note.language)))
-						else:
-							g.add((collection, SKOS.note, Literal(note.name, lang=note.language)))
-				# Collection sources
-				if x.has_sources.all():
-					for source in x.has_sources.all():
-						g.add((collection, DC.source, Literal(source.name, lang=source.language)))
-				if x.creator:
-					for i in x.creator.split(';'):              
-						g.add((collection, DC.creator, Literal(i.strip())))
-				if x.contributor:
-					for i in x.contributor.split(';'):              
-						g.add((collection, DC.contributor, Literal(i.strip())))
-				if x.has_members.all():
-					for y in x.has_members.all():
-						if y.legacy_id:
-							g.add((collection, SKOS.member, URIRef(y.legacy_id)))
-						else:
-							g.add((collection, SKOS.member, URIRef(mainConceptScheme + "#concept" + str(y.id))))
-		# Concept properties
-		if obj.has_labels.all():
-			for label in obj.has_labels.all():
-				if label.label_type == 'prefLabel':
-					g.add((concept, SKOS.prefLabel, Literal(label.name, lang=label.language)))
-				elif label.label_type == 'altLabel':
-					g.add((concept, SKOS.altLabel, Literal(label.name, lang=label.language)))
-				elif label.label_type == 'hiddenLabel':
-					g.add((concept, SKOS.hiddenLabel, Literal(label.name, lang=label.language)))
-				# if label.label_type is not set then make it altLabel
-				else:
-					g.add((concept, SKOS.altLabel, Literal(label.name, lang=label.language)))
-		if obj.has_notes.all():
-			for note in obj.has_notes.all():
-				if note.note_type == 'note':
-					g.add((concept, SKOS.note, Literal(note.name, lang=note.language)))
-				elif note.note_type == 'scopeNote':
-					g.add((concept, SKOS.scopeNote, Literal(note.name, lang=note.language)))
-				elif note.note_type == 'changeNote':
-					g.add((concept, SKOS.changeNote, Literal(note.name, lang=note.language)))
-				elif note.note_type == 'editorialNote':
-					g.add((concept, SKOS.editorialNote, Literal(note.name, lang=note.language)))
-				elif note.note_type == 'historyNote':
-					g.add((concept, SKOS.historyNote, Literal(note.name, lang=note.language)))
-				elif note.note_type == 'definition':
-					g.add((concept, SKOS.definition, Literal(note.name, lang=note.language)))
-				elif note.note_type == 'example':
-					g.add((concept, SKOS.example, Literal(note.name, lang=note.language)))
-				else:
-					g.add((concept, SKOS.note, Literal(note.name, lang=note.language)))
-		if obj.has_sources.all():
-			for source in obj.has_sources.all():
-				g.add((concept, DC.source, Literal(source.name, lang=source.language)))
-		#top concepts
-		if not obj.broader_concept:
-			g.add((mainConceptScheme, SKOS.hasTopConcept, URIRef(concept)))
-			g.add((concept, SKOS.topConceptOf, mainConceptScheme ))
-		# modelling broader/narrower relationships
-		if obj.broader_concept:
-			if obj.broader_concept.legacy_id:
-				g.add((concept, SKOS.broader, URIRef(obj.broader_concept.legacy_id)))
-			else:
-				g.add((concept, SKOS.broader, URIRef(mainConceptScheme + "#concept"+ str(obj.broader_concept.id))))
-		if obj.narrower_concepts.all():
-			for x in obj.narrower_concepts.all():
-				if x.legacy_id:
-					g.add((concept, SKOS.narrower, URIRef(x.legacy_id)))
-				else:
-					g.add((concept, SKOS.narrower, URIRef(mainConceptScheme + "#concept" + str(x.id))))
-		# modelling external matches
-		# skos:related
-		if obj.related:
-			for x in obj.related_as_list():
-				g.add((concept, SKOS.related, URIRef(x)))
-		# skos:broadMatch
-		if obj.broad_match:
-			for x in obj.broad_match_as_list():
-				g.add((concept, SKOS.broadMatch, URIRef(x)))
-		# skos:narrowMatch
-		if obj.narrow_match:
-			for x in obj.narrow_match_as_list():
-				g.add((concept, SKOS.narrowMatch, URIRef(x)))
-		# skos:exactMatch
-		if obj.exact_match:
-			for x in obj.exact_match_as_list():
-				g.add((concept, SKOS.exactMatch, URIRef(x)))
-		# skos:relatedMatch
-		if obj.related_match:
-			for x in obj.related_match_as_list():
-				g.add((concept, SKOS.relatedMatch, URIRef(x)))
-		# skos:closeMatch
-		if obj.close_match:
-			for x in obj.close_match_as_list():
-				g.add((concept, SKOS.closeMatch, URIRef(x)))
-		# meta
-		if obj.creator:
-			for i in obj.creator.split(';'):
-				g.add((concept, DC.creator, Literal(i.strip())))
-		if obj.contributor:
-			for i in obj.contributor.split(';'):
-				g.add((concept, DC.contributor, Literal(i.strip())))
-		if obj.date_created:
-			g.add((concept, DCT.created, Literal(obj.date_created, datatype=XSD.dateTime)))
-		if obj.date_modified:
-			g.add((concept, DCT.modified, Literal(obj.date_modified, datatype=XSD.dateTime)))
+	schemes = set()
+	collections = set()
+	for obj in plan.concepts:
+		_add_concept(g, plan, obj, schemes, collections)
 	return g
+
+
+class TripleBuffer(object):
+	"""
+	Collects triples with the add method of a graph, in order and without duplicates
+	"""
+
+	def __init__(self):
+		self.triples = {}
+
+	def add(self, triple):
+		self.triples[triple] = None
+
+	def __iter__(self):
+		return iter(self.triples)
+
+	def __len__(self):
+		return len(self.triples)
+
+
+def iter_triple_chunks(results, chunk_size=EXPORT_CHUNK_SIZE):
+	"""
+	Yields the triples of graph_construct_qs for chunks of at most chunk_size concepts.
+	The pks of the concepts are read with an iterator and every chunk has its own ExportPlan,
+	so only one chunk is in memory. Concept schemes and collections are in the first chunk
+	with one of their concepts
+	"""
+	if not isinstance(results, QuerySet):
+		results = SkosConcept.objects.filter(pk__in=[obj.pk for obj in results])
+	schemes = set()
+	collections = set()
+	pks = []
+	for pk in results.values_list('pk', flat=True).iterator():
+		pks.append(pk)
+		if len(pks) >= chunk_size:
+			yield _chunk_triples(pks, schemes, collections)
+			pks = []
+	if pks:
+		yield _chunk_triples(pks, schemes, collections)
+
+
+def _chunk_triples(pks, schemes, collections):
+	plan = ExportPlan(SkosConcept.objects.filter(pk__in=pks))
+	triples = TripleBuffer()
+	for obj in plan.concepts:
+		_add_concept(triples, plan, obj, schemes, collections)
+	return triples
+
+
+def _ntriples_chunk(triples):
+	return "".join(_nt_row(triple) for triple in triples)
+
+
+def _turtle_term(term):
+	if isinstance(term, URIRef):
+		for prefix, namespace in TURTLE_PREFIXES:
+			if term.startswith(namespace) and TURTLE_LOCAL_NAME.match(term[len(namespace):]):
+				return "{}:{}".format(prefix, term[len(namespace):])
+	if isinstance(term, Literal):
+		# quoted like N-Triples, without the long strings of Literal.n3
+		return _quoteLiteral(term)
+	return term.n3()
+
+
+def _turtle_chunk(triples):
+	"""
+	Returns Turtle of triples grouped by subject. A subject, e.g. a concept scheme
+	with its top concepts, can have a group in several chunks
+	"""
+	lines = []
+	for subject, group in _grouped(triples, lambda x: x[0]).items():
+		properties = " ;\n    ".join(
+			"{} {}".format("a" if p == RDF.type else _turtle_term(p), _turtle_term(o))
+			for _s, p, o in group)
+		lines.append("{}\n    {} .\n\n".format(_turtle_term(subject), properties))
+	return "".join(lines)
+
+
+TURTLE_HEADER = "".join(
+	"@prefix {}: <{}> .\n".format(prefix, namespace) for prefix, namespace in TURTLE_PREFIXES) + "\n"
+# formats written chunk by chunk of concepts: (text before the first chunk, writer of a chunk)
+STREAMING_FORMATS = {
+	"turtle": (TURTLE_HEADER, _turtle_chunk),
+	"nt": ("", _ntriples_chunk),
+}
+# formats of exports: (content type, file extension), other rdflib formats are written like pretty-xml
+EXPORT_FORMATS = {
+	"pretty-xml": ("application/xml; charset=utf-8", "rdf"),
+	"turtle": ("text/turtle; charset=utf-8", "ttl"),
+	"nt": ("application/n-triples; charset=utf-8", "nt"),
+	"json-ld": ("application/ld+json; charset=utf-8", "jsonld"),
+}
+
+
+class ConceptExport(object):
+	"""
+	Export of concepts (a queryset or a list) in a format, iterating over it yields bytes:
+	Turtle and N-Triples chunk by chunk of concepts (see iter_triple_chunks), so the first chunk
+	is written before the rest of the concepts is read, other formats are serialized
+	from graph_construct_qs at once. The number of triples is in self.triples afterwards
+	"""
+
+	def __init__(self, results, file_format, chunk_size=EXPORT_CHUNK_SIZE):
+		self.results = results
+		self.file_format = file_format
+		self.chunk_size = chunk_size
+		self.triples = 0
+
+	@property
+	def streaming(self):
+		return self.file_format in STREAMING_FORMATS
+
+	def __iter__(self):
+		self.triples = 0
+		if self.streaming:
+			header, write_chunk = STREAMING_FORMATS[self.file_format]
+			if header:
+				yield header.encode("utf-8")
+			for triples in iter_triple_chunks(self.results, self.chunk_size):
+				self.triples += len(triples)
+				yield write_chunk(triples).encode("utf-8")
+		else:
+			g = graph_construct_qs(self.results)
+			self.triples = len(g)
+			yield g.serialize(format=self.file_format)
@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.db import connections
+from .models import SkosConcept, SkosConceptScheme
+from .rdf_utils import EXPORT_FORMATS, ConceptExport
+
+
+class _HashingFile(object):
+	"""
+	Writes to a file and keeps the sha256 and the size of what is written
+	"""
+
+	def __init__(self, f):
+		self.f = f
+		self.sha256 = hashlib.sha256()
+		self.size = 0
+
+	def write(self, data):
+		self.sha256.update(data)
+		self.size += len(data)
+		return self.f.write(data)
+
+	def flush(self):
+		self.f.flush()
+
+
+def export_file_name(scheme_pk, file_format, compress=True):
+	extension = EXPORT_FORMATS[file_format][1]
+	return "scheme-{}.{}{}".format(scheme_pk, extension, ".gz" if compress else "")
+
+
+def export_scheme(scheme_pk, file_format, directory, compress=True):
+	"""
+	Writes the concepts of a concept scheme in a format (see EXPORT_FORMATS) with the exporter
+	of the download view, rdf_utils.ConceptExport, to a file in directory, gzipped while it is written.
+	Returns the manifest entry of the file: the concept scheme, format, file name,
+	number of triples, size and sha256 of the file
+	"""
+	scheme = SkosConceptScheme.objects.get(pk=scheme_pk)
+	export = ConceptExport(SkosConcept.objects.filter(scheme=scheme), file_format)
+	name = export_file_name(scheme_pk, file_format, compress)
+	with open(os.path.join(directory, name), "wb") as f:
+		out = _HashingFile(f)
+		if compress:
+			# the time of the last change in the header, an unchanged scheme gives the same file
+			with gzip.GzipFile(
+					filename=name[:-len(".gz")], mode="wb", fileobj=out,
+					mtime=int(scheme.date_content_modified.timestamp())) as gz:
+				for chunk in export:
+					gz.write(chunk)
+		else:
+			for chunk in export:
+				out.write(chunk)
+	return {
+		"scheme": scheme.pk,
+		"identifier": scheme.identifier,
+		"title": scheme.title,
+		"date_content_modified": scheme.date_content_modified.isoformat(),
+		"format": file_format,
+		"file": name,
+		"triples": export.triples,
+		"bytes": out.size,
+		"sha256": out.sha256.hexdigest(),
+	}
+
+
+def export_schemes(scheme_pks, formats, directory, compress=True, workers=1):
+	"""
+	Writes every concept scheme in every format to directory (see export_scheme),
+	with workers > 1 in a pool of processes, a file per process at a time.
+	Yields the manifest entries in the order of the concept schemes and formats
+	"""
+	tasks = [(pk, file_format) for pk in scheme_pks for file_format in formats]
+	if workers <= 1:
+		for pk, file_format in tasks:
+			yield export_scheme(pk, file_format, directory, compress)
+		return
+	# forked workers must not share the database connection of the main process
+	connections.close_all()
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		futures = [pool.submit(export_scheme, pk, file_format, directory, compress) for pk, file_format in tasks]
+		for future in futures:
+			yield future.result()
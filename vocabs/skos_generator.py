@@ -0,0 +1,98 @@
+import random
+from collections import deque
+from rdflib import Graph, Literal, Namespace, RDF
+from rdflib.namespace import DC, SKOS
+from .skos_stream import format_name
+
+
+NOTE_TYPES = ("definition", "scopeNote", "example", "note", "historyNote", "editorialNote", "changeNote")
+
+
+def concept_parents(concepts, depth, fan_out):
+	"""
+	Lays out concepts breadth first: every concept has at most fan_out narrower
+	concepts and trees are at most depth levels deep, once a tree is full
+	the next concept starts a new one. Returns the list of parent indexes (None for top concepts)
+	"""
+	parents = []
+	levels = []
+	children = []
+	open_parents = deque()
+	for i in range(concepts):
+		while open_parents and (
+				children[open_parents[0]] >= fan_out or levels[open_parents[0]] >= depth - 1):
+			open_parents.popleft()
+		parent = open_parents[0] if open_parents else None
+		parents.append(parent)
+		levels.append(0 if parent is None else levels[parent] + 1)
+		children.append(0)
+		if parent is not None:
+			children[parent] += 1
+		open_parents.append(i)
+	return parents
+
+
+def generate_triples(
+		concepts=1000, depth=4, fan_out=10, languages=("en", "de"), notes=1,
+		collections=0, collection_size=50, namespace="http://example.org/synthetic/", seed=0):
+	"""
+	Yields triples of a synthetic SKOS vocabulary with one concept scheme.
+	Every concept has a pref label and an alt label per language and notes
+	in the first language, collections have collection_size random members.
+	The same arguments give the same vocabulary
+	"""
+	ns = Namespace(namespace)
+	rng = random.Random(seed)
+	scheme = ns["scheme"]
+	yield scheme, RDF.type, SKOS.ConceptScheme
+	for lang in languages:
+		yield scheme, DC.title, Literal("Synthetic vocabulary of {} concepts".format(concepts), lang=lang)
+	yield scheme, DC.creator, Literal("generate_skos_vocab")
+	for i, parent in enumerate(concept_parents(concepts, depth, fan_out)):
+		concept = ns["concept{}".format(i)]
+		yield concept, RDF.type, SKOS.Concept
+		yield concept, SKOS.inScheme, scheme
+		yield concept, SKOS.notation, Literal(str(i))
+		for lang in languages:
+			yield concept, SKOS.prefLabel, Literal("Concept {} {}".format(i, lang), lang=lang)
+			yield concept, SKOS.altLabel, Literal("Synonym of concept {} {}".format(i, lang), lang=lang)
+		for n in range(notes):
+			note_type = NOTE_TYPES[n % len(NOTE_TYPES)]
+			yield concept, SKOS[note_type], Literal(
+				"{} {} of concept {}".format(note_type, n, i), lang=languages[0] if languages else None)
+		if parent is None:
+			yield concept, SKOS.topConceptOf, scheme
+		else:
+			yield concept, SKOS.broader, ns["concept{}".format(parent)]
+	for j in range(collections):
+		collection = ns["collection{}".format(j)]
+		yield collection, RDF.type, SKOS.Collection
+		yield collection, SKOS.inScheme, scheme
+		for lang in languages:
+			yield collection, SKOS.prefLabel, Literal("Collection {} {}".format(j, lang), lang=lang)
+		for i in sorted(rng.sample(range(concepts), min(collection_size, concepts))):
+			yield collection, SKOS.member, ns["concept{}".format(i)]
+
+
+def write_vocab(path, file_format="nt", **kwargs):
+	"""
+	Writes a synthetic vocabulary (see generate_triples) to a file.
+	N-Triples are written line by line, other formats are serialized from a graph.
+	Returns the number of triples
+	"""
+	file_format = format_name(file_format)
+	count = 0
+	if file_format == "nt":
+		with open(path, "w", encoding="utf-8") as f:
+			for s, p, o in generate_triples(**kwargs):
+				f.write("{} {} {} .\n".format(s.n3(), p.n3(), o.n3()))
+				count += 1
+		return count
+	g = Graph()
+	g.bind("skos", SKOS)
+	g.bind("dc", DC)
+	for triple in generate_triples(**kwargs):
+		g.add(triple)
+		count += 1
+	g.serialize(destination=path, format=file_format)
+	return count
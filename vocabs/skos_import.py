@@ -1,16 +1,28 @@
 import rdflib
-from rdflib import Graph, Literal, Namespace, RDF, URIRef, RDFS, XSD
+from rdflib import ConjunctiveGraph, Graph, Literal, Namespace, RDF, URIRef, RDFS, XSD
 from rdflib.namespace import DC, RDFS, SKOS
 from rdflib.util import guess_format
 import pprint
 from .models import *
-import re
 from .forms import UploadFileForm
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseRedirect
+import hashlib
+import json
 import logging
-from django.core.exceptions import ObjectDoesNotExist
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from django.db import transaction
+from django.utils import timezone
+from guardian.models import UserObjectPermission
+from .bulk_writer import BulkWriter
+from .mptt_utils import compute_tree_fields
+from .notations import NotationAllocator
+from .skos_stream import (
+	QUAD_FORMATS, XML_FORMATS, TriplesDigest, UnsupportedRDFXML, digest_triples, document_uri, format_name,
+	group_by_subject, guess_source_format, iter_rdfxml_triples, iter_triples, open_source)
 
 logging.getLogger().setLevel(logging.INFO)
 
@@ -23,447 +35,1211 @@ OWL = Namespace("http://www.w3.org/2002/07/owl#")
 VOCABS = Namespace("https://vocabs.acdh.oeaw.ac.at/create-concept-scheme/")
 
 
+# documentary notes, field names are the note types stored in the database
+NOTE_FIELDS = (
+	"note", "definition", "scopeNote", "changeNote",
+	"editorialNote", "historyNote", "example",
+)
+
+# label fields in the order of preference
+SCHEME_LABEL_FIELDS = ("dcTitle", "rdfsLabel", "dctTitle", "prefLabel")
+CONCEPT_LABEL_FIELDS = ("prefLabel", "rdfsLabel")
+
+# predicate -> field of a subject record, DC and DCT properties share a field
+PREDICATE_FIELDS = {
+	RDF.type: "type",
+	SKOS.prefLabel: "prefLabel",
+	SKOS.altLabel: "altLabel",
+	SKOS.hiddenLabel: "hiddenLabel",
+	RDFS.label: "rdfsLabel",
+	DC.title: "dcTitle",
+	DCT.title: "dctTitle",
+	SKOS.inScheme: "inScheme",
+	SKOS.topConceptOf: "inScheme",
+	SKOS.notation: "notation",
+	SKOS.broader: "broader",
+	SKOS.member: "member",
+	DCT.license: "license",
+}
+for _field in NOTE_FIELDS:
+	PREDICATE_FIELDS[SKOS[_field]] = _field
+for _field in ("creator", "contributor", "language", "subject", "publisher", "description", "source"):
+	PREDICATE_FIELDS[DCT[_field]] = _field
+	PREDICATE_FIELDS[DC[_field]] = _field
+
+# predicates needed for the tree fields and the concept scheme of a concept
+TREE_FIELDS = {
+	predicate: field for predicate, field in PREDICATE_FIELDS.items()
+	if field in CONCEPT_LABEL_FIELDS + ("broader", "inScheme")}
+
+
+# dictionary keys compared by content_hash when a vocabulary is imported again
+CONCEPT_HASH_KEYS = (
+	"pref_label", "alt_label", "hidden_label", "note", "source",
+	"notation", "creator", "contributor", "broader_concept",
+)
+COLLECTION_HASH_KEYS = ("labels", "other_label", "note", "source")
+
+
+def _sorted_json(value):
+	if isinstance(value, list):
+		return sorted(_sorted_json(item) for item in value)
+	if isinstance(value, dict):
+		return json.dumps(value, sort_keys=True)
+	return json.dumps(value)
+
+
+def content_hash(data, keys, *extra):
+	"""
+	Returns a sha1 of the values of keys in data (and extra values),
+	the order of list items does not change the hash
+	"""
+	content = [_sorted_json(data.get(key)) for key in keys] + [_sorted_json(list(e)) for e in extra]
+	return hashlib.sha1(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def measure(stages, name):
+	"""
+	Records wall time and peak memory allocated during a stage in stages[name]
+	"""
+	tracing = tracemalloc.is_tracing()
+	if tracing:
+		tracemalloc.stop()
+	tracemalloc.start()
+	start = time.time()
+	try:
+		yield
+	finally:
+		stages[name] = {"seconds": time.time() - start, "peak_memory": tracemalloc.get_traced_memory()[1]}
+		tracemalloc.stop()
+		if tracing:
+			tracemalloc.start()
+
+
+def parse_file(file, file_format=None, language=None):
+	"""
+	Parses a SKOS file into a list of concept scheme dictionaries which can be
+	passed to SkosImporter.upload_data, runs in worker processes of a pool
+	"""
+	return SkosImporter(file=file, file_format=file_format, language=language).parse_triples()
+
+
+def validate_file(file, file_format=None, language=None, streaming=False):
+	"""
+	Returns the dry run report of a SKOS file (see SkosImporter.validate),
+	runs in worker processes of a pool
+	"""
+	return SkosImporter(file=file, file_format=file_format, language=language, streaming=streaming).validate()
+
+
 class SkosImporter(object):
 	"""
 	Perform a file parsing and importing SKOS data in database
 	"""
 
-	def __init__(self, file, file_format=None, language=None):
+	def __init__(
+			self, file, file_format=None, language=None, streaming=False, chunk_size=1000,
+			merge=False, progress=None, resume=False, deduplicate=True, on_content_hash=None):
 		self.file = file
-		self.file_format = file_format
+		# format names and extensions (rdf, nq, jsonld, ...) are mapped to rdflib parsers,
+		# without a format it is guessed from the file name
+		self.file_format = format_name(file_format) or guess_source_format(file)
 		self.language = language
+		self.streaming = streaming
+		self.chunk_size = chunk_size
+		self.merge = merge
+		self.progress = progress
+		self.resume = resume
+		# a concept scheme imported by the same user from identical triples is returned instead of written again
+		self.deduplicate = deduplicate
+		self.on_content_hash = on_content_hash
+		self.content_hash = None
+		self.duplicates = []
+		self.writer = None
+		self.stats = {}
+		self.dangling_broader = []
+		self.cyclic_broader = []
+		self.diff = {}
+		self.report = {}
+		self.schemes = []
+		self.unassigned = []
+		# what the streaming RDF/XML reader did not handle, the file is then read by rdflib
+		self.rdfxml_error = None
+		self._file_digest = None
 
-	def _graph_read(self):
-		"""
-		Parse a file in RDF Graph
-		"""
-		g = Graph()
+	def _new_graph(self):
+		if self.file_format in QUAD_FORMATS:
+			g = ConjunctiveGraph()
+		else:
+			g = Graph()
 		g.bind('skos', SKOS)
 		g.bind('dc', DC)
 		g.bind('dct', DCT)
 		g.bind('rdfs', RDFS)
-		g.parse(self.file, format=self.file_format)
 		return g
 
+	def _graph_read(self):
+		"""
+		Parse a file in RDF Graph, compressed files are decompressed while they are read.
+		RDF/XML is read with the streaming reader, documents it does not handle with rdflib
+		"""
+		g = self._new_graph()
+		# relative URIs are resolved against the file, whichever parser reads it
+		base = document_uri(self.file)
+		if self.file_format in XML_FORMATS and self.rdfxml_error is None:
+			try:
+				with open_source(self.file) as f:
+					for triple in iter_rdfxml_triples(f, base):
+						g.add(triple)
+				return g
+			except UnsupportedRDFXML as error:
+				logging.info("Parsing RDF/XML with rdflib: {}".format(error))
+				self.rdfxml_error = error
+				g = self._new_graph()
+		with open_source(self.file) as f:
+			g.parse(source=f, format=self.file_format, publicID=base or None)
+		return g
+
+	def _hash_schemes(self, digest, schemes):
+		"""
+		Sets the hash of the parsed triples of the file and the content hash
+		of every concept scheme (with the language and the identifier of the scheme)
+		"""
+		self.content_hash = digest.hexdigest()
+		for identifier, concept_scheme in schemes.items():
+			concept_scheme["content_hash"] = hashlib.sha1("{}|{}|{}".format(
+				self.content_hash, self.language, identifier).encode("utf-8")).hexdigest()
+
+	def _progress(self, phase):
+		"""
+		Reports the phase (parse, write, tree or permissions) and the number
+		of rows written so far to the progress callback
+		"""
+		if self.progress is not None:
+			rows = 0
+			if self.writer is not None:
+				rows = sum(stat["rows"] for stat in self.writer.stats.values())
+			self.progress(phase, rows)
+
+	def _language_check(self, value):
+		"""Check for language attributes, if they are absent set language to a specified language"""
+		language = getattr(value, "language", None)
+		if language:
+			return str(language)
+		else:
+			return self.language
+
+	def _subject_record(self, g, subject, dispatch=PREDICATE_FIELDS):
+		"""
+		Returns the record of a subject: field -> list of objects,
+		only predicates from the dispatch table are kept
+		"""
+		record = {}
+		for p, o in g.predicate_objects(subject):
+			field = dispatch.get(p)
+			if field is None:
+				continue
+			values = record.get(field)
+			if values is None:
+				record[field] = [o]
+			else:
+				values.append(o)
+		return record
+
+	def _preferred_labels(self, record, fields):
+		"""
+		Returns values of the first label field which has any,
+		the same way Graph.preferredLabel does
+		"""
+		for field in fields:
+			if field in record:
+				return record[field]
+		return []
+
+	def _labels(self, labels):
+		return [{"label": str(label), "lang": self._language_check(label)} for label in labels]
+
+	def _texts(self, record, field):
+		return [{"name": str(value), "lang": self._language_check(value)} for value in record.get(field, [])]
+
+	def _notes(self, record):
+		return [
+			{"name": str(note), "lang": self._language_check(note), "note_type": note_type}
+			for note_type in NOTE_FIELDS for note in record.get(note_type, [])]
+
 	def parse_triples(self):
 		"""
-		Reads graph, finds triples about concept scheme and its concepts,
-		returns a dictionary
+		Reads graph, finds triples about concept schemes and their concepts,
+		returns a list of dictionaries with all concepts of a scheme in has_concepts
+		"""
+		concept_schemes = []
+		for concept_scheme, concept_chunks in self.graph_concept_schemes():
+			concept_scheme["has_concepts"] = [concept for chunk in concept_chunks for concept in chunk]
+			concept_schemes.append(concept_scheme)
+		return concept_schemes
+
+	def _schemes_of(self, values, identifiers):
+		"""
+		Returns the identifiers of the concept schemes of the file an object belongs to
+		(values of skos:inScheme, skos:topConceptOf or the schemes of collection members).
+		Everything belongs to the only concept scheme of a file
+		"""
+		if len(identifiers) == 1:
+			return identifiers
+		schemes = []
+		for value in values:
+			if str(value) in identifiers and str(value) not in schemes:
+				schemes.append(str(value))
+		return schemes
+
+	def _warn_unassigned(self):
+		if self.unassigned:
+			logging.warning("{} concepts and collections are not in any concept scheme of the file".format(
+				len(self.unassigned)))
+
+	def _build_scheme(self, cs, record):
+		"""
+		Builds a concept scheme dictionary from a subject record
 		"""
 		concept_scheme = {}
-		g = self._graph_read()
-		def allowProperties(_property):
-			"""Allow DC and DCT properties"""
-			properties = [URIRef('http://purl.org/dc/terms/{}'.format(_property)),
-				URIRef('http://purl.org/dc/elements/1.1/{}'.format(_property))]
-			return properties
-		def languageCheck(property_lang):
-			"""Check for language attributes, if they are absent set language to a specified language"""
-			if property_lang:
-				if str(property_lang) == "None":
-					return self.language
-				else:
-					return str(property_lang)
-			else:
-				return self.language
-
-		# parsing concept scheme
-
-		if (None, RDF.type, SKOS.ConceptScheme) in g:
-			for cs in g.subjects(RDF.type, SKOS.ConceptScheme):
-				concept_scheme["identifier"] = str(cs)
-				titles = []
-				# Set labels properties to recognize all possible labels
-				for title in g.preferredLabel(cs, labelProperties=((DC.title), (RDFS.label), (DCT.title), (SKOS.prefLabel))):
-					temp_title = {}
-					temp_title["title"] = str(title[1])
-					# If language attribute is absent populate it with a specified language
-					if str(title[1].language) == "None":
-						temp_title["lang"] = self.language
-					else:
-						temp_title["lang"] = str(title[1].language)
-					titles.append(temp_title)
-				concept_scheme["title"] = titles
-				concept_scheme["creator"] = ";".join([c for cp in allowProperties('creator') for c in g.objects(cs, cp)])
-				concept_scheme["contributor"] = ";".join([contr for contrp in allowProperties('contributor') for contr in g.objects(cs, contrp)])
-				concept_scheme["language"] = ";".join([l for lp in allowProperties('language') for l in g.objects(cs, lp)])
-				concept_scheme["subject"] = ";".join([s for sp in allowProperties('subject') for s in g.objects(cs, sp)])
-				concept_scheme["publisher"] = ";".join([p for pp in allowProperties('publisher') for p in g.objects(cs, pp)])
-				for license in g.objects(cs, DCT.license):
-					concept_scheme["license"] = str(license)
-				descriptions = []
-				for descp in allowProperties('description'):
-					for d in  g.objects(cs, descp):
-						temp_desc = {}
-						temp_desc["name"] = str(d)
-						temp_desc["lang"] = languageCheck(d.language)
-						descriptions.append(temp_desc)
-				concept_scheme["description"] = descriptions
-				sources = []
-				for sp in allowProperties('source'):
-					for s in  g.objects(cs, sp):
-						temp_s = {}
-						temp_s["name"] = str(s)
-						temp_s["lang"] = languageCheck(s.language)
-						sources.append(temp_s)
-				concept_scheme["source"] = sources
+		concept_scheme["identifier"] = str(cs)
+		titles = []
+		# Set labels properties to recognize all possible labels
+		for title in self._preferred_labels(record, SCHEME_LABEL_FIELDS):
+			# If language attribute is absent populate it with a specified language
+			titles.append({"title": str(title), "lang": self._language_check(title)})
+		concept_scheme["title"] = titles
+		concept_scheme["creator"] = ";".join(record.get("creator", []))
+		concept_scheme["contributor"] = ";".join(record.get("contributor", []))
+		concept_scheme["language"] = ";".join(record.get("language", []))
+		concept_scheme["subject"] = ";".join(record.get("subject", []))
+		concept_scheme["publisher"] = ";".join(record.get("publisher", []))
+		for license in record.get("license", []):
+			concept_scheme["license"] = str(license)
+		concept_scheme["description"] = self._texts(record, "description")
+		concept_scheme["source"] = self._texts(record, "source")
+		return concept_scheme
 
-		else:
+	def _build_collection(self, col, record):
+		"""
+		Builds a collection dictionary from a subject record
+		"""
+		collection = {}
+		collection["legacy_id"] = str(col)
+		collection["labels"] = [
+			{"label": str(label), "label_lang": self._language_check(label)}
+			for label in self._preferred_labels(record, SCHEME_LABEL_FIELDS)]
+		collection["members"] = [str(member) for member in record.get("member", [])]
+		# collection notes
+		collection["note"] = self._notes(record)
+		# collection other labels
+		col_labels = []
+		for label_type in ("altLabel", "hiddenLabel"):
+			for other_label in record.get(label_type, []):
+				col_labels.append({
+					"name": str(other_label), "lang": self._language_check(other_label),
+					"label_type": label_type})
+		collection["other_label"] = col_labels
+		# collection sources
+		collection["source"] = self._texts(record, "source")
+		return collection
+
+	def _build_concept(self, c, record):
+		"""
+		Builds a concept dictionary from a subject record
+		"""
+		concept = {}
+		concept["legacy_id"] = str(c)
+		# pref labels
+		concept["pref_label"] = self._labels(self._preferred_labels(record, CONCEPT_LABEL_FIELDS))
+		for scheme in record.get("inScheme", []):
+			concept["scheme"] = str(scheme)
+		for notation in record.get("notation", []):
+			concept["notation"] = str(notation)
+		concept["creator"] = ";".join(record.get("creator", []))
+		concept["contributor"] = ";".join(record.get("contributor", []))
+		for broader_concept in record.get("broader", []):
+			concept["broader_concept"] = str(broader_concept)
+		# alt labels
+		concept["alt_label"] = self._labels(record.get("altLabel", []))
+		# hidden labels
+		concept["hidden_label"] = self._labels(record.get("hiddenLabel", []))
+		# sources
+		concept["source"] = self._texts(record, "source")
+		# documentary notes
+		concept["note"] = self._notes(record)
+		return concept
+
+	def graph_concept_schemes(self):
+		"""
+		Reads the graph and returns (concept scheme dictionary with collections,
+		generator of lists of at most chunk_size concept dictionaries) for every
+		concept scheme, concepts and collections are partitioned by skos:inScheme.
+		Concepts are built from the graph chunk by chunk while they are written,
+		so only the graph and one chunk are in memory.
+		Tree nodes of the concepts of a scheme are kept in self.graph_tree_nodes[identifier]
+		"""
+		g = self._graph_read()
+		digest = TriplesDigest()
+		for triple in g:
+			digest.update(triple)
+		schemes = OrderedDict()
+		# parsing concept schemes
+		for cs in sorted(set(g.subjects(RDF.type, SKOS.ConceptScheme)), key=str):
+			concept_scheme = self._build_scheme(cs, self._subject_record(g, cs))
+			logging.info("Concept Scheme: {}".format(concept_scheme))
+			schemes[concept_scheme["identifier"]] = concept_scheme
+		if not schemes:
 			raise Exception("rdf:type skos:ConceptScheme is not found")
+		self._hash_schemes(digest, schemes)
+		identifiers = list(schemes)
+		self.unassigned = []
 
-		logging.info("Concept Scheme: {}".format(concept_scheme))
+		# Parsing concepts triples, the order of a graph differs from parse to parse
+
+		concepts = {identifier: [] for identifier in identifiers}
+		concept_schemes = {}
+		self.graph_tree_nodes = {identifier: {} for identifier in identifiers}
+		for c in sorted(set(g.subjects(RDF.type, SKOS.Concept)), key=str):
+			record = self._subject_record(g, c, TREE_FIELDS)
+			in_schemes = self._schemes_of(record.get("inScheme", []), identifiers)
+			if not in_schemes:
+				self.unassigned.append(str(c))
+				continue
+			node = self._tree_node({
+				"pref_label": self._labels(self._preferred_labels(record, CONCEPT_LABEL_FIELDS)),
+				"broader_concept": str(record["broader"][-1]) if record.get("broader") else None})
+			concept_schemes[str(c)] = in_schemes
+			for identifier in in_schemes:
+				concepts[identifier].append(c)
+				self.graph_tree_nodes[identifier][str(c)] = node
+		if not concept_schemes:
+			logging.info("Graph doesn't have concepts")
 
 		# Pasring Collection
 
-		if (None, RDF.type, SKOS.Collection) in g:
-			collections = []
-			for col in g.subjects(RDF.type, SKOS.Collection):
-				collection = {}
-				collection["legacy_id"] = str(col)
-				labels = []
-				for label in g.preferredLabel(col, labelProperties=((DC.title), (RDFS.label), (DCT.title), (SKOS.prefLabel))):
-					temp_col_label = {}
-					temp_col_label["label"] = str(label[1])
-					if str(label[1].language):
-						if str(label[1].language) == "None":
-							temp_col_label["label_lang"] = self.language
-						else:
-							temp_col_label["label_lang"] = str(label[1].language)
-					else:
-						temp_col_label["label_lang"] = self.language
-					labels.append(temp_col_label)
-				collection["labels"] = labels
-				members = []
-				for member in g.objects(col, SKOS.member):
-					members.append(str(member))
-				collection["members"] = members
-				# collection notes
-				col_notes = []
-				col_predicates = [SKOS.note, SKOS.definition, SKOS.scopeNote, SKOS.changeNote,
-							 SKOS.editorialNote, SKOS.historyNote, SKOS.example]
-				for pred in col_predicates:
-					for note in g.objects(col, pred):
-						temp_note = {}
-						temp_note["name"] = str(note)
-						temp_note["lang"] = languageCheck(note.language)
-						temp_note["note_type"] = re.search('http.*#(.*)', str(pred)).group(1)
-						col_notes.append(temp_note)
-				collection["note"] = col_notes
-				# collection other labels
-				col_labels = []
-				for pred in [SKOS.altLabel, SKOS.hiddenLabel]:
-					for other_label in g.objects(col, pred):
-						temp_other_label = {}
-						temp_other_label["name"] = str(other_label)
-						temp_other_label["lang"] = languageCheck(other_label.language)
-						temp_other_label["label_type"] = re.search('http.*#(.*)', str(pred)).group(1)
-						col_labels.append(temp_other_label)
-				collection["other_label"] = col_labels
-				# collection sources
-				col_sources = []
-				for col_srcp in allowProperties('source'):
-					for source in g.objects(col, col_srcp):
-						temp_col_src = {}
-						temp_col_src["name"] = str(source)
-						temp_col_src["lang"] = languageCheck(source.language)
-						col_sources.append(temp_col_src)
-				collection["source"] = col_sources
-				collections.append(collection)
-			concept_scheme["collections"] = collections
-			logging.info(concept_scheme["collections"])
+		for col in sorted(set(g.subjects(RDF.type, SKOS.Collection)), key=str):
+			collection = self._build_collection(col, self._subject_record(g, col))
+			members_schemes = [
+				identifier for member in collection["members"] for identifier in concept_schemes.get(member, [])]
+			in_schemes = self._schemes_of(list(g.objects(col, SKOS.inScheme)) + members_schemes, identifiers)
+			if not in_schemes:
+				self.unassigned.append(str(col))
+			for identifier in in_schemes:
+				schemes[identifier].setdefault("collections", []).append(collection)
+		self._warn_unassigned()
 
-		else:
-			pass
+		def concept_chunks(identifier):
+			subjects = concepts[identifier]
+			for i in range(0, len(subjects), self.chunk_size):
+				yield [self._build_concept(c, self._subject_record(g, c)) for c in subjects[i:i + self.chunk_size]]
 
-		# Parsing concepts triples
-
-		if (None, RDF.type, SKOS.Concept) in g:
-			concepts = []
-			for c in g.subjects(RDF.type, SKOS.Concept):
-				concept = {}
-				concept["legacy_id"] = str(c)
-				# pref labels
-				pref_labels = []
-				for pref_label in g.preferredLabel(c):
-					label = {}
-					label["label"] = str(pref_label[1])
-					if str(pref_label[1].language) == "None":
-						label["lang"] = self.language
-					else:
-						label["lang"] = str(pref_label[1].language)
-					pref_labels.append(label)
-				concept["pref_label"] = pref_labels
-				for scheme in g.objects(c, SKOS.inScheme):
-					concept["scheme"] = str(scheme)
-				for notation in g.objects(c, SKOS.notation):
-					concept["notation"] = str(notation)
-				concept["creator"] = ";".join([c for cp in allowProperties('creator') for c in g.objects(cs, cp)])
-				concept["contributor"] = ";".join([contr for contrp in allowProperties('contributor') for contr in g.objects(cs, contrp)])
-				for broader_concept in g.objects(c, SKOS.broader):
-					concept["broader_concept"] = str(broader_concept)
-				# alt labels
-				alt_labels = [] 
-				for alt_label in g.objects(c, SKOS.altLabel):
-					label = {}
-					label["label"] = str(alt_label)
-					label["lang"] = languageCheck(alt_label.language)
-					alt_labels.append(label)
-				concept["alt_label"] = alt_labels
-				# hidden labels
-				hidden_labels = [] 
-				for hidden_label in g.objects(c, SKOS.hiddenLabel):
-					label = {}
-					label["label"] = str(hidden_label)
-					label["lang"] = languageCheck(hidden_label.language)
-					hidden_labels.append(label)
-				concept["hidden_label"] = hidden_labels
-				# sources
-				sources = []
-				for srcp in allowProperties('source'):
-					for source in g.objects(c, srcp):
-						temp_source = {}
-						temp_source["name"] = str(source)
-						temp_source["lang"] = languageCheck(source.language)
-						sources.append(temp_source)
-				concept["source"] = sources
-				# documentary notes
-				notes = []
-				predicates = [SKOS.note, SKOS.definition, SKOS.scopeNote, SKOS.changeNote,
-							 SKOS.editorialNote, SKOS.historyNote, SKOS.example]
-				for pred in predicates:
-					for note in g.objects(c, pred):
-						temp_note = {}
-						temp_note["name"] = str(note)
-						temp_note["lang"] = languageCheck(note.language)
-						temp_note["note_type"] = re.search('http.*#(.*)', str(pred)).group(1)
-						notes.append(temp_note)
-				concept["note"] = notes
-				# Add concept to a list
-				concepts.append(concept)
-			concept_scheme["has_concepts"] = concepts
-		else:
-			pass
-			logging.info("Graph doesn't have concepts")
-		return concept_scheme
+		return [(schemes[identifier], concept_chunks(identifier)) for identifier in identifiers]
+
+	def _stream_records(self, digest=None):
+		"""
+		Yields (subject, record) pairs read from the file without building a graph,
+		the file must have the triples of a subject next to each other.
+		Triples are added to digest if it is given
+		"""
+		triples = iter_triples(self.file, self.file_format)
+		if digest is not None:
+			triples = digest_triples(triples, digest)
+		return group_by_subject(triples, PREDICATE_FIELDS)
+
+	def stream_concept_schemes(self):
+		"""
+		Reads the file without building a graph: the first pass builds concept scheme
+		dictionaries with collections, then one more pass for every concept scheme
+		yields lists of at most chunk_size concept dictionaries of the scheme.
+		RDF/XML which the streaming reader does not handle is read in a graph (see graph_concept_schemes).
+		Returns (concept scheme dictionary, generator of concept chunks) for every concept scheme
+		"""
+		schemes = OrderedDict()
+		collections = []
+		concept_schemes = {}
+		digest = TriplesDigest()
+		try:
+			for subject, record in self._stream_records(digest):
+				types = record.get("type", [])
+				if SKOS.ConceptScheme in types:
+					concept_scheme = self._build_scheme(subject, record)
+					schemes[concept_scheme["identifier"]] = concept_scheme
+				elif SKOS.Collection in types:
+					collections.append((self._build_collection(subject, record), record.get("inScheme", [])))
+				elif SKOS.Concept in types:
+					concept_schemes[str(subject)] = [str(scheme) for scheme in record.get("inScheme", [])]
+		except UnsupportedRDFXML as error:
+			# the first pass reads the whole file, nothing is written yet
+			logging.info("Parsing RDF/XML with rdflib: {}".format(error))
+			self.rdfxml_error = error
+			self.streaming = False
+			return self.graph_concept_schemes()
+		if not schemes:
+			raise Exception("rdf:type skos:ConceptScheme is not found")
+		self._hash_schemes(digest, schemes)
+		identifiers = list(schemes)
+		self.unassigned = [
+			legacy_id for legacy_id, values in concept_schemes.items()
+			if not self._schemes_of(values, identifiers)]
+		for collection, values in collections:
+			members_schemes = [
+				identifier for member in collection["members"] for identifier in concept_schemes.get(member, [])]
+			in_schemes = self._schemes_of(list(values) + members_schemes, identifiers)
+			if not in_schemes:
+				self.unassigned.append(collection["legacy_id"])
+			for identifier in in_schemes:
+				schemes[identifier].setdefault("collections", []).append(collection)
+		del concept_schemes
+		self._warn_unassigned()
+
+		def concept_chunks(identifier):
+			chunk = []
+			for subject, record in self._stream_records():
+				if SKOS.Concept in record.get("type", []) and identifier in self._schemes_of(
+						record.get("inScheme", []), identifiers):
+					chunk.append(self._build_concept(subject, record))
+					if len(chunk) >= self.chunk_size:
+						yield chunk
+						chunk = []
+			if chunk:
+				yield chunk
 
+		return [(schemes[identifier], concept_chunks(identifier)) for identifier in identifiers]
 
-	def upload_data(self, user):
-		"""
-		Creates and saves concept scheme and its concepts in a database
-		"""
-		concept_scheme = self.parse_triples()
-		concept_scheme_uri = concept_scheme.get("identifier")
-		concept_scheme_creator = concept_scheme.get("creator", "")
-		concept_scheme_contributor = concept_scheme.get("contributor", "")
-		concept_scheme_language = concept_scheme.get("language", "")
-		concept_scheme_subject = concept_scheme.get("subject", "")
-		concept_scheme_publisher = concept_scheme.get("publisher", "")
-		concept_scheme_license = concept_scheme.get("license", "")
-		concept_scheme_description = concept_scheme.get("description")
-		concept_scheme_source = concept_scheme.get("source")
-		concept_scheme_has_concepts = concept_scheme.get("has_concepts")
-		concept_scheme_has_collections = concept_scheme.get("collections")
-		main_title = {}
-		other_titles = []
-		for title in concept_scheme.get("title"):
-			if title.get("lang") == self.language:
-				main_title["label"] = title.get("title")
-				main_title["lang"] = title.get("lang")
+	def _split_labels(self, labels, label_key, lang_key):
+		"""
+		Splits a list of labels into the label in the main language
+		and labels in other languages
+		"""
+		main_label = {}
+		other_labels = []
+		for label in labels:
+			if label.get(lang_key) == self.language:
+				main_label["label"] = label.get(label_key)
+				main_label["lang"] = label.get(lang_key)
 			else:
-				other_title = {}
-				other_title["label"] = title.get("title", "Empty title")
-				other_title["lang"] = title.get("lang", self.language) 
-				other_titles.append(other_title)
-		concept_scheme_title = main_title.get("label", "No title in specified language")
-		concept_scheme_title_lang = main_title.get("lang", self.language)
-		concept_scheme = SkosConceptScheme.objects.create(
-			identifier=concept_scheme_uri,
-			title=concept_scheme_title, title_lang=concept_scheme_title_lang,
-			creator=concept_scheme_creator, contributor=concept_scheme_contributor,
-			language=concept_scheme_language, subject=concept_scheme_subject,
-			publisher=concept_scheme_publisher, license=concept_scheme_license,
-			created_by=User.objects.get(username=user)
+				other_label = {}
+				other_label["label"] = label.get(label_key)
+				other_label["lang"] = label.get(lang_key, self.language)
+				other_labels.append(other_label)
+		return main_label, other_labels
+
+	def _allocate_notations(self, concepts):
+		"""
+		Sets default notations for concepts without one, unique in the concept scheme
+		like the ones of SkosConcept.save. The notations of the scheme are read once per scheme
+		"""
+		if self.notations is None:
+			self.notations = NotationAllocator.for_scheme(SkosConcept.objects, self.scheme.pk)
+		for concept in concepts:
+			if concept.notation != "":
+				self.notations.reserve(concept.notation)
+		for concept in concepts:
+			if concept.notation == "":
+				concept.notation = self.notations.allocate(concept.pref_label)
+
+	def _scheme_values(self, concept_scheme):
+		"""
+		Returns field values of a concept scheme and its titles in other languages
+		"""
+		main_title, other_titles = self._split_labels(concept_scheme.get("title"), "title", "lang")
+		values = dict(
+			identifier=concept_scheme.get("identifier"),
+			title=main_title.get("label", "No title in specified language"),
+			title_lang=main_title.get("lang", self.language),
+			creator=concept_scheme.get("creator", ""),
+			contributor=concept_scheme.get("contributor", ""),
+			language=concept_scheme.get("language", ""),
+			subject=concept_scheme.get("subject", ""),
+			publisher=concept_scheme.get("publisher", ""),
+			license=concept_scheme.get("license", ""),
 			)
-		if  len(other_titles) > 0:
-			for other in other_titles:
-				cs_title = ConceptSchemeTitle.objects.create(
-					concept_scheme=concept_scheme, name=other.get("label"),
-					language=other.get("lang")
-				)
-		else:
-			pass
+		return values, other_titles
 
-		if concept_scheme_description:
-			for desc in concept_scheme_description:
-				cs_desc = ConceptSchemeDescription.objects.create(
-					concept_scheme=concept_scheme, name=desc.get("name"),
-					language=desc.get("lang")
-				)
-		else:
-			pass
-		if concept_scheme_source:
-			for source in concept_scheme_source:
-				cs_source = ConceptSchemeSource.objects.create(
-					concept_scheme=concept_scheme, name=source.get("name"),
-					language=source.get("lang")
-				)
+	def _write_scheme_children(self, concept_scheme, other_titles):
+		writer = self.writer
+		writer.create(ConceptSchemeTitle, [
+			ConceptSchemeTitle(
+				concept_scheme=self.scheme, name=other.get("label"),
+				language=other.get("lang"))
+			for other in other_titles])
+		writer.create(ConceptSchemeDescription, [
+			ConceptSchemeDescription(
+				concept_scheme=self.scheme, name=desc.get("name"), language=desc.get("lang"))
+			for desc in concept_scheme.get("description") or []])
+		writer.create(ConceptSchemeSource, [
+			ConceptSchemeSource(
+				concept_scheme=self.scheme, name=source.get("name"), language=source.get("lang"))
+			for source in concept_scheme.get("source") or []])
+
+	def _write_scheme(self, concept_scheme):
+		"""
+		Creates the concept scheme with its titles, descriptions and sources
+		"""
+		values, other_titles = self._scheme_values(concept_scheme)
+		self.scheme = SkosConceptScheme.objects.create(created_by=self.created_by, **values)
+		self._write_scheme_children(concept_scheme, other_titles)
+		return self.scheme
+
+	def _collection_values(self, col):
+		"""
+		Returns field values of a collection, keeps its labels in other languages
+		and the content hash in the collection dictionary
+		"""
+		col_main_label, col_other_labels = self._split_labels(col.get("labels"), "label", "label_lang")
+		col["other_pref_labels"] = col_other_labels
+		col["content_hash"] = content_hash(col, COLLECTION_HASH_KEYS)
+		return dict(
+			name=col_main_label.get("label", "no label in specified language"),
+			label_lang=col_main_label.get("lang", self.language),
+			content_hash=col["content_hash"])
+
+	def _write_collection_children(self, collections, new_collections):
+		"""
+		Creates labels, notes and sources of collections
+		"""
+		writer = self.writer
+		col_labels = []
+		col_notes = []
+		col_sources = []
+		for col, new_collection in zip(collections, new_collections):
+			for other in col["other_pref_labels"]:
+				col_labels.append(CollectionLabel(
+					collection=new_collection, name=other.get("label"),
+					language=other.get("lang"), label_type="prefLabel"))
+			for cn in col.get("note") or []:
+				col_notes.append(CollectionNote(
+					collection=new_collection, name=cn.get("name"),
+					language=cn.get("lang"), note_type=cn.get("note_type")))
+			for cahl in col.get("other_label") or []:
+				col_labels.append(CollectionLabel(
+					collection=new_collection, name=cahl.get("name"),
+					language=cahl.get("lang"), label_type=cahl.get("label_type")))
+			for csrc in col.get("source") or []:
+				col_sources.append(CollectionSource(
+					collection=new_collection, name=csrc.get("name"),
+					language=csrc.get("lang")))
+		writer.create(CollectionLabel, col_labels)
+		writer.create(CollectionNote, col_notes)
+		writer.create(CollectionSource, col_sources)
+
+	def _index_members(self, collections, collection_pks):
+		"""
+		Builds self.collection_index: member legacy_id -> pks of collections it belongs to
+		"""
+		for col in collections:
+			collection_pk = collection_pks[col.get("legacy_id")]
+			for member in col.get("members"):
+				member_of = self.collection_index.setdefault(member, [])
+				if collection_pk not in member_of:
+					member_of.append(collection_pk)
+
+	def _write_collections(self, collections):
+		"""
+		Creates collections with their labels, notes and sources,
+		returns a dictionary legacy_id -> pk
+		"""
+		new_collections = [
+			SkosCollection(
+				scheme=self.scheme, legacy_id=col.get("legacy_id"),
+				created_by=self.created_by, **self._collection_values(col))
+			for col in collections]
+		collection_pks = self.writer.create(
+			SkosCollection, new_collections, key="legacy_id",
+			queryset=SkosCollection.objects.filter(scheme=self.scheme))
+		self._progress("permissions")
+		self.writer.create(UserObjectPermission, bulk_object_permissions(SkosCollection, new_collections, self.scheme))
+		self._progress("write")
+		self._write_collection_children(collections, new_collections)
+		return collection_pks
+
+	def _concept_values(self, concept):
+		"""
+		Returns field values of a concept, keeps its labels in other languages
+		in the concept dictionary
+		"""
+		main_pref_label, other_pref_labels = self._split_labels(concept.get("pref_label"), "label", "lang")
+		concept["other_pref_labels"] = other_pref_labels
+		return dict(
+			pref_label=main_pref_label.get("label", "no label in this language"),
+			pref_label_lang=main_pref_label.get("lang", self.language),
+			notation=concept.get("notation", ""), creator=concept.get("creator", ""),
+			contributor=concept.get("contributor", ""),
+			content_hash=content_hash(
+				concept, CONCEPT_HASH_KEYS, self.collection_index.get(concept.get("legacy_id"), []))
+			)
+
+	def _write_concept_children(self, concepts, new_concepts):
+		"""
+		Creates labels, notes, sources and collection memberships of concepts,
+		memberships are taken from the member index built by _index_members
+		"""
+		writer = self.writer
+		Membership = SkosConcept.collection.through
+		memberships = []
+		concept_labels = []
+		concept_notes = []
+		concept_sources = []
+		for concept, new_concept in zip(concepts, new_concepts):
+			# concept to collections
+			for collection_pk in self.collection_index.get(new_concept.legacy_id, []):
+				memberships.append(Membership(skosconcept_id=new_concept.pk, skoscollection_id=collection_pk))
+			for other in concept["other_pref_labels"]:
+				concept_labels.append(ConceptLabel(
+					concept=new_concept, name=other.get("label"),
+					language=other.get("lang"), label_type="prefLabel"))
+			for alt in concept.get("alt_label") or []:
+				concept_labels.append(ConceptLabel(
+					concept=new_concept, name=alt.get("label"),
+					language=alt.get("lang"), label_type="altLabel"))
+			for hid in concept.get("hidden_label") or []:
+				concept_labels.append(ConceptLabel(
+					concept=new_concept, name=hid.get("label"),
+					language=hid.get("lang"), label_type="hiddenLabel"))
+			for n in concept.get("note") or []:
+				concept_notes.append(ConceptNote(
+					concept=new_concept, name=n.get("name"),
+					language=n.get("lang"), note_type=n.get("note_type")))
+			for s in concept.get("source") or []:
+				concept_sources.append(ConceptSource(
+					concept=new_concept, name=s.get("name"),
+					language=s.get("lang")))
+		writer.create(Membership, memberships)
+		writer.create(ConceptLabel, concept_labels)
+		writer.create(ConceptNote, concept_notes)
+		writer.create(ConceptSource, concept_sources)
+
+	def _write_concepts(self, concepts):
+		"""
+		Creates a chunk of concepts with their labels, notes, sources
+		and collection memberships. Tree fields are taken from self.tree_fields
+		if they are computed before, broader relationships are set
+		by _write_relationships
+		"""
+		new_concepts = []
+		chunk_ids = set()
+		for concept in concepts:
+			if concept.get("legacy_id") in self.concept_pks or concept.get("legacy_id") in chunk_ids:
+				raise Exception(
+					"Concept {} is found twice, triples of a subject "
+					"must be next to each other".format(concept.get("legacy_id")))
+			chunk_ids.add(concept.get("legacy_id"))
+			values = self._concept_values(concept)
+			if self.tree_fields is None:
+				# tree fields are computed by _write_relationships
+				self.tree_nodes[concept.get("legacy_id")] = (values["pref_label"], concept.get("broader_concept"))
+				lft, rght, tree_id, level = 0, 0, 0, 0
+			else:
+				lft, rght, tree_id, level = self.tree_fields[concept.get("legacy_id")]
+			new_concepts.append(SkosConcept(
+				legacy_id=concept.get("legacy_id"), scheme=self.scheme, created_by=self.created_by,
+				lft=lft, rght=rght, tree_id=tree_id, level=level, **values
+				))
+		self._allocate_notations(new_concepts)
+		self.concept_pks.update(self.writer.create(
+			SkosConcept, new_concepts, key="legacy_id",
+			queryset=SkosConcept.objects.filter(scheme=self.scheme)))
+		self._progress("permissions")
+		self.writer.create(UserObjectPermission, bulk_object_permissions(SkosConcept, new_concepts, self.scheme))
+		self._progress("write")
+		self._write_concept_children(concepts, new_concepts)
+		self._progress("write")
+
+	def _compute_tree_fields(self, nodes, first_tree_id):
+		"""
+		Computes MPTT fields of nodes (key -> (pref_label, broader key)) with tree ids
+		starting at first_tree_id. Broader links to concepts which are not in the file
+		are collected in self.dangling_broader, links which make a cycle
+		in self.cyclic_broader, both are removed from nodes
+		"""
+		for key, (pref_label, broader_id) in nodes.items():
+			if broader_id is not None and broader_id not in nodes:
+				self.dangling_broader.append((key, broader_id))
+				nodes[key] = (pref_label, None)
+		if self.dangling_broader:
+			logging.warning("{} broader concepts are not found".format(len(self.dangling_broader)))
+		tree_fields, cut = compute_tree_fields(nodes, first_tree_id)
+		for key in cut:
+			pref_label, broader_id = nodes[key]
+			self.cyclic_broader.append((key, broader_id))
+			nodes[key] = (pref_label, None)
+		if self.cyclic_broader:
+			logging.warning("{} broader concepts make a cycle".format(len(self.cyclic_broader)))
+		return tree_fields
+
+	def _reserved_tree_fields(self, tree_fields, first_tree_id=None):
+		"""
+		Moves tree fields computed with tree ids from 1 to tree ids reserved with reserve_tree_ids,
+		or to the ones from first_tree_id reserved before by an interrupted import.
+		Existing trees and trees of other imports are never touched, the editor does not
+		shift tree ids (see SkosConceptManager).
+		Returns the tree fields and the first tree id
+		"""
+		count = len(set(tree_id for lft, rght, tree_id, level in tree_fields.values()))
+		if first_tree_id is None:
+			first_tree_id = reserve_tree_ids(count)
+		return {
+			key: (lft, rght, tree_id + first_tree_id - 1, level)
+			for key, (lft, rght, tree_id, level) in tree_fields.items()}, first_tree_id
+
+	def _write_relationships(self):
+		"""
+		Sets broader concepts with one batched update using the legacy_id -> pk
+		map of the inserted concepts. If the tree fields were not known
+		at insert time (streaming mode), they are computed and written in the same update
+		"""
+		self._progress("tree")
+		pks = self.concept_pks
+		if self.tree_fields is None:
+			self.tree_fields, _first_tree_id = self._reserved_tree_fields(
+				self._compute_tree_fields(self.tree_nodes, 1))
+			fields = ["broader_concept", "lft", "rght", "tree_id", "level"]
+			updates = []
+			for legacy_id, (pref_label, broader_id) in self.tree_nodes.items():
+				lft, rght, tree_id, level = self.tree_fields[legacy_id]
+				updates.append(SkosConcept(
+					pk=pks[legacy_id], broader_concept_id=pks.get(broader_id),
+					lft=lft, rght=rght, tree_id=tree_id, level=level))
 		else:
-			pass
+			fields = ["broader_concept"]
+			updates = [
+				SkosConcept(pk=pks[legacy_id], broader_concept_id=pks[broader_id])
+				for legacy_id, (pref_label, broader_id) in self.tree_nodes.items()
+				if broader_id is not None]
+		self.writer.update(SkosConcept, updates, fields)
 
-		with transaction.atomic():
-			if concept_scheme_has_collections:
-				
-				for col in concept_scheme_has_collections:
-					col_notes = col.get("note", "")
-					col_alt_hid_labels = col.get("other_label", "")
-					col_sources = col.get("source", "")
-					col_main_label = {}
-					col_other_labels = []
-					for label in col.get("labels"):
-						if label.get("label_lang") == self.language:
-							col_main_label["label"] = label.get("label")
-							col_main_label["lang"] = label.get("label_lang")
-						else:
-							other_label = {}
-							other_label["label"] = label.get("label", "other label")
-							other_label["lang"] = label.get("label_lang", self.language) 
-							col_other_labels.append(other_label)
-					new_collection = SkosCollection.objects.create(scheme=concept_scheme,
-						name=col_main_label.get("label", "no label in specified language"),
-						legacy_id=col.get("legacy_id"), label_lang=col_main_label.get("lang", self.language),
-						created_by=User.objects.get(username=user))
-					if len(col_other_labels) > 0:
-						for other in col_other_labels:
-							col_title = CollectionLabel.objects.create(
-								collection=new_collection, name=other.get("label"),
-								language=other.get("lang"), label_type="prefLabel"
-							)
-					if col_notes:
-						for cn in col_notes:
-							note = CollectionNote.objects.create(
-								collection=new_collection, name=cn.get("name"),
-								language=cn.get("lang"), note_type=cn.get("note_type")
-								)
-					if col_alt_hid_labels:
-						for cahl in col_alt_hid_labels:
-							alt_hid_label = CollectionLabel.objects.create(
-								collection=new_collection, name=cahl.get("name"),
-								language=cahl.get("lang"), label_type=cahl.get("label_type")
-								)
-					if col_sources:
-						for csrc in col_sources:
-							src = CollectionSource.objects.create(
-								collection=new_collection, name=csrc.get("name"),
-								language=csrc.get("lang")
-								)
+	def _count_diff(self, name, inserted, updated, deleted, unchanged):
+		"""
+		Adds the counts of merged rows of a concept scheme to self.diff
+		"""
+		counts = self.diff.setdefault(name, {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0})
+		counts["inserted"] += inserted
+		counts["updated"] += updated
+		counts["deleted"] += deleted
+		counts["unchanged"] += unchanged
 
+	def _merge_collections(self, collections):
+		"""
+		Inserts new collections, rewrites the changed ones and deletes collections
+		which are not in the file any more. Returns a dictionary legacy_id -> pk
+		"""
+		writer = self.writer
+		existing = {}
+		removed = []
+		for pk, legacy_id, old_hash in self.scheme.has_collections.exclude(
+				legacy_id="").values_list('pk', 'legacy_id', 'content_hash'):
+			if legacy_id in existing:
+				removed.append(pk)
 			else:
-				pass
+				existing[legacy_id] = (pk, old_hash)
+		new = []
+		changed = []
+		changed_collections = []
+		for col in collections:
+			values = self._collection_values(col)
+			if col.get("legacy_id") not in existing:
+				new.append(col)
+			elif existing[col.get("legacy_id")][1] != col["content_hash"]:
+				changed.append(col)
+				changed_collections.append(SkosCollection(
+					pk=existing[col.get("legacy_id")][0], legacy_id=col.get("legacy_id"),
+					date_modified=timezone.now(), **values))
+		collection_pks = {legacy_id: pk for legacy_id, (pk, old_hash) in existing.items()}
+		collection_pks.update(self._write_collections(new))
+		changed_pks = [col.pk for col in changed_collections]
+		writer.update(SkosCollection, changed_collections, ["name", "label_lang", "content_hash", "date_modified"])
+		for model in (CollectionLabel, CollectionNote, CollectionSource):
+			writer.delete(model, changed_pks, "collection")
+		self._write_collection_children(changed, changed_collections)
+		file_ids = set(col.get("legacy_id") for col in collections)
+		removed.extend(pk for legacy_id, (pk, old_hash) in existing.items() if legacy_id not in file_ids)
+		writer.delete(SkosCollection, removed)
+		self._count_diff(
+			"collections", len(new), len(changed), len(removed), len(collections) - len(new) - len(changed))
+		return collection_pks
 
+	def _merge_concepts(self, concepts):
+		"""
+		Matches concepts by legacy_id and compares content hashes: new concepts
+		are inserted, changed ones are rewritten, concepts which are not in the file
+		any more are deleted. Concepts created in the editor (without legacy_id) are kept.
+		Tree fields of the whole scheme are computed in memory and only rows
+		whose tree fields or broader concept change are updated
+		"""
+		writer = self.writer
+		existing = {}
+		removed = []
+		manual = {}
+		current = {}
+		pk_keys = {}
+		rows = self.scheme.has_concepts.values_list(
+			'pk', 'legacy_id', 'pref_label', 'broader_concept_id', 'lft', 'rght', 'tree_id', 'level', 'content_hash')
+		for pk, legacy_id, pref_label, broader_pk, lft, rght, tree_id, level, old_hash in rows:
+			if not legacy_id:
+				manual[pk] = (pref_label, broader_pk)
+				key = pk
+			elif legacy_id in existing:
+				removed.append(pk)
+				continue
+			else:
+				existing[legacy_id] = (pk, old_hash)
+				key = legacy_id
+			pk_keys[pk] = key
+			current[key] = (broader_pk, lft, rght, tree_id, level)
+		file_ids = set(concept.get("legacy_id") for concept in concepts)
+		removed.extend(pk for legacy_id, (pk, old_hash) in existing.items() if legacy_id not in file_ids)
 
-		if concept_scheme_has_concepts:
-
-			for concept in concept_scheme_has_concepts:
-				concept_legacy_id = concept.get("legacy_id")
-				concept_inscheme = concept.get("scheme")
-				concept_notation = concept.get("notation", "")
-				concept_creator = concept.get("creator", "")
-				concept_contributor = concept.get("contributor", "")
-				concept_alt_labels = concept.get("alt_label")
-				concept_hidden_labels = concept.get("hidden_label")
-				concept_notes = concept.get("note")
-				concept_sources = concept.get("source")
-				main_pref_label = {}
-				other_pref_labels = []
-				for pref_label in concept.get("pref_label"):								
-					if  pref_label.get("lang") == self.language:
-						main_pref_label["label"] = pref_label.get("label")
-						main_pref_label["lang"] = pref_label.get("lang")
-					else:
-						other_pref_label = {}
-						other_pref_label["label"] = pref_label.get("label")
-						other_pref_label["lang"] = pref_label.get("lang", self.language) 
-						other_pref_labels.append(other_pref_label)
-				concept_pref_label = main_pref_label.get("label", "no label in this language")
-				concept_pref_label_lang = main_pref_label.get("lang", self.language)
-				new_concept = SkosConcept.objects.create(
-					legacy_id=concept_legacy_id,
-					scheme=SkosConceptScheme.objects.get(id=concept_scheme.id),
-					pref_label=concept_pref_label, pref_label_lang=concept_pref_label_lang,
-					notation=concept_notation, creator=concept_creator,
-					contributor=concept_contributor, created_by=User.objects.get(username=user)
-					)
-				new_concept.save()
-
-				# concept to collections
-				if concept_scheme_has_collections:
-					collections = []
-					for col in concept_scheme_has_collections:
-						if concept_legacy_id in col.get("members"):
-							collections.append(col.get("legacy_id"))
-						else:
-							pass
-					if len(collections) > 0:
-						member_of_collections = SkosCollection.objects.filter(legacy_id__in=collections)
-						new_concept.collection.set(member_of_collections)
-				else:
-					pass
+		# concept tree of the merged scheme: file concepts by legacy_id, editor concepts by pk
+		values = {}
+		for concept in concepts:
+			values[concept.get("legacy_id")] = self._concept_values(concept)
+			self.tree_nodes[concept.get("legacy_id")] = (
+				values[concept.get("legacy_id")]["pref_label"], concept.get("broader_concept"))
+		for pk, (pref_label, broader_pk) in manual.items():
+			broader_key = pk_keys.get(broader_pk)
+			if broader_key is not None and broader_key not in file_ids and broader_key not in manual:
+				broader_key = None
+			self.tree_nodes[pk] = (pref_label, broader_key)
+		self._progress("tree")
+		tree_fields = self._compute_tree_fields(self.tree_nodes, 1)
+		# roots which were roots before keep their tree id
+		tree_ids = {}
+		for key, (lft, rght, tree_id, level) in tree_fields.items():
+			if level == 0 and key in current and current[key][4] == 0:
+				tree_ids[tree_id] = current[key][3]
+		new_tree_ids = sorted(set(tree_id for lft, rght, tree_id, level in tree_fields.values()) - set(tree_ids))
+		first_tree_id = reserve_tree_ids(len(new_tree_ids))
+		for i, tree_id in enumerate(new_tree_ids):
+			tree_ids[tree_id] = first_tree_id + i
+		self.tree_fields = {
+			key: (lft, rght, tree_ids[tree_id], level)
+			for key, (lft, rght, tree_id, level) in tree_fields.items()}
 
-				if len(other_pref_labels) > 0:
-					for other in other_pref_labels:
-						other_label = ConceptLabel.objects.create(
-							concept=new_concept, name=other.get("label"),
-							language=other.get("lang"), label_type="prefLabel"
-							)
-				else:
-					pass
-				if  len(concept_alt_labels) > 0:
-					for alt in concept_alt_labels:
-						alt_label = ConceptLabel.objects.create(
-							concept=new_concept, name=alt.get("label"),
-							language=alt.get("lang"), label_type="altLabel"
-							)
-				else:
-					pass
-				if  len(concept_hidden_labels) > 0:
-					for hid in concept_hidden_labels:
-						hidden_label = ConceptLabel.objects.create(
-							concept=new_concept, name=hid.get("label"),
-							language=hid.get("lang"), label_type="hiddenLabel"
-						)
-				else:
-					pass
-				if len(concept_notes) > 0:
-					for n in concept_notes:
-						note = ConceptNote.objects.create(
-							concept=new_concept, name=n.get("name"),
-							language=n.get("lang"), note_type=n.get("note_type")
-							)
-				else:
-					pass
-				if len(concept_sources) > 0:
-					for s in concept_sources:
-						source = ConceptSource.objects.create(
-							concept=new_concept, name=s.get("name"),
-							language=s.get("lang")
-							)
-				else:
-					pass
-			# add relationships
-			for concept in concept_scheme_has_concepts:
-				if concept.get("broader_concept") is not None:
-					local_concepts = SkosConcept.objects.filter(scheme=concept_scheme.id)
-					try:
-						update_concept = local_concepts.filter(
-							legacy_id=concept.get("legacy_id")).update(
-							broader_concept=local_concepts.get(legacy_id=concept.get("broader_concept"))
-							)
-					except ObjectDoesNotExist as e:
-						pass
-						logging.info(e)
+		new = [concept for concept in concepts if concept.get("legacy_id") not in existing]
+		if new:
+			self._write_concepts(new)
+		changed = []
+		changed_concepts = []
+		update_fields = ["pref_label", "pref_label_lang", "creator", "contributor", "content_hash", "date_modified"]
+		for concept in concepts:
+			legacy_id = concept.get("legacy_id")
+			if legacy_id in existing and existing[legacy_id][1] != values[legacy_id]["content_hash"]:
+				changed.append(concept)
+				concept_values = values[legacy_id]
+				if not concept_values["notation"]:
+					del concept_values["notation"]
+				changed_concepts.append(SkosConcept(
+					pk=existing[legacy_id][0], legacy_id=legacy_id, date_modified=timezone.now(), **concept_values))
+		writer.update(SkosConcept, [c for c in changed_concepts if c.notation], update_fields + ["notation"])
+		writer.update(SkosConcept, [c for c in changed_concepts if not c.notation], update_fields)
+		changed_pks = [c.pk for c in changed_concepts]
+		for model in (ConceptLabel, ConceptNote, ConceptSource):
+			writer.delete(model, changed_pks, "concept")
+		writer.delete(SkosConcept.collection.through, changed_pks, "skosconcept")
+		self._write_concept_children(changed, changed_concepts)
+
+		# broader concepts and tree fields of the rows which change
+		self._progress("tree")
+		pks = {legacy_id: pk for legacy_id, (pk, old_hash) in existing.items()}
+		pks.update(self.concept_pks)
+		pks.update((pk, pk) for pk in manual)
+		for legacy_id in self.concept_pks:
+			current[legacy_id] = (None,) + self.tree_fields[legacy_id]
+		updates = []
+		for key, (pref_label, broader_key) in self.tree_nodes.items():
+			wanted = (pks.get(broader_key),) + self.tree_fields[key]
+			if current[key] != wanted:
+				broader_pk, lft, rght, tree_id, level = wanted
+				updates.append(SkosConcept(
+					pk=pks[key], broader_concept_id=broader_pk,
+					lft=lft, rght=rght, tree_id=tree_id, level=level))
+		writer.update(SkosConcept, updates, ["broader_concept", "lft", "rght", "tree_id", "level"])
+		# nothing points at removed concepts any more, deleting them does not cascade to kept ones
+		writer.delete(SkosConcept, removed)
+		self._count_diff(
+			"concepts", len(new), len(changed), len(removed), len(concepts) - len(new) - len(changed))
+
+	def _merge(self, concept_scheme):
+		"""
+		Writes the difference between the file and the existing concept scheme self.scheme
+		"""
+		values, other_titles = self._scheme_values(concept_scheme)
+		SkosConceptScheme.objects.filter(pk=self.scheme.pk).update(date_modified=timezone.now(), **values)
+		for model in (ConceptSchemeTitle, ConceptSchemeDescription, ConceptSchemeSource):
+			self.writer.delete(model, [self.scheme.pk], "concept_scheme")
+		self._write_scheme_children(concept_scheme, other_titles)
+		self._progress("write")
+		collections = concept_scheme.get("collections") or []
+		self._index_members(collections, self._merge_collections(collections))
+		self._merge_concepts(concept_scheme.get("has_concepts") or [])
+		self.scheme.refresh_from_db()
+
+	def validate(self):
+		"""
+		Parses and checks the file without touching the database.
+		Returns a report with counts of concept schemes, concepts, labels per language, notes per type,
+		collections, concepts and collections without a scheme,
+		dangling and cyclic broader links, duplicate legacy_ids,
+		notation collisions and wall time and peak memory of every stage
+		"""
+		stages = OrderedDict()
+		with measure(stages, "parse"):
+			if self.streaming:
+				schemes = self.stream_concept_schemes()
+			else:
+				schemes = self.graph_concept_schemes()
+		self.dangling_broader = []
+		self.cyclic_broader = []
+		concepts = 0
+		labels = Counter()
+		notes = Counter()
+		collections = 0
+		scheme_nodes = []
+		duplicates = set()
+		notations = {}
+		# concept dictionaries are built in this stage, in streaming mode with the passes over the file
+		with measure(stages, "concepts"):
+			for concept_scheme, concept_chunks in schemes:
+				collections += len(concept_scheme.get("collections") or [])
+				tree_nodes = {}
+				scheme_notations = {}
+				for chunk in concept_chunks:
+					for concept in chunk:
+						concepts += 1
+						legacy_id = concept.get("legacy_id")
+						if legacy_id in tree_nodes:
+							duplicates.add(legacy_id)
+						tree_nodes[legacy_id] = self._tree_node(concept)
+						for label_key in ("pref_label", "alt_label", "hidden_label"):
+							labels.update(label.get("lang") for label in concept.get(label_key) or [])
+						notes.update(note.get("note_type") for note in concept.get("note") or [])
+						if concept.get("notation"):
+							scheme_notations.setdefault(concept.get("notation"), []).append(legacy_id)
+				scheme_nodes.append(tree_nodes)
+				for notation, legacy_ids in scheme_notations.items():
+					if len(legacy_ids) > 1:
+						notations.setdefault(notation, []).extend(legacy_ids)
+		with measure(stages, "tree"):
+			for tree_nodes in scheme_nodes:
+				self._compute_tree_fields(tree_nodes, 1)
+		self.report = {
+			"schemes": len(schemes),
+			"concepts": concepts,
+			"labels": dict(labels),
+			"notes": dict(notes),
+			"collections": collections,
+			"unassigned": self.unassigned,
+			"dangling_broader": self.dangling_broader,
+			"cyclic_broader": self.cyclic_broader,
+			"duplicate_legacy_ids": sorted(duplicates),
+			"notation_collisions": notations,
+			"stages": stages,
+		}
+		return self.report
+
+	def checkpoint_key(self, identifier=""):
+		"""
+		Returns a sha1 of the file, its format, language and the identifier
+		of the concept scheme which identifies the checkpoint of an import of the file
+		"""
+		digest = hashlib.sha1("{}|{}|{}|".format(self.file_format, self.language, identifier).encode("utf-8"))
+		digest.update(self.file_digest().encode("utf-8"))
+		return digest.hexdigest()
+
+	def file_digest(self):
+		"""
+		Returns the sha1 of the file bytes, the file is read once for all its concept schemes
+		"""
+		if self._file_digest is None:
+			digest = hashlib.sha1()
+			with open_source(self.file, decompress=False) as f:
+				for block in iter(lambda: f.read(1 << 20), b""):
+					digest.update(block)
+			self._file_digest = digest.hexdigest()
+		return self._file_digest
+
+	def _tree_node(self, concept):
+		"""
+		Returns (pref_label, broader legacy_id) of a concept dictionary
+		"""
+		main_pref_label, other_pref_labels = self._split_labels(concept.get("pref_label"), "label", "lang")
+		return main_pref_label.get("label", "no label in this language"), concept.get("broader_concept")
+
+	def _resume(self, checkpoint, concept_scheme):
+		"""
+		Continues an import from its checkpoint, the legacy_id -> pk maps
+		are read from the rows committed before the checkpoint
+		"""
+		self.scheme = checkpoint.scheme
+		collections = concept_scheme.get("collections") or []
+		self._index_members(collections, dict(self.scheme.has_collections.values_list("legacy_id", "pk")))
+		self.concept_pks = dict(self.scheme.has_concepts.values_list("legacy_id", "pk"))
+		logging.info("Resuming import of {} after {} concepts".format(self.scheme, checkpoint.concepts_done))
+
+	def _write_chunked(self, concept_scheme, concept_chunks):
+		"""
+		Writes a new concept scheme, every chunk of concepts is committed with
+		the number of concepts done in the checkpoint of the file.
+		With resume, concepts committed by an interrupted import are skipped
+		"""
+		key = self.checkpoint_key(concept_scheme.get("identifier"))
+		checkpoint = None
+		if self.resume:
+			checkpoint = ImportCheckpoint.objects.filter(key=key).select_related("scheme").order_by("-id").first()
+		first_tree_id = None
+		if not self.streaming:
+			if concept_scheme.get("has_concepts") is not None:
+				for concept in concept_scheme.get("has_concepts"):
+					self.tree_nodes[concept.get("legacy_id")] = self._tree_node(concept)
+			else:
+				self.tree_nodes = self.graph_tree_nodes[concept_scheme.get("identifier")]
+			self._progress("tree")
+			# the tree ids are reserved before the first chunk is committed, a resumed import keeps its own
+			self.tree_fields, first_tree_id = self._reserved_tree_fields(
+				self._compute_tree_fields(self.tree_nodes, 1),
+				checkpoint.first_tree_id if checkpoint is not None else None)
+		self._progress("write")
+		if checkpoint is None:
+			with transaction.atomic():
+				self._write_scheme(concept_scheme)
+				if concept_scheme.get("collections"):
+					collections = concept_scheme.get("collections")
+					self._index_members(collections, self._write_collections(collections))
 				else:
 					pass
-			return SkosConcept.objects.rebuild()
+				checkpoint = ImportCheckpoint.objects.create(
+					key=key, scheme=self.scheme, first_tree_id=first_tree_id)
+		else:
+			self._resume(checkpoint, concept_scheme)
+		# concepts are matched by legacy_id, the order of a graph is not the same in every parse
+		committed = set(self.concept_pks)
+		for concepts in concept_chunks:
+			if committed:
+				pending = [concept for concept in concepts if concept.get("legacy_id") not in committed]
+				if self.streaming:
+					# tree fields of the committed concepts are computed at the end
+					for concept in concepts:
+						if concept.get("legacy_id") in committed:
+							self.tree_nodes[concept.get("legacy_id")] = self._tree_node(concept)
+			else:
+				pending = concepts
+			if pending:
+				with transaction.atomic():
+					self._write_concepts(pending)
+					checkpoint.concepts_done += len(pending)
+					checkpoint.save(update_fields=["concepts_done", "date_modified"])
+		with transaction.atomic():
+			if self.concept_pks:
+				self._write_relationships()
+			else:
+				pass
+			self._store_content_hash(concept_scheme)
+			checkpoint.delete()
+
+	def _store_content_hash(self, concept_scheme):
+		"""
+		Stores the content hash on a concept scheme once all of it is written,
+		an interrupted import is not returned for an identical upload
+		"""
+		if concept_scheme.get("content_hash"):
+			SkosConceptScheme.objects.filter(pk=self.scheme.pk).update(content_hash=concept_scheme["content_hash"])
 		else:
 			pass
-		return concept_scheme
+
+	def _find_duplicate(self, concept_scheme):
+		"""
+		Returns the concept scheme the user imported from identical triples before, or None
+		"""
+		if not self.deduplicate or self.merge or not concept_scheme.get("content_hash"):
+			return None
+		return SkosConceptScheme.objects.filter(
+			content_hash=concept_scheme["content_hash"], created_by=self.created_by).order_by('-id').first()
+
+	def _upload_scheme(self, concept_scheme, concept_chunks):
+		"""
+		Writes one concept scheme of the file, in merge mode into the concept scheme
+		with the same identifier if there is one
+		"""
+		self.collection_index = {}
+		self.concept_pks = {}
+		self.tree_nodes = {}
+		self.tree_fields = None
+		self.notations = None
+		self.scheme = None
+		if concept_scheme.get("has_concepts") is not None:
+			concepts = concept_scheme.get("has_concepts")
+			concept_chunks = [concepts[i:i + self.chunk_size] for i in range(0, len(concepts), self.chunk_size)]
+		duplicate = self._find_duplicate(concept_scheme)
+		if duplicate is not None:
+			logging.info("{} is imported already from identical triples".format(duplicate))
+			self.duplicates.append(duplicate)
+			return duplicate
+		if self.merge:
+			self.scheme = SkosConceptScheme.objects.filter(
+				identifier=concept_scheme.get("identifier")).order_by('-id').first()
+		if self.scheme is not None:
+			with transaction.atomic():
+				self._merge(concept_scheme)
+				self._store_content_hash(concept_scheme)
+		else:
+			self._write_chunked(concept_scheme, concept_chunks)
+		# bulk writes send no signals, downloads cached while the scheme was written are dropped
+		content_changed(schemes=[self.scheme.pk])
+		return self.scheme
+
+	def upload_data(self, user, concept_schemes=None):
+		"""
+		Creates and saves concept schemes and their concepts in a database.
+		Every skos:ConceptScheme of the file becomes a concept scheme with the concepts
+		and collections which are in it (skos:inScheme), the file is parsed once.
+		Rows are built in memory and written with batched bulk_create per model,
+		statistics per table are available in self.stats afterwards.
+		Concepts are built from the graph, written and committed in chunks of chunk_size, with resume
+		an interrupted import of the same file continues after the last committed chunk.
+		In streaming mode concepts are also read in chunks.
+		In merge mode a concept scheme with the same identifier is updated
+		with the changes of the file in one transaction, self.diff has the counts of written rows.
+		The progress callback, if given, is called with the phase and rows written so far.
+		With deduplicate a concept scheme the user imported from identical triples (see TriplesDigest)
+		is returned instead of a new one, it is in self.duplicates. on_content_hash, if given,
+		is called with the hash of the triples of the file before anything is written.
+		Concept scheme dictionaries parsed beforehand (see parse_file) can be passed to skip parsing.
+		Returns the first concept scheme, all of them are in self.schemes
+		"""
+		if self.merge and self.resume:
+			raise Exception("Merge mode can not be resumed, it is written in one transaction")
+		self.writer = None
+		if not self.merge:
+			# some rdflib parsers close the file, it is hashed for the checkpoints before
+			self.file_digest()
+		self._progress("parse")
+		if concept_schemes is not None:
+			self.streaming = False
+			schemes = [(concept_scheme, None) for concept_scheme in concept_schemes]
+		elif self.streaming:
+			if self.merge:
+				raise Exception("Merge mode can not be used with streaming")
+			schemes = self.stream_concept_schemes()
+		elif self.merge:
+			# the difference is computed for the whole concept scheme
+			schemes = [(concept_scheme, None) for concept_scheme in self.parse_triples()]
+		else:
+			schemes = self.graph_concept_schemes()
+		self.writer = BulkWriter()
+		self.created_by = User.objects.get(username=user)
+		if self.on_content_hash is not None and self.content_hash is not None:
+			self.on_content_hash(self.content_hash)
+		self.dangling_broader = []
+		self.cyclic_broader = []
+		self.diff = {}
+		self.schemes = []
+		self.duplicates = []
+		# permissions of concepts and collections are written in bulk, not by the receivers
+		with bulk_import():
+			for concept_scheme, concept_chunks in schemes:
+				self.schemes.append(self._upload_scheme(concept_scheme, concept_chunks))
+		self.stats = self.writer.stats
+		self.writer.log_report()
+		return self.schemes[0]
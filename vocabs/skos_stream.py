@@ -0,0 +1,461 @@
+import bz2
+import codecs
+import gzip
+import hashlib
+import lzma
+import os
+import zipfile
+from contextlib import contextmanager
+from urllib.parse import urljoin
+from urllib.request import pathname2url
+from xml.etree import ElementTree
+from rdflib import BNode, Graph, Literal, RDF, URIRef
+from rdflib.plugins.parsers.ntriples import NTriplesParser, ParseError, r_tail, r_wspace
+
+
+LINE_FORMATS = ("nt", "nt11", "ntriples", "nquads", "nq")
+TURTLE_FORMATS = ("ttl", "turtle", "n3")
+XML_FORMATS = ("xml",)
+STREAM_FORMATS = LINE_FORMATS + TURTLE_FORMATS + XML_FORMATS
+# formats with named graphs, they are parsed in a ConjunctiveGraph
+QUAD_FORMATS = ("nquads", "trig")
+
+TURTLE_DIRECTIVES = ("@prefix", "@base", "prefix ", "base ")
+
+# file extension or format name -> rdflib parser name
+FORMAT_NAMES = {
+	"rdf": "xml", "xml": "xml", "owl": "xml",
+	"ttl": "ttl", "turtle": "ttl", "n3": "n3",
+	"nt": "nt", "ntriples": "nt", "nt11": "nt",
+	"nq": "nquads", "nquads": "nquads",
+	"jsonld": "json-ld", "json-ld": "json-ld", "json": "json-ld",
+	"trig": "trig",
+}
+
+COMPRESSIONS = {
+	".gz": lambda f: gzip.GzipFile(fileobj=f),
+	".bz2": bz2.BZ2File,
+	".xz": lzma.LZMAFile,
+}
+
+
+def format_name(file_format):
+	"""
+	Returns the rdflib parser name of a format or file extension
+	"""
+	if file_format is None:
+		return None
+	return FORMAT_NAMES.get(file_format.lower(), file_format)
+
+
+def guess_file_format(name):
+	"""
+	Returns the rdflib parser name for a file name, a compression extension
+	(.gz, .bz2, .xz, .zip) is skipped. Returns None for unknown extensions
+	"""
+	root, extension = os.path.splitext(name.lower())
+	if extension in COMPRESSIONS or extension == ".zip":
+		root, extension = os.path.splitext(root)
+	return FORMAT_NAMES.get(extension.lstrip("."))
+
+
+def guess_source_format(source):
+	"""
+	Returns the rdflib parser name for a file name or file like object (see guess_file_format),
+	the format of a zip archive without it in its name is guessed from the name of its first file
+	"""
+	name = (getattr(source, "name", None) if hasattr(source, "read") else source) or ""
+	file_format = guess_file_format(name)
+	if file_format is None and name.lower().endswith(".zip"):
+		try:
+			with open_source(source) as f:
+				file_format = guess_file_format(f.name)
+		except zipfile.BadZipFile:
+			return None
+	return file_format
+
+
+def document_uri(source):
+	"""
+	Returns the file URI of a file name or named file like object, relative URIs of a document
+	without a base are resolved against it (as rdflib does for a file it opens by name)
+	"""
+	name = getattr(source, "name", None) if hasattr(source, "read") else source
+	if not isinstance(name, str) or not name:
+		return ""
+	return urljoin("file:", pathname2url(os.path.abspath(name)))
+
+
+def _decompress(f, name):
+	"""
+	Wraps a byte stream with a decompressing reader chosen by the extension
+	of name, the first file of a zip archive is read
+	"""
+	extension = os.path.splitext(name.lower())[1]
+	if extension in COMPRESSIONS:
+		return COMPRESSIONS[extension](f)
+	if extension == ".zip":
+		archive = zipfile.ZipFile(f)
+		members = [info for info in archive.infolist() if not info.filename.endswith("/")]
+		if not members:
+			raise Exception("Zip archive {} is empty".format(name))
+		return archive.open(members[0])
+	return f
+
+
+@contextmanager
+def open_source(source, decompress=True):
+	"""
+	Opens a file name or rewinds a file like object for reading bytes.
+	Files ending with .gz, .bz2, .xz or .zip are decompressed while they are read
+	"""
+	if hasattr(source, "read"):
+		source.seek(0)
+		f = source
+		name = getattr(source, "name", None) or ""
+	else:
+		f = open(source, "rb")
+		name = source
+	try:
+		if decompress:
+			stream = _decompress(f, name)
+			try:
+				yield stream
+			finally:
+				if stream is not f:
+					stream.close()
+		else:
+			yield f
+	finally:
+		if f is not source:
+			f.close()
+
+
+class LineParser(NTriplesParser):
+	"""
+	N-Triples and N-Quads parser which returns one triple per line
+	instead of adding it to a graph, the graph name of a quad is ignored
+	"""
+
+	def __init__(self, f):
+		super(LineParser, self).__init__()
+		# blank node ids are kept per document, not per class
+		self._bnode_ids = {}
+		self.file = codecs.getreader('utf-8')(f)
+		self.buffer = ''
+
+	def parseline(self):
+		self.eat(r_wspace)
+		if (not self.line) or self.line.startswith('#'):
+			return None
+		subject = self.subject()
+		self.eat(r_wspace)
+		predicate = self.predicate()
+		self.eat(r_wspace)
+		obj = self.object()
+		self.eat(r_wspace)
+		# graph name of N-Quads
+		self.uriref() or self.nodeid()
+		self.eat(r_tail)
+		if self.line:
+			raise ParseError("Trailing garbage")
+		return subject, predicate, obj
+
+	def triples(self):
+		while True:
+			self.line = line = self.readline()
+			if line is None:
+				break
+			try:
+				triple = self.parseline()
+			except ParseError as e:
+				raise ParseError("Invalid line ({}): {!r}".format(e, line))
+			if triple is not None:
+				yield triple
+
+
+def iter_line_triples(f):
+	"""
+	Yields triples of an N-Triples or N-Quads file line by line
+	"""
+	return LineParser(f).triples()
+
+
+def _parse_turtle_block(directives, block, base=""):
+	g = Graph()
+	g.parse(data="".join(directives + block), format="turtle", publicID=base or None)
+	# keep triples of a subject together
+	for subject in set(g.subjects()):
+		for predicate, obj in g.predicate_objects(subject):
+			yield subject, predicate, obj
+
+
+def _scan_turtle_line(line, long_quote=None):
+	"""
+	Scans a line of Turtle, which starts in a long string if its quote (three double
+	or single quotes) is given as long_quote.
+	Returns the quote of a long string still open at the end of the line, or None,
+	and whether the line ends a statement: its last character outside of strings,
+	IRIs and comments is a dot
+	"""
+	quote = long_quote
+	last = ""
+	i = 0
+	while i < len(line):
+		if quote is not None:
+			if line[i] == "\\":
+				i += 2
+			elif line.startswith(quote, i):
+				i += len(quote)
+				quote = None
+				last = '"'
+			else:
+				i += 1
+			continue
+		char = line[i]
+		if char == "#":
+			break
+		if char in "\"'":
+			quote = char * 3 if line.startswith(char * 3, i) else char
+			i += len(quote)
+			continue
+		if char == "<":
+			end = line.find(">", i)
+			i = len(line) if end < 0 else end + 1
+			last = ">"
+			continue
+		if not char.isspace():
+			last = char
+		i += 1
+	# a short string is not continued on the next line
+	if quote is not None and len(quote) == 1:
+		quote = None
+	return quote, quote is None and last == "."
+
+
+def iter_turtle_triples(f, statements=1000, base=""):
+	"""
+	Yields triples of a Turtle file which is parsed in blocks of statements.
+	Prefix and base directives are prepended to every block, relative URIs
+	without a base directive are resolved against base (see document_uri).
+	A statement must end with a dot at the end of a line (comments aside), as written by rdflib
+	and most other serializers. Blank node labels are only valid within a block
+	"""
+	reader = codecs.getreader('utf-8')(f)
+	directives = []
+	block = []
+	count = 0
+	statement_start = True
+	long_quote = None
+	for line in reader:
+		stripped = line.strip()
+		if long_quote is None:
+			if not stripped or (statement_start and stripped.startswith("#")):
+				continue
+			if statement_start and stripped.lower().startswith(TURTLE_DIRECTIVES):
+				directives.append(line if line.endswith("\n") else line + "\n")
+				continue
+		block.append(line)
+		statement_start = False
+		long_quote, statement_end = _scan_turtle_line(line, long_quote)
+		if statement_end:
+			statement_start = True
+			count += 1
+			if count >= statements:
+				for triple in _parse_turtle_block(directives, block, base):
+					yield triple
+				block = []
+				count = 0
+	if block:
+		for triple in _parse_turtle_block(directives, block, base):
+			yield triple
+
+
+RDF_NS = str(RDF)
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+XML_LANG = "{%s}lang" % XML_NS
+XML_BASE = "{%s}base" % XML_NS
+RDF_TAGS = {name: "{%s}%s" % (RDF_NS, name) for name in (
+	"RDF", "Description", "about", "nodeID", "ID", "resource", "datatype", "li")}
+# attributes of node and property elements which are not property attributes
+NODE_ATTRIBUTES = (RDF_TAGS["about"], RDF_TAGS["nodeID"], RDF_TAGS["ID"], XML_LANG)
+PROPERTY_ATTRIBUTES = (RDF_TAGS["resource"], RDF_TAGS["nodeID"], RDF_TAGS["datatype"], XML_LANG)
+
+
+class UnsupportedRDFXML(Exception):
+	"""
+	An RDF/XML construct which iter_rdfxml_triples does not handle,
+	such documents are parsed with rdflib
+	"""
+
+
+def _tag_uri(tag):
+	if not tag.startswith("{"):
+		raise UnsupportedRDFXML("Name without a namespace: {}".format(tag))
+	return URIRef(tag[1:].replace("}", "", 1))
+
+
+def iter_rdfxml_triples(f, base=""):
+	"""
+	Yields triples of an RDF/XML file with incremental XML parsing (iterparse of the standard
+	library's ElementTree, lxml is not a dependency), elements are cleared as soon as they are
+	read and the node elements read before are removed from rdf:RDF. Relative URIs are resolved against
+	the xml:base of rdf:RDF, itself resolved against base (see document_uri).
+	Handles the usual shape of SKOS exports: rdf:RDF with node elements (rdf:Description
+	or typed, rdf:about, rdf:nodeID, rdf:ID, property attributes) and property elements
+	with rdf:resource, rdf:nodeID, rdf:datatype, xml:lang, text or one nested node element.
+	Triples of a node element are yielded together at its end tag.
+	Other constructs (rdf:parseType, rdf:li, reification, xml:base below the root)
+	raise UnsupportedRDFXML
+	"""
+	bnodes = {}
+	root = None
+	stack = []
+
+	def resolve(value):
+		return URIRef(urljoin(base, value) if base else value)
+
+	def bnode(node_id):
+		if node_id not in bnodes:
+			bnodes[node_id] = BNode()
+		return bnodes[node_id]
+
+	for event, elem in ElementTree.iterparse(f, events=("start", "end")):
+		if event == "start":
+			parent = stack[-1] if stack else None
+			lang = elem.get(XML_LANG, parent["lang"] if parent else None)
+			if parent is None:
+				if elem.tag != RDF_TAGS["RDF"]:
+					raise UnsupportedRDFXML("The root element is not rdf:RDF")
+				root = elem
+				if elem.get(XML_BASE) is not None:
+					base = urljoin(base, elem.get(XML_BASE)) if base else elem.get(XML_BASE)
+				stack.append({"kind": "root", "lang": lang})
+				continue
+			if elem.get(XML_BASE) is not None:
+				raise UnsupportedRDFXML("xml:base below rdf:RDF")
+			if parent["kind"] == "node":
+				# property element
+				predicate = _tag_uri(elem.tag)
+				if elem.tag == RDF_TAGS["li"] or any(name not in PROPERTY_ATTRIBUTES for name in elem.keys()):
+					raise UnsupportedRDFXML("Property element {} is not supported".format(predicate))
+				obj = None
+				if elem.get(RDF_TAGS["resource"]) is not None:
+					obj = resolve(elem.get(RDF_TAGS["resource"]))
+				elif elem.get(RDF_TAGS["nodeID"]) is not None:
+					obj = bnode(elem.get(RDF_TAGS["nodeID"]))
+				stack.append({"kind": "property", "predicate": predicate, "object": obj, "lang": lang, "node": parent})
+				continue
+			# node element, at the top or nested in a property element
+			if parent["kind"] == "property" and parent["object"] is not None:
+				raise UnsupportedRDFXML("Property element {} has several objects".format(parent["predicate"]))
+			if elem.get(RDF_TAGS["about"]) is not None:
+				subject = resolve(elem.get(RDF_TAGS["about"]))
+			elif elem.get(RDF_TAGS["nodeID"]) is not None:
+				subject = bnode(elem.get(RDF_TAGS["nodeID"]))
+			elif elem.get(RDF_TAGS["ID"]) is not None:
+				subject = resolve("#" + elem.get(RDF_TAGS["ID"]))
+			else:
+				subject = BNode()
+			triples = []
+			if elem.tag != RDF_TAGS["Description"]:
+				triples.append((subject, RDF.type, _tag_uri(elem.tag)))
+			for name, value in elem.items():
+				if name in NODE_ATTRIBUTES:
+					continue
+				if name.startswith("{%s}" % RDF_NS) or name.startswith("{%s}" % XML_NS):
+					raise UnsupportedRDFXML("Attribute {} is not supported".format(name))
+				triples.append((subject, _tag_uri(name), Literal(value, lang=lang)))
+			if parent["kind"] == "property":
+				parent["object"] = subject
+			stack.append({"kind": "node", "subject": subject, "triples": triples, "lang": lang})
+		else:
+			frame = stack.pop()
+			if frame["kind"] == "property":
+				obj = frame["object"]
+				if obj is None:
+					datatype = elem.get(RDF_TAGS["datatype"])
+					if datatype is not None:
+						obj = Literal(elem.text or "", datatype=resolve(datatype))
+					else:
+						obj = Literal(elem.text or "", lang=frame["lang"])
+				node = frame["node"]
+				node["triples"].append((node["subject"], frame["predicate"], obj))
+			elif frame["kind"] == "node":
+				for triple in frame["triples"]:
+					yield triple
+				if len(stack) == 1:
+					# read node elements are dropped from the root
+					root.clear()
+			elem.clear()
+
+
+def iter_triples(source, file_format):
+	"""
+	Yields triples of a file in one of the STREAM_FORMATS
+	without loading the whole file in a graph
+	"""
+	with open_source(source) as f:
+		if file_format in LINE_FORMATS:
+			triples = iter_line_triples(f)
+		elif file_format in TURTLE_FORMATS:
+			triples = iter_turtle_triples(f, base=document_uri(source))
+		elif file_format in XML_FORMATS:
+			triples = iter_rdfxml_triples(f, document_uri(source))
+		else:
+			raise Exception("Streaming import supports only {}".format(", ".join(STREAM_FORMATS)))
+		for triple in triples:
+			yield triple
+
+
+class TriplesDigest(object):
+	"""
+	Hash of a set of triples which does not depend on their order, the sha1 of every
+	triple in N-Triples notation is added up modulo 2**160. Blank node labels differ
+	from parse to parse, all blank nodes are hashed alike
+	"""
+
+	def __init__(self):
+		self.total = 0
+
+	def update(self, triple):
+		line = " ".join("_:" if isinstance(term, BNode) else term.n3() for term in triple)
+		self.total = (self.total + int(hashlib.sha1(line.encode("utf-8")).hexdigest(), 16)) % (1 << 160)
+
+	def hexdigest(self):
+		return "{:040x}".format(self.total)
+
+
+def digest_triples(triples, digest):
+	"""
+	Yields triples and adds them to a TriplesDigest
+	"""
+	for triple in triples:
+		digest.update(triple)
+		yield triple
+
+
+def group_by_subject(triples, dispatch):
+	"""
+	Groups consecutive triples of the same subject into a record
+	field -> list of objects, fields are taken from the dispatch table.
+	Yields (subject, record)
+	"""
+	subject = None
+	record = {}
+	for s, p, o in triples:
+		if s != subject:
+			if subject is not None:
+				yield subject, record
+			subject = s
+			record = {}
+		field = dispatch.get(p)
+		if field is None:
+			continue
+		values = record.get(field)
+		if values is None:
+			record[field] = [o]
+		else:
+			values.append(o)
+	if subject is not None:
+		yield subject, record
@@ -0,0 +1,203 @@
+import logging
+import os
+import re
+from urllib.parse import quote
+import pandas as pd
+from django.utils.text import slugify
+from .models import DEFAULT_URI
+from .skos_import import NOTE_FIELDS, SkosImporter
+
+
+SCHEME_COLUMN = "conceptScheme"
+# pref_label@en or "1st order pref_label@eng | pref_label@ger"
+LABEL_HEADER = re.compile(r"^(?P<level>.*?)\s*pref_label@")
+FIELD_LANGUAGE = re.compile(r"(?P<field>[A-Za-z_]+)@(?P<lang>[^\s|]+)")
+LANGUAGE = re.compile(r"^[a-z]{2,3}(-[a-z0-9]+)*$")
+
+
+class SpreadsheetImporter(object):
+	"""
+	Imports concept schemes from a spreadsheet (xlsx, xls or csv) with SkosImporter.
+	Two layouts are read, a row of both has the concept scheme title(s) in
+	the conceptScheme column, titles and labels in several languages are separated by |:
+
+	* hierarchy (vocabs/data/spreadsheets/vocabs_sample.xlsx): every row is a path
+	  of concepts in columns "1st order pref_label@eng | pref_label@ger", "2nd order ..."
+	* list: a row is a concept with notation, broader (notation of the broader concept),
+	  pref_label@<lang>, alt_label@<lang>, hidden_label@<lang>, <note type>@<lang>
+	  and creator, contributor columns, several alt labels, notes and creators
+	  are separated by ;
+	"""
+
+	def __init__(self, file, language=None, namespace=None, sheet_name=0, chunk_size=1000):
+		self.file = file
+		self.language = language.lower() if language else language
+		# identifiers of concept schemes are the namespace followed by the slug of the title
+		self.namespace = namespace or DEFAULT_URI
+		self.sheet_name = sheet_name
+		self.chunk_size = chunk_size
+		self.dangling_broader = []
+		self.stats = {}
+
+	def read(self):
+		"""
+		Reads the sheet as strings, empty cells are empty strings
+		"""
+		name = getattr(self.file, "name", self.file)
+		if os.path.splitext(str(name))[1].lower() == ".csv":
+			df = pd.read_csv(self.file, dtype=str)
+		else:
+			df = pd.read_excel(self.file, sheet_name=self.sheet_name, dtype=str)
+		df.columns = [str(column).strip() for column in df.columns]
+		return df.fillna("").apply(lambda column: column.str.strip())
+
+	def _languages(self, header):
+		"""
+		Returns the normalised (lower case) languages of a column header
+		"""
+		languages = [match.group("lang").lower() for match in FIELD_LANGUAGE.finditer(header)]
+		invalid = [lang for lang in languages if not LANGUAGE.match(lang)]
+		if invalid:
+			raise Exception("Column {}: invalid language {}".format(header, ", ".join(invalid)))
+		return languages
+
+	def _split_languages(self, column, languages, header):
+		"""
+		Splits cells of "label|label" in one column per language
+		"""
+		parts = column.str.split("|", expand=True)
+		if parts.shape[1] > len(languages):
+			extra = parts.iloc[:, len(languages):].notnull().any(axis=1)
+			raise Exception("Column {}: more labels than languages in rows {}".format(
+				header, ", ".join(str(row + 2) for row in parts.index[extra])))
+		parts = parts.fillna("").apply(lambda part: part.str.strip())
+		return {lang: parts[i] if i in parts.columns else "" for i, lang in enumerate(languages)}
+
+	def _hierarchy(self, df, level_columns):
+		"""
+		Turns a hierarchy of levels into the list layout, the key of a concept
+		is the path of its labels in the first language
+		"""
+		frames = []
+		parent = None
+		for header in level_columns:
+			labels = self._split_languages(df[header], self._languages(header), header)
+			first = next(iter(labels.values()))
+			key = first.map(lambda label: slugify(label, allow_unicode=True))
+			if parent is not None:
+				key = parent + "/" + key
+			frame = pd.DataFrame({SCHEME_COLUMN: df[SCHEME_COLUMN], "key": key, "notation": ""})
+			frame["broader"] = "" if parent is None else parent
+			for lang, label in labels.items():
+				frame["pref_label@{}".format(lang)] = label
+			frames.append(frame[first != ""])
+			parent = key
+		return pd.concat(frames, ignore_index=True).drop_duplicates([SCHEME_COLUMN, "key"])
+
+	def normalise(self, df):
+		"""
+		Validates the columns and returns a data frame in the list layout
+		with a key column, creator and contributor lists are cleaned up
+		"""
+		if SCHEME_COLUMN not in df.columns:
+			raise Exception("Column {} is not found".format(SCHEME_COLUMN))
+		label_columns = [header for header in df.columns if LABEL_HEADER.match(header)]
+		if not label_columns:
+			raise Exception("No pref_label@<language> column is found")
+		self.title_languages = self._languages(label_columns[0])
+		level_columns = [header for header in label_columns if LABEL_HEADER.match(header).group("level")]
+		if level_columns:
+			df = self._hierarchy(df, level_columns)
+		else:
+			if "notation" not in df.columns:
+				raise Exception("Column notation is not found")
+			for header in df.columns:
+				self._languages(header)
+			df = df.assign(key=df["notation"])
+			missing = df["key"] == ""
+			if missing.any():
+				raise Exception("Notation is missing in rows {}".format(
+					", ".join(str(row + 2) for row in df.index[missing])))
+			duplicated = df.duplicated([SCHEME_COLUMN, "key"], keep=False)
+			if duplicated.any():
+				raise Exception("Notation is used twice in a concept scheme: {}".format(
+					", ".join(sorted(set(df.loc[duplicated, "key"])))))
+		for column in ("broader", "creator", "contributor"):
+			if column not in df.columns:
+				df[column] = ""
+		for column in ("creator", "contributor"):
+			df[column] = df[column].str.replace(r"\s*;[\s;]*", ";", regex=True).str.strip(";")
+		pref_labels = [header for header in df.columns if header.startswith("pref_label@")]
+		unlabelled = (df[pref_labels] == "").all(axis=1)
+		if unlabelled.any():
+			raise Exception("Concepts without pref label: {}".format(", ".join(df.loc[unlabelled, "key"])))
+		known = df[SCHEME_COLUMN] + "\n" + df["key"]
+		dangling = (df["broader"] != "") & ~(df[SCHEME_COLUMN] + "\n" + df["broader"]).isin(known)
+		self.dangling_broader = list(zip(df.loc[dangling, "key"], df.loc[dangling, "broader"]))
+		if self.dangling_broader:
+			logging.warning("{} broader concepts are not found".format(len(self.dangling_broader)))
+		return df
+
+	def _values(self, row, field):
+		"""
+		Returns (text, language) pairs of the field@<lang> columns of a row
+		"""
+		values = []
+		for header, value in row.items():
+			if value and header.startswith(field + "@"):
+				lang = header[len(field) + 1:].lower()
+				for text in (value.split(";") if field != "pref_label" else [value]):
+					if text.strip():
+						values.append((text.strip(), lang))
+		return values
+
+	def _build_concept(self, row, identifier):
+		concept = {}
+		concept["legacy_id"] = "{}/{}".format(identifier, quote(row["key"], safe="/"))
+		concept["pref_label"] = [{"label": label, "lang": lang} for label, lang in self._values(row, "pref_label")]
+		concept["scheme"] = identifier
+		if row["notation"]:
+			concept["notation"] = row["notation"]
+		concept["creator"] = row["creator"]
+		concept["contributor"] = row["contributor"]
+		if row["broader"]:
+			concept["broader_concept"] = "{}/{}".format(identifier, quote(row["broader"], safe="/"))
+		for field in ("alt_label", "hidden_label"):
+			concept[field] = [{"label": label, "lang": lang} for label, lang in self._values(row, field)]
+		concept["source"] = []
+		concept["note"] = [
+			{"name": name, "lang": lang, "note_type": note_type}
+			for note_type in NOTE_FIELDS for name, lang in self._values(row, note_type)]
+		return concept
+
+	def concept_schemes(self):
+		"""
+		Returns concept scheme dictionaries (the ones SkosImporter builds from RDF)
+		of all concept schemes of the sheet
+		"""
+		df = self.normalise(self.read())
+		concept_schemes = []
+		for title, rows in df.groupby(SCHEME_COLUMN, sort=False):
+			titles = [part.strip() for part in title.split("|")]
+			concept_scheme = {
+				"identifier": self.namespace + slugify(titles[0], allow_unicode=True),
+				"title": [
+					{"title": name, "lang": lang} for name, lang in zip(titles, self.title_languages) if name],
+				"creator": "", "contributor": "", "language": "", "subject": "", "publisher": "",
+				"description": [], "source": [],
+			}
+			concept_scheme["has_concepts"] = [
+				self._build_concept(row, concept_scheme["identifier"])
+				for row in rows.drop(columns=[SCHEME_COLUMN]).to_dict("records")]
+			concept_schemes.append(concept_scheme)
+		return concept_schemes
+
+	def upload_data(self, user):
+		"""
+		Writes every concept scheme of the sheet with the bulk writer of SkosImporter,
+		returns the concept schemes, statistics per table are in self.stats
+		"""
+		importer = SkosImporter(file=self.file, language=self.language, chunk_size=self.chunk_size)
+		importer.upload_data(user=user, concept_schemes=self.concept_schemes())
+		self.stats = importer.stats
+		return importer.schemes
@@ -1,5 +1,44 @@
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
+
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import caches
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.db import connection, transaction
+from rdflib import Graph, RDF, URIRef
+from rdflib.namespace import SKOS
+from rdflib.compare import isomorphic
+
+from .benchmarks import run_benchmark
+from .import_jobs import claim_next_job, run_import_job, wait_for_identical_jobs
+from .mptt_utils import compute_tree_fields
+from . import rdf_utils
+from .rdf_utils import ConceptExport, graph_construct_qs
+from .models import (
+    ConceptLabel, ImportCheckpoint, ImportJob, SkosConcept, SkosConceptScheme, bulk_import, reserve_tree_ids
+)
+from .skos_generator import concept_parents, write_vocab
+from .skos_import import SkosImporter
+from .skos_stream import UnsupportedRDFXML, document_uri, iter_rdfxml_triples, iter_triples, iter_turtle_triples
+from .spreadsheet_import import SpreadsheetImporter
+
+# downloads are cached in memory, not in the export-cache directory
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'exports': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'exports'},
+}
 
 
 class VocabsTest(TestCase):
@@ -22,3 +61,775 @@ class VocabsTest(TestCase):
         form_data = {'pref_label': 'test concept'}
         self.client.post('/vocabs/create/', form_data, follow=True)
         self.assertContains(rv, 'Skos broadmatch')
+
+
+SKOS_SAMPLE = b"""
+@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+@prefix dc: <http://purl.org/dc/elements/1.1/> .
+@prefix ex: <http://example.org/vocab/> .
+
+ex:scheme a skos:ConceptScheme ;
+    dc:title "Sample"@en, "Beispiel"@de ;
+    dc:creator "Tester" .
+
+ex:col a skos:Collection ;
+    skos:prefLabel "Collection"@en ;
+    skos:member ex:a, ex:b .
+
+ex:a a skos:Concept ;
+    skos:inScheme ex:scheme ;
+    skos:prefLabel "Animal"@en, "Tier"@de ;
+    skos:altLabel "Beast"@en ;
+    skos:definition "A living organism"@en .
+
+ex:b a skos:Concept ;
+    skos:inScheme ex:scheme ;
+    skos:prefLabel "Dog"@en ;
+    skos:broader ex:a .
+"""
+
+
+class SkosImporterTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user('temporary', 'temp@gmail.com', 'temporary')
+
+    def import_sample(self, data=SKOS_SAMPLE, file_format='ttl', **kwargs):
+        importer = SkosImporter(
+            file=io.BytesIO(data), file_format=file_format, language='en', **kwargs)
+        return importer, importer.upload_data(user='temporary')
+
+    def test_upload_data(self):
+        importer, scheme = self.import_sample()
+        self.assertEqual(scheme.title, 'Sample')
+        self.assertEqual(scheme.has_titles.get().name, 'Beispiel')
+        animal = SkosConcept.objects.get(legacy_id='http://example.org/vocab/a')
+        dog = SkosConcept.objects.get(legacy_id='http://example.org/vocab/b')
+        self.assertEqual(dog.broader_concept, animal)
+        self.assertEqual(animal.notation, 'animal')
+        self.assertEqual(
+            sorted(animal.has_labels.values_list('name', 'label_type')),
+            [('Beast', 'altLabel'), ('Tier', 'prefLabel')])
+        self.assertEqual(animal.has_notes.get().note_type, 'definition')
+        self.assertEqual(scheme.has_collections.get().has_members.count(), 2)
+        self.assertEqual(importer.stats['vocabs_skosconcept']['rows'], 2)
+        user = User.objects.get(username='temporary')
+        self.assertTrue(user.has_perm('change_skosconcept', dog))
+
+    def test_streaming_upload_data(self):
+        g = Graph()
+        g.parse(data=SKOS_SAMPLE.decode(), format='ttl')
+        lines = sorted(g.serialize(format='nt').splitlines(True))
+        importer, scheme = self.import_sample(
+            b''.join(lines), file_format='nt', streaming=True, chunk_size=1)
+        dog = scheme.has_concepts.get(legacy_id='http://example.org/vocab/b')
+        self.assertEqual(dog.broader_concept.pref_label, 'Animal')
+        self.assertEqual(scheme.has_collections.get().has_members.count(), 2)
+        self.assertEqual(ConceptLabel.objects.filter(concept__scheme=scheme).count(), 2)
+
+    def test_compressed_formats(self):
+        g = Graph()
+        g.parse(data=SKOS_SAMPLE.decode(), format='ttl')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        nt = os.path.join(directory, 'sample.nt.gz')
+        with gzip.open(nt, 'wb') as f:
+            f.write(b''.join(sorted(g.serialize(format='nt').splitlines(True))))
+        jsonld = os.path.join(directory, 'sample.zip')
+        with zipfile.ZipFile(jsonld, 'w') as archive:
+            archive.writestr('sample.jsonld', g.serialize(format='json-ld'))
+        for file, file_format, streaming in (nt, None, False), (nt, None, True), (jsonld, 'jsonld', False), (jsonld, None, False):
+            importer = SkosImporter(file=file, file_format=file_format, language='en', streaming=streaming)
+            scheme = importer.upload_data(user='temporary')
+            dog = scheme.has_concepts.get(legacy_id='http://example.org/vocab/b')
+            self.assertEqual(dog.broader_concept.pref_label, 'Animal')
+
+    def test_rdfxml_reader(self):
+        data = b"""<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+    xmlns:skos="http://www.w3.org/2004/02/skos/core#" xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xml:base="http://example.org/vocab/" xml:lang="en">
+  <skos:ConceptScheme rdf:about="scheme" dc:title="Sample"/>
+  <skos:Concept rdf:about="a">
+    <skos:inScheme rdf:resource="scheme"/>
+    <skos:prefLabel>Animal</skos:prefLabel>
+    <skos:prefLabel xml:lang="de">Tier</skos:prefLabel>
+    <skos:notation rdf:datatype="http://www.w3.org/2001/XMLSchema#string">1</skos:notation>
+    <skos:narrower>
+      <skos:Concept rdf:about="b"><skos:prefLabel>Dog</skos:prefLabel></skos:Concept>
+    </skos:narrower>
+    <skos:note><rdf:Description rdf:nodeID="n1"><dc:source>Book</dc:source></rdf:Description></skos:note>
+  </skos:Concept>
+  <rdf:Description rdf:ID="c"><skos:related rdf:nodeID="n1"/></rdf:Description>
+</rdf:RDF>"""
+        expected = Graph()
+        expected.parse(data=data, format='xml')
+        streamed = Graph()
+        for triple in iter_rdfxml_triples(io.BytesIO(data)):
+            streamed.add(triple)
+        self.assertTrue(isomorphic(streamed, expected))
+        unsupported = data.replace(
+            b'<skos:note><rdf:Description rdf:nodeID="n1"><dc:source>Book</dc:source></rdf:Description></skos:note>',
+            b'<skos:note rdf:parseType="Resource"><dc:source>Book</dc:source></skos:note>')
+        with self.assertRaises(UnsupportedRDFXML):
+            list(iter_rdfxml_triples(io.BytesIO(unsupported)))
+        # rdflib reads what the streaming reader does not handle
+        importer = SkosImporter(file=io.BytesIO(unsupported), file_format='rdf', language='en')
+        self.assertEqual(len(importer._graph_read()), len(expected))
+        # also in a streaming import
+        importer, scheme = self.import_sample(unsupported, file_format='rdf', streaming=True)
+        self.assertFalse(importer.streaming)
+        self.assertEqual(
+            scheme.has_concepts.get(legacy_id='http://example.org/vocab/a').pref_label, 'Animal')
+
+    def test_rdfxml_document_base(self):
+        data = b"""<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+    xmlns:skos="http://www.w3.org/2004/02/skos/core#">
+  <skos:Concept rdf:about="a"><skos:broader rdf:resource="#b"/></skos:Concept>
+</rdf:RDF>"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'sample.rdf')
+        with open(path, 'wb') as f:
+            f.write(data)
+        # relative URIs are resolved against the file like rdflib does
+        expected = Graph()
+        expected.parse(path, format='xml')
+        streamed = Graph()
+        for triple in iter_triples(path, 'xml'):
+            streamed.add(triple)
+        self.assertEqual(set(streamed), set(expected))
+        uri = document_uri(path)
+        self.assertIn((URIRef(uri[:-len('sample.rdf')] + 'a'), SKOS.broader, URIRef(uri + '#b')), streamed)
+
+    def test_turtle_reader(self):
+        data = b"""@prefix ex: <http://example.org/vocab/> .
+@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+# a comment ending in a period.
+ex:a a skos:Concept ;
+    # the labels follow.
+    skos:prefLabel "Animal"@en ;
+    skos:definition \"\"\"A living being.
+
+Not a plant.\"\"\" ;
+    skos:note "Ends with a dot." ;
+    skos:scopeNote 'It is not a "plant".' .
+ex:b a skos:Concept ; skos:broader <http://example.org/vocab/a> . # a trailing comment.
+"""
+        expected = Graph()
+        expected.parse(data=data.decode(), format='turtle')
+        streamed = Graph()
+        # a block for every statement
+        for triple in iter_turtle_triples(io.BytesIO(data), statements=1):
+            streamed.add(triple)
+        self.assertEqual(len(expected), 7)
+        self.assertEqual(set(streamed), set(expected))
+
+    def test_streaming_rdfxml(self):
+        g = Graph()
+        g.parse(data=SKOS_SAMPLE.decode(), format='ttl')
+        importer, scheme = self.import_sample(g.serialize(format='pretty-xml'), file_format='rdf', streaming=True)
+        dog = scheme.has_concepts.get(legacy_id='http://example.org/vocab/b')
+        self.assertEqual(dog.broader_concept.pref_label, 'Animal')
+        self.assertEqual(scheme.has_collections.get().has_members.count(), 2)
+
+    def test_collection_members_stay_in_scheme(self):
+        self.import_sample(deduplicate=False)
+        importer, scheme = self.import_sample(deduplicate=False)
+        concept = scheme.has_concepts.get(legacy_id='http://example.org/vocab/a')
+        self.assertEqual(list(concept.collection.all()), list(scheme.has_collections.all()))
+
+    def test_several_schemes(self):
+        data = SKOS_SAMPLE + b"""
+ex:other a skos:ConceptScheme ;
+    dc:title "Other"@en .
+
+ex:c a skos:Concept ;
+    skos:topConceptOf ex:other ;
+    skos:prefLabel "Cat"@en ;
+    dc:creator "Author" .
+
+ex:d a skos:Concept ;
+    skos:prefLabel "Nowhere"@en .
+"""
+        for streaming in False, True:
+            g = Graph()
+            g.parse(data=data.decode(), format='ttl')
+            nt = b''.join(sorted(g.serialize(format='nt').splitlines(True)))
+            importer, scheme = self.import_sample(nt, file_format='nt', streaming=streaming)
+            other, sample = importer.schemes
+            self.assertEqual((sample.title, other.title), ('Sample', 'Other'))
+            self.assertEqual(
+                sorted(sample.has_concepts.values_list('pref_label', flat=True)), ['Animal', 'Dog'])
+            self.assertEqual(sample.has_collections.get().has_members.count(), 2)
+            self.assertFalse(other.has_collections.exists())
+            cat = other.has_concepts.get()
+            self.assertEqual(cat.creator, 'Author')
+            self.assertEqual(sample.has_concepts.get(pref_label='Dog').creator, '')
+            self.assertEqual(importer.unassigned, ['http://example.org/vocab/d'])
+
+    def test_notations(self):
+        importer, scheme = self.import_sample()
+        importer, other = self.import_sample(deduplicate=False)
+        self.assertEqual(other.has_concepts.get(pref_label='Animal').notation, 'animal')
+        user = User.objects.get(username='temporary')
+        SkosConcept.objects.create(pref_label='Animal', notation='animal-2', scheme=scheme, created_by=user)
+        notations = [
+            SkosConcept.objects.create(pref_label='Animal', scheme=scheme, created_by=user).notation
+            for i in range(2)]
+        self.assertEqual(notations, ['animal-1', 'animal-3'])
+        concept = SkosConcept.objects.get(notation='animal-1')
+        concept.notation = ''
+        concept.save()
+        self.assertEqual(concept.notation, 'animal-1')
+
+    def test_identical_upload(self):
+        importer, scheme = self.import_sample()
+        g = Graph()
+        g.parse(data=SKOS_SAMPLE.decode(), format='ttl')
+        nt = b''.join(reversed(g.serialize(format='nt').splitlines(True)))
+        for streaming in False, True:
+            importer, again = self.import_sample(nt, file_format='nt', streaming=streaming)
+            self.assertEqual(again, scheme)
+            self.assertEqual(importer.duplicates, [scheme])
+            self.assertEqual(importer.stats, {})
+        self.assertEqual(SkosConceptScheme.objects.count(), 1)
+        importer, changed = self.import_sample(SKOS_SAMPLE.replace(b'"Dog"', b'"Hound"'))
+        self.assertNotEqual(changed, scheme)
+        german = SkosImporter(file=io.BytesIO(SKOS_SAMPLE), file_format='ttl', language='de')
+        self.assertNotEqual(german.upload_data(user='temporary'), scheme)
+
+    def test_dangling_broader(self):
+        data = SKOS_SAMPLE.replace(b'skos:broader ex:a', b'skos:broader ex:missing')
+        importer, scheme = self.import_sample(data)
+        self.assertEqual(
+            importer.dangling_broader,
+            [('http://example.org/vocab/b', 'http://example.org/vocab/missing')])
+        self.assertIsNone(scheme.has_concepts.get(legacy_id='http://example.org/vocab/b').broader_concept)
+
+    def test_tree_fields(self):
+        data = SKOS_SAMPLE + b"""
+ex:c a skos:Concept ; skos:inScheme ex:scheme ; skos:prefLabel "Cat"@en ; skos:broader ex:a .
+ex:d a skos:Concept ; skos:inScheme ex:scheme ; skos:prefLabel "Kitten"@en ; skos:broader ex:c .
+"""
+        importer, first = self.import_sample(data)
+        existing = list(first.has_concepts.values_list('lft', 'rght', 'tree_id', 'level'))
+        importer, scheme = self.import_sample(data, file_format='ttl', streaming=True, deduplicate=False)
+        self.assertEqual(
+            list(first.has_concepts.values_list('lft', 'rght', 'tree_id', 'level')), existing)
+        fields = 'legacy_id', 'lft', 'rght', 'level'
+        imported = sorted(scheme.has_concepts.values_list(*fields))
+        self.assertEqual(scheme.has_concepts.values('tree_id').distinct().count(), 1)
+        self.assertNotEqual(scheme.has_concepts.first().tree_id, existing[0][2])
+        SkosConcept.objects.rebuild()
+        self.assertEqual(sorted(scheme.has_concepts.values_list(*fields)), imported)
+
+    def test_reserved_tree_ids(self):
+        # tree ids reserved by an import which is not finished yet are not taken by others
+        reserved = reserve_tree_ids(5)
+        importer, scheme = self.import_sample()
+        self.assertTrue(all(tree_id > reserved + 4 for tree_id in scheme.has_concepts.values_list('tree_id', flat=True)))
+        root = SkosConcept.objects.create(pref_label='Zebra', scheme=scheme, created_by=scheme.created_by)
+        self.assertGreater(root.tree_id, max(scheme.has_concepts.exclude(pk=root.pk).values_list('tree_id', flat=True)))
+
+    def test_root_between_chunks(self):
+        # a root of the editor sorting before the other roots does not move the trees of an import
+        importer, first = self.import_sample(deduplicate=False)
+        write_concepts = SkosImporter._write_concepts
+
+        def write_then_edit(importer, concepts):
+            write_concepts(importer, concepts)
+            aardvark = SkosConcept.objects.filter(pref_label='Aardvark').first()
+            if aardvark is None:
+                SkosConcept.objects.create(pref_label='Aardvark', scheme=first, created_by=first.created_by)
+            else:
+                # a child made a root and a root moved into another tree
+                dog = first.has_concepts.get(pref_label='Dog')
+                dog.broader_concept = None
+                dog.save()
+                aardvark.broader_concept = first.has_concepts.get(pref_label='Animal')
+                aardvark.save()
+
+        with mock.patch.object(SkosImporter, '_write_concepts', write_then_edit):
+            importer, second = self.import_sample(deduplicate=False, chunk_size=1)
+
+        def tree_state():
+            concepts = SkosConcept.objects.values_list('pk', 'tree_id', 'lft', 'rght', 'level')
+            trees = {}
+            for pk, tree_id, lft, rght, level in concepts:
+                trees.setdefault(tree_id, set()).add(pk)
+            return (
+                {pk: (lft, rght, level) for pk, tree_id, lft, rght, level in concepts},
+                sorted(sorted(pks) for pks in trees.values()))
+
+        state = tree_state()
+        SkosConcept.objects.rebuild()
+        self.assertEqual(state, tree_state())
+        self.assertEqual(second.has_concepts.get(pref_label='Dog').broader_concept.pref_label, 'Animal')
+
+    def test_tree_fields_cycle(self):
+        # C is below the cycle A -> B -> A, only one node of the cycle loses its broader link
+        nodes = {'C': ('c', 'A'), 'A': ('a', 'B'), 'B': ('b', 'A')}
+        fields, cut = compute_tree_fields(nodes, 1)
+        self.assertEqual(cut, ['A'])
+        self.assertEqual(fields['A'], (1, 6, 1, 0))
+        self.assertEqual(fields['B'][3], 1)
+        self.assertEqual(fields['C'][3], 1)
+
+    def test_bulk_permissions(self):
+        importer, scheme = self.import_sample()
+        curator = User.objects.create_user('curator', 'curator@gmail.com', 'curator')
+        scheme.curator.add(curator)
+        data = SKOS_SAMPLE + b"""
+ex:c a skos:Concept ; skos:inScheme ex:scheme ; skos:prefLabel "Cat"@en .
+"""
+        importer, merged = self.import_sample(data, merge=True)
+        cat = scheme.has_concepts.get(legacy_id='http://example.org/vocab/c')
+        for user in scheme.created_by, curator:
+            for perm in 'view_skosconcept', 'change_skosconcept', 'delete_skosconcept':
+                self.assertTrue(user.has_perm(perm, cat))
+        self.assertEqual(importer.stats['guardian_userobjectpermission']['rows'], 6)
+        with bulk_import():
+            manual = SkosConcept.objects.create(pref_label='Manual', scheme=scheme, created_by=curator)
+        self.assertFalse(curator.has_perm('view_skosconcept', manual))
+
+    def test_validate(self):
+        data = SKOS_SAMPLE.replace(b'skos:broader ex:a', b'skos:broader ex:missing') + b"""
+ex:c a skos:Concept ; skos:inScheme ex:scheme ; skos:prefLabel "Cat"@en ; skos:notation "x" .
+ex:d a skos:Concept ; skos:inScheme ex:scheme ; skos:prefLabel "Kitten"@en ; skos:notation "x" .
+"""
+        report = SkosImporter(file=io.BytesIO(data), file_format='ttl', language='en').validate()
+        self.assertFalse(SkosConceptScheme.objects.exists())
+        self.assertEqual(report['concepts'], 4)
+        self.assertEqual(report['collections'], 1)
+        self.assertEqual(report['labels'], {'en': 5, 'de': 1})
+        self.assertEqual(report['notes'], {'definition': 1})
+        self.assertEqual(
+            report['dangling_broader'], [('http://example.org/vocab/b', 'http://example.org/vocab/missing')])
+        self.assertEqual(
+            sorted(report['notation_collisions']['x']), ['http://example.org/vocab/c', 'http://example.org/vocab/d'])
+        self.assertEqual(list(report['stages']), ['parse', 'concepts', 'tree'])
+        with tempfile.NamedTemporaryFile(suffix='.ttl') as f:
+            f.write(data)
+            f.flush()
+            stdout = io.StringIO()
+            call_command(
+                'import_skos_vocab', f.name, 'en', 'ttl', 'temporary', dry_run=True, stream=True, stdout=stdout)
+        self.assertIn('concepts: 4', stdout.getvalue())
+        self.assertIn('Notation x is used by', stdout.getvalue())
+        self.assertFalse(SkosConceptScheme.objects.exists())
+
+    def test_resume(self):
+        write_concepts = SkosImporter._write_concepts
+
+        def fail_on_second_chunk(importer, concepts):
+            if importer.concept_pks:
+                raise Exception('interrupted')
+            write_concepts(importer, concepts)
+
+        with mock.patch.object(SkosImporter, '_write_concepts', fail_on_second_chunk):
+            with self.assertRaises(Exception):
+                self.import_sample(chunk_size=1)
+        scheme = SkosConceptScheme.objects.get()
+        self.assertEqual(scheme.has_concepts.count(), 1)
+        self.assertEqual(ImportCheckpoint.objects.get(scheme=scheme).concepts_done, 1)
+        importer, resumed = self.import_sample(chunk_size=1, resume=True)
+        self.assertEqual(resumed, scheme)
+        self.assertEqual(importer.stats['vocabs_skosconcept']['rows'], 1)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        dog = scheme.has_concepts.get(legacy_id='http://example.org/vocab/b')
+        self.assertEqual(dog.broader_concept.legacy_id, 'http://example.org/vocab/a')
+        self.assertEqual(scheme.has_collections.get().has_members.count(), 2)
+        fields = 'pk', 'lft', 'rght', 'level', 'broader_concept'
+        resumed_tree = sorted(scheme.has_concepts.values_list(*fields))
+        SkosConcept.objects.rebuild()
+        self.assertEqual(sorted(scheme.has_concepts.values_list(*fields)), resumed_tree)
+
+    def test_merge(self):
+        importer, scheme = self.import_sample()
+        animal = scheme.has_concepts.get(legacy_id='http://example.org/vocab/a')
+        manual = SkosConcept.objects.create(
+            pref_label='Manual', scheme=scheme, broader_concept=animal, created_by=scheme.created_by)
+        data = SKOS_SAMPLE.replace(b'"Dog"@en', b'"Doggy"@en') + b"""
+ex:c a skos:Concept ; skos:inScheme ex:scheme ; skos:prefLabel "Cat"@en ; skos:broader ex:a .
+"""
+        importer, merged = self.import_sample(data, merge=True)
+        self.assertEqual(merged.pk, scheme.pk)
+        self.assertEqual(
+            importer.diff['concepts'], {'inserted': 1, 'updated': 1, 'deleted': 0, 'unchanged': 1})
+        self.assertEqual(
+            sorted(scheme.has_concepts.values_list('pref_label', flat=True)),
+            ['Animal', 'Cat', 'Doggy', 'Manual'])
+        cat = scheme.has_concepts.get(legacy_id='http://example.org/vocab/c')
+        self.assertEqual(cat.broader_concept, animal)
+        self.assertEqual(SkosConcept.objects.get(pk=manual.pk).broader_concept, animal)
+        fields = 'pk', 'lft', 'rght', 'level', 'broader_concept'
+        merged_tree = sorted(scheme.has_concepts.values_list(*fields))
+        SkosConcept.objects.rebuild()
+        self.assertEqual(sorted(scheme.has_concepts.values_list(*fields)), merged_tree)
+
+        importer, merged = self.import_sample(data.replace(b'skos:member ex:a, ex:b', b'skos:member ex:a'), merge=True)
+        self.assertEqual(
+            importer.diff['concepts'], {'inserted': 0, 'updated': 1, 'deleted': 0, 'unchanged': 2})
+        self.assertEqual(scheme.has_collections.get().has_members.get(), animal)
+
+        without_dog = data[:data.index(b'ex:b a skos:Concept')] + data[data.index(b'ex:c a skos:Concept'):]
+        importer, merged = self.import_sample(without_dog, merge=True)
+        self.assertEqual(importer.diff['concepts']['deleted'], 1)
+        self.assertEqual(scheme.has_concepts.count(), 3)
+
+    def test_import_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ('first', 'second'):
+            with open(os.path.join(directory, '{}.ttl'.format(name)), 'wb') as f:
+                f.write(SKOS_SAMPLE.replace(b'ex:scheme', 'ex:{}'.format(name).encode()))
+        call_command(
+            'import_skos_vocab', directory, 'en', 'ttl', 'temporary', workers=2, stdout=io.StringIO())
+        self.assertEqual(
+            sorted(SkosConceptScheme.objects.values_list('identifier', flat=True)),
+            ['http://example.org/vocab/first', 'http://example.org/vocab/second'])
+        for scheme in SkosConceptScheme.objects.all():
+            self.assertEqual(scheme.has_concepts.count(), 2)
+
+
+class ImportJobTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.client = Client()
+        User.objects.create_user('temporary', 'temp@gmail.com', 'temporary')
+        self.client.post('/accounts/login/', {'username': 'temporary', 'password': 'temporary'})
+
+    def test_upload_runs_in_background(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rv = self.client.post('/vocabs/import/', {
+                'file': SimpleUploadedFile('sample.ttl', SKOS_SAMPLE), 'language': 'en'})
+            job = ImportJob.objects.get()
+            self.assertRedirects(rv, job.get_absolute_url())
+            self.assertEqual(job.status, 'queued')
+            job = run_import_job(claim_next_job())
+            self.assertFalse(os.path.exists(job.file.path))
+        self.assertIsNone(claim_next_job())
+        status = self.client.get('/vocabs/import/{}/status/'.format(job.id)).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['scheme'], job.scheme.get_absolute_url())
+        self.assertGreater(status['rows_done'], 0)
+        self.assertEqual(job.scheme.has_concepts.count(), 2)
+
+    def test_upload_zip(self):
+        g = Graph()
+        g.parse(data=SKOS_SAMPLE.decode(), format='ttl')
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            archive.writestr('sample.jsonld', g.serialize(format='json-ld'))
+        with override_settings(MEDIA_ROOT=self.media_root):
+            self.client.post('/vocabs/import/', {
+                'file': SimpleUploadedFile('vocab.zip', data.getvalue()), 'language': 'en'})
+            self.assertEqual(ImportJob.objects.get().file_format, 'json-ld')
+            job = run_import_job(claim_next_job())
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.scheme.has_concepts.count(), 2)
+
+    def test_claim_stale_job(self):
+        user = User.objects.get(username='temporary')
+        hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        alive = ImportJob.objects.create(
+            file='sample.ttl', language='en', created_by=user, status='running',
+            date_started=hour_ago, date_heartbeat=timezone.now(), attempts=1)
+        stopped = ImportJob.objects.create(
+            file='sample.ttl', language='en', created_by=user, status='running',
+            date_started=hour_ago, date_heartbeat=hour_ago, attempts=1)
+        failed = ImportJob.objects.create(
+            file='imports/failed.ttl', language='en', created_by=user, status='running',
+            date_started=hour_ago, date_heartbeat=hour_ago, attempts=3)
+        os.makedirs(os.path.join(self.media_root, 'imports'))
+        path = os.path.join(self.media_root, 'imports', 'failed.ttl')
+        with open(path, 'wb') as f:
+            f.write(SKOS_SAMPLE)
+        with override_settings(MEDIA_ROOT=self.media_root):
+            job = claim_next_job()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(job.pk, stopped.pk)
+        self.assertEqual(job.attempts, 2)
+        self.assertGreater(job.date_heartbeat, hour_ago)
+        self.assertIsNone(claim_next_job())
+        self.assertEqual(ImportJob.objects.get(pk=alive.pk).attempts, 1)
+        self.assertEqual(ImportJob.objects.get(pk=failed.pk).status, 'failed')
+
+    def test_identical_uploads(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            for name in 'sample.ttl', 'copy.ttl':
+                self.client.post('/vocabs/import/', {
+                    'file': SimpleUploadedFile(name, SKOS_SAMPLE), 'language': 'en'})
+            first = run_import_job(claim_next_job())
+            second = run_import_job(claim_next_job())
+        self.assertEqual(second.status, 'done')
+        self.assertEqual(second.scheme, first.scheme)
+        self.assertEqual(second.content_hash, first.content_hash)
+        self.assertEqual(SkosConceptScheme.objects.count(), 1)
+
+    def test_wait_for_identical_jobs(self):
+        user = User.objects.get(username='temporary')
+        running, waiting = [
+            ImportJob.objects.create(file='sample.ttl', language='en', created_by=user, status='running')
+            for i in range(2)]
+        wait_for_identical_jobs(running, 'hash')
+
+        def finish(interval):
+            ImportJob.objects.filter(pk=running.pk).update(status='done')
+
+        with mock.patch('vocabs.import_jobs.time.sleep', side_effect=finish) as sleep:
+            wait_for_identical_jobs(waiting, 'hash')
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(ImportJob.objects.get(pk=waiting.pk).phase, 'waiting')
+
+    def test_wait_for_stopped_job(self):
+        user = User.objects.get(username='temporary')
+        hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        stopped = ImportJob.objects.create(
+            file='sample.ttl', language='en', created_by=user, status='running',
+            date_started=hour_ago, date_heartbeat=hour_ago, content_hash='hash', date_hashed=hour_ago)
+        waiting = ImportJob.objects.create(file='sample.ttl', language='en', created_by=user, status='running')
+        with mock.patch('vocabs.import_jobs.time.sleep') as sleep:
+            wait_for_identical_jobs(waiting, 'hash')
+        self.assertEqual(sleep.call_count, 0)
+        self.assertEqual(ImportJob.objects.get(pk=stopped.pk).status, 'running')
+
+
+class SpreadsheetImporterTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user('temporary', 'temp@gmail.com', 'temporary')
+
+    def test_sample_hierarchy(self):
+        importer = SpreadsheetImporter(
+            os.path.join(os.path.dirname(__file__), 'data', 'spreadsheets', 'vocabs_sample.xlsx'), language='eng')
+        topic, howwasit = importer.upload_data(user='temporary')
+        self.assertEqual((topic.title, howwasit.title), ('Topic', 'howwasit'))
+        self.assertEqual(topic.has_titles.get().name, 'Thema')
+        self.assertEqual(topic.has_concepts.count(), 5)
+        european = topic.has_concepts.get(pref_label='Modern European History')
+        self.assertEqual(
+            [c.pref_label for c in european.get_ancestors()], ['History', 'Modern History'])
+        self.assertEqual(european.has_labels.get().name, 'Neuere Europäische Geschichte')
+
+    def test_list(self):
+        data = (
+            'conceptScheme,notation,broader,pref_label@en,pref_label@de,alt_label@en,definition@en,creator\n'
+            'Animals|Tiere,1,,Animal,Tier,Beast;Creature,A living being, Anna ; Bob ;\n'
+            'Animals|Tiere,1.1,1,Dog,Hund,,,Anna\n'
+            'Animals|Tiere,1.2,9,Cat,,,,\n'
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file = os.path.join(directory, 'animals.csv')
+        with open(file, 'w') as f:
+            f.write(data)
+        importer = SpreadsheetImporter(file, language='en', namespace='http://example.org/')
+        scheme, = importer.upload_data(user='temporary')
+        self.assertEqual(scheme.identifier, 'http://example.org/animals')
+        animal = scheme.has_concepts.get(notation='1')
+        self.assertEqual(animal.creator, 'Anna;Bob')
+        self.assertEqual(animal.has_notes.get().name, 'A living being')
+        self.assertEqual(animal.has_labels.filter(label_type='altLabel').count(), 2)
+        self.assertEqual(scheme.has_concepts.get(notation='1.1').broader_concept, animal)
+        self.assertEqual(importer.dangling_broader, [('1.2', '9')])
+        with open(file, 'a') as f:
+            f.write('Animals|Tiere,1,,Again,,,,\n')
+        with self.assertRaises(Exception):
+            SpreadsheetImporter(file, language='en').concept_schemes()
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command(
+            'import_spreadsheet_vocab',
+            os.path.join(os.path.dirname(__file__), 'data', 'spreadsheets', 'vocabs_sample.xlsx'),
+            'eng', 'temporary', stdout=out)
+        self.assertIn('Concept scheme: Topic', out.getvalue())
+        self.assertIn('Successfully imported the spreadsheet', out.getvalue())
+        self.assertEqual(SkosConceptScheme.objects.get(title='Topic').has_concepts.count(), 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('temporary', 'temp@gmail.com', 'temporary')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_generator(self):
+        parents = concept_parents(15, depth=2, fan_out=3)
+        self.assertEqual(parents[:5], [None, 0, 0, 0, None])
+        path = os.path.join(self.directory, 'vocab.ttl')
+        write_vocab(path, 'ttl', concepts=30, depth=3, fan_out=3, collections=2, collection_size=5)
+        scheme = SkosImporter(file=path, language='en').upload_data(user='temporary')
+        self.assertEqual(scheme.has_concepts.count(), 30)
+        self.assertEqual(scheme.has_concepts.filter(level=2).count(), 9 * 2)
+        self.assertEqual([c.has_members.count() for c in scheme.has_collections.all()], [5, 5])
+
+    def test_run_benchmark(self):
+        results = run_benchmark([20], self.directory, self.user, memory=False, collections=1)
+        self.assertEqual(
+            [result['stage'] for result in results],
+            ['import', 'export', 'concept_list', 'concept_detail', 'scheme_detail', 'download'])
+        self.assertTrue(all(result['queries'] > 0 for result in results))
+        self.assertEqual(set(result['status'] for result in results[2:]), {200})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExportTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user('temporary', 'temp@gmail.com', 'temporary')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def import_synthetic(self, concepts):
+        path = os.path.join(self.directory, 'synthetic-{}.nt'.format(concepts))
+        write_vocab(path, concepts=concepts, collections=2, collection_size=5)
+        return SkosImporter(file=path, language='en').upload_data(user='temporary')
+
+    def test_constant_queries(self):
+        queries = []
+        for concepts in 5, 50:
+            scheme = self.import_synthetic(concepts)
+            with CaptureQueriesContext(connection) as context:
+                g = graph_construct_qs(SkosConcept.objects.filter(scheme=scheme))
+            queries.append(len(context))
+            self.assertEqual(len(set(g.subjects(RDF.type, SKOS.Concept))), concepts)
+            self.assertEqual(len(list(g.triples((None, SKOS.member, None)))), 10)
+        self.assertEqual(queries[0], queries[1])
+
+    def test_scheme_and_collections_once(self):
+        scheme = self.import_synthetic(50)
+        with mock.patch('vocabs.rdf_utils._add_collection', wraps=rdf_utils._add_collection) as add_collection, \
+                mock.patch('vocabs.rdf_utils._add_concept_scheme', wraps=rdf_utils._add_concept_scheme) as add_scheme:
+            g = graph_construct_qs(SkosConcept.objects.filter(scheme=scheme))
+        self.assertEqual(add_scheme.call_count, 1)
+        self.assertEqual(add_collection.call_count, 2)
+        self.assertEqual(len(set(g.subjects(RDF.type, SKOS.Collection))), 2)
+
+    def test_download(self):
+        scheme = self.import_synthetic(5)
+        client = Client()
+        client.login(username='temporary', password='temporary')
+        for file_format, parser in ('turtle', 'turtle'), ('nt', 'nt'), ('pretty-xml', 'xml'):
+            rv = client.get('/vocabs/vocabs-download/', {'scheme': scheme.pk, 'format': file_format})
+            content = b''.join(rv.streaming_content) if rv.streaming else rv.content
+            g = Graph()
+            g.parse(data=content.decode(), format=parser)
+            self.assertEqual(len(set(g.subjects(RDF.type, SKOS.Concept))), 5)
+
+    def test_streaming_export(self):
+        scheme = self.import_synthetic(50)
+        concepts = SkosConcept.objects.filter(scheme=scheme)
+        expected = graph_construct_qs(concepts)
+        # chunks of 7 concepts, the concept scheme and collections are written once
+        for file_format in 'nt', 'turtle':
+            export = ConceptExport(concepts, file_format, chunk_size=7)
+            data = b''.join(export).decode()
+            g = Graph()
+            g.parse(data=data, format=file_format)
+            self.assertTrue(isomorphic(g, expected))
+            self.assertEqual(export.triples, len(expected))
+        lines = b''.join(ConceptExport(concepts, 'nt', chunk_size=7)).splitlines()
+        self.assertEqual(len(lines), len(expected))
+
+    def test_export_command(self):
+        scheme = self.import_synthetic(20)
+        output = os.path.join(self.directory, 'exports')
+        call_command(
+            'export_skos_vocab', str(scheme.pk), output=output, formats='turtle,nt,pretty-xml,json-ld', stdout=io.StringIO())
+        with open(os.path.join(output, 'manifest.json')) as f:
+            files = json.load(f)['files']
+        self.assertEqual([entry['format'] for entry in files], ['turtle', 'nt', 'pretty-xml', 'json-ld'])
+        expected = graph_construct_qs(SkosConcept.objects.filter(scheme=scheme))
+        for entry, parser in zip(files, ('turtle', 'nt', 'xml', 'json-ld')):
+            with open(os.path.join(output, entry['file']), 'rb') as f:
+                data = f.read()
+            self.assertEqual(hashlib.sha256(data).hexdigest(), entry['sha256'])
+            self.assertEqual(len(data), entry['bytes'])
+            g = Graph()
+            g.parse(data=gzip.decompress(data).decode(), format=parser)
+            self.assertEqual(entry['triples'], len(expected))
+            self.assertTrue(isomorphic(g, expected))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExportCacheTest(TransactionTestCase):
+    # the modification stamps are set when a transaction commits
+
+    def setUp(self):
+        User.objects.create_user('temporary', 'temp@gmail.com', 'temporary')
+        caches['exports'].clear()
+        self.client.login(username='temporary', password='temporary')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        path = os.path.join(self.directory, 'synthetic.nt')
+        write_vocab(path, concepts=5, collections=1, collection_size=3)
+        self.scheme = SkosImporter(file=path, language='en').upload_data(user='temporary')
+
+    def download(self, **kwargs):
+        rv = self.client.get('/vocabs/vocabs-download/', {'scheme': self.scheme.pk, 'format': 'turtle'}, **kwargs)
+        content = b''.join(rv.streaming_content) if rv.streaming else rv.content
+        return rv, content
+
+    def test_cached_download(self):
+        SkosConceptScheme.objects.filter(pk=self.scheme.pk).update(
+            date_content_modified=timezone.now() - datetime.timedelta(seconds=5))
+        rv, content = self.download()
+        self.assertTrue(rv.streaming)
+        etag = rv['ETag']
+        rv, cached = self.download()
+        self.assertFalse(rv.streaming)
+        self.assertEqual(cached, content)
+        self.assertEqual(rv['ETag'], etag)
+        rv, _content = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(rv.status_code, 304)
+        rv, _content = self.download(HTTP_IF_MODIFIED_SINCE=rv['Last-Modified'])
+        self.assertEqual(rv.status_code, 304)
+        # a new label of a concept changes the stamp of the scheme
+        concept = self.scheme.has_concepts.first()
+        ConceptLabel.objects.create(concept=concept, name='changed label', language='en', label_type='altLabel')
+        stamp = SkosConceptScheme.objects.get(pk=self.scheme.pk).date_content_modified
+        # the date of a change in the current second could be the date of the next change
+        with mock.patch('vocabs.views.time.time', return_value=stamp.timestamp()):
+            rv, content = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(rv.status_code, 200)
+        self.assertNotEqual(rv['ETag'], etag)
+        self.assertIn(b'changed label', content)
+        self.assertFalse(rv.has_header('Last-Modified'))
+        # so does a removed collection member
+        etag = rv['ETag']
+        concept.collection.clear()
+        rv, content = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(rv.status_code, 200)
+
+    def test_moved_concept(self):
+        other = SkosConceptScheme.objects.create(title='Other', created_by=self.scheme.created_by)
+        stamp = SkosConceptScheme.objects.get(pk=self.scheme.pk).date_content_modified
+        concept = self.scheme.has_concepts.first()
+        concept.scheme = other
+        concept.save()
+        self.assertGreater(SkosConceptScheme.objects.get(pk=self.scheme.pk).date_content_modified, stamp)
+
+    def test_change_after_rollback(self):
+        stamp = SkosConceptScheme.objects.get(pk=self.scheme.pk).date_content_modified
+        concept = self.scheme.has_concepts.first()
+        with self.assertRaises(ValueError), transaction.atomic():
+            ConceptLabel.objects.create(concept=concept, name='rolled back', language='en', label_type='altLabel')
+            raise ValueError
+        self.assertEqual(SkosConceptScheme.objects.get(pk=self.scheme.pk).date_content_modified, stamp)
+        with transaction.atomic():
+            ConceptLabel.objects.create(concept=concept, name='committed', language='en', label_type='altLabel')
+        self.assertGreater(SkosConceptScheme.objects.get(pk=self.scheme.pk).date_content_modified, stamp)
+
+    def test_filtered_download(self):
+        concept = self.scheme.has_concepts.first()
+        rv = self.client.get('/vocabs/vocabs-download/', {
+            'scheme': self.scheme.pk, 'pref_label': concept.pk, 'format': 'turtle'})
+        self.assertFalse(rv.has_header('ETag'))
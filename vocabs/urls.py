@@ -45,4 +45,6 @@ urlpatterns = [
         name='skoscollection_delete',
     ),
     url(r'^import/$', views.file_upload, name='import'),
+    url(r'^import/(?P<pk>[0-9]+)$', views.import_job_detail, name='importjob_detail'),
+    url(r'^import/(?P<pk>[0-9]+)/status/$', views.import_job_status, name='importjob_status'),
 ]
@@ -3,22 +3,27 @@ from django.views.generic.edit import DeleteView
 from django.utils.decorators import method_decorator
 from django.urls import reverse_lazy
 from django_tables2 import RequestConfig
-from .models import SkosConcept, SkosConceptScheme, SkosCollection
+from .models import SkosConcept, SkosConceptScheme, SkosCollection, ImportJob
 from .forms import *
 from .tables import *
 from .filters import SkosConceptListFilter, SkosConceptSchemeListFilter, SkosCollectionListFilter
 from browsing.browsing_utils import GenericListView, BaseCreateView, BaseUpdateView
 from .rdf_utils import *
 from django.shortcuts import render_to_response, render
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+import math
 import time
 import datetime
 from guardian.shortcuts import get_objects_for_user
 from django.contrib.auth.decorators import login_required, permission_required
 from reversion.models import Version
 from django.db import transaction
-from django.shortcuts import redirect
+from django.shortcuts import redirect, get_object_or_404
 from .skos_import import *
+from .skos_stream import guess_source_format
+from . import export_cache
 from django.contrib import messages 
 
 
@@ -573,17 +578,66 @@ class SkosConceptDL(GenericListView):
     filter_class = SkosConceptListFilter
     formhelper_class = SkosConceptFormHelper
 
+    def get(self, request, *args, **kwargs):
+        # the download needs neither the table nor the rest of the list context
+        self.object_list = self.get_queryset()
+        return self.render_to_response({})
+
+    def cached_scheme(self, get_format):
+        """
+        Returns the concept scheme of a download of a whole scheme, whose dumps are cached:
+        only the scheme and a cached format are given and the user can view every concept of the scheme
+        """
+        if get_format not in export_cache.CACHED_FORMATS:
+            return None
+        if any(value for key, values in self.request.GET.lists()
+               if key not in ('scheme', 'format') for value in values):
+            return None
+        if not self.filter.is_valid():
+            return None
+        scheme = self.filter.form.cleaned_data.get('scheme')
+        if scheme is None or self.object_list.count() != scheme.has_concepts.count():
+            return None
+        return scheme
+
     def render_to_response(self, context):
         timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d-%H-%M-%S')
-        response = HttpResponse(content_type='application/xml; charset=utf-8')
         filename = "download_{}".format(timestamp)
         get_format = self.request.GET.get('format', default='pretty-xml')
-        if get_format == 'turtle':
-            response['Content-Disposition'] = 'attachment; filename="{}.ttl"'.format(filename)
+        content_type, extension = EXPORT_FORMATS.get(get_format, EXPORT_FORMATS['pretty-xml'])
+        export = ConceptExport(self.object_list, get_format)
+        scheme = self.cached_scheme(get_format)
+        if scheme is not None:
+            stamp = scheme.date_content_modified
+            etag = export_cache.etag(scheme.pk, get_format, stamp)
+            # whole seconds, rounded up: a change later in the second of the stamp gets a later date.
+            # It is left out while that second lasts, another change could have the same date
+            last_modified = math.ceil(stamp.timestamp())
+            if last_modified > time.time():
+                last_modified = None
+            response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+            if response is None:
+                content = export_cache.get_dump(scheme.pk, get_format, stamp)
+                if content is not None:
+                    response = HttpResponse(content, content_type=content_type)
+                elif export.streaming:
+                    response = StreamingHttpResponse(
+                        export_cache.cache_stream(export, scheme.pk, get_format, stamp), content_type=content_type)
+                else:
+                    content = b"".join(export)
+                    export_cache.set_dump(scheme.pk, get_format, stamp, content)
+                    response = HttpResponse(content, content_type=content_type)
+                response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, extension)
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            return response
+        if export.streaming:
+            # the first chunk goes out before the rest of the concepts is read
+            response = StreamingHttpResponse(export, content_type=content_type)
         else:
-            response['Content-Disposition'] = 'attachment; filename="{}.rdf"'.format(filename)
-        g = graph_construct_qs(self.get_queryset()) 
-        result = g.serialize(destination=response, format=get_format)
+            response = HttpResponse(b"".join(export), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, extension)
         return response
 
 
@@ -597,19 +651,31 @@ def file_upload(request):
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
             file = request.FILES['file']
-            file_format = file.name.split('.')[-1]
-            if file_format in ['ttl', 'rdf']:
-                if file_format == 'ttl':
-                    skos_vocab = SkosImporter(file=file, file_format="ttl", language=form.cleaned_data['language'])
-                else:
-                    skos_vocab = SkosImporter(file=file, language=form.cleaned_data['language'])
-                try:
-                    skos_vocab.upload_data(user=request.user.username)
-                    return redirect('vocabs:browse_schemes')
-                except Exception as error:
-                    messages.error(request, error)
+            file_format = guess_source_format(file)
+            if file_format is not None:
+                job = ImportJob.objects.create(
+                    file=file,
+                    file_format=file_format,
+                    language=form.cleaned_data['language'],
+                    created_by=request.user
+                )
+                return redirect(job)
             else:
-                messages.error(request, "Upload rdf or ttl file")
+                messages.error(
+                    request, "Upload rdf, ttl, nt, nq, jsonld or trig file, "
+                    "it can be compressed with gz, bz2, xz or zip")
     else:
         form = UploadFileForm()
     return render(request, 'vocabs/upload.html', {'form': form})
+
+
+@login_required
+def import_job_detail(request, pk):
+    job = get_object_or_404(ImportJob, pk=pk, created_by=request.user)
+    return render(request, 'vocabs/importjob_detail.html', {'object': job})
+
+
+@login_required
+def import_job_status(request, pk):
+    job = get_object_or_404(ImportJob, pk=pk, created_by=request.user)
+    return JsonResponse(job.as_dict())
@@ -138,7 +138,21 @@ VOCABS_DEFAULT_PEFIX = os.path.basename(BASE_DIR)
 VOCABS_SETTINGS = {
     'default_prefix': VOCABS_DEFAULT_PEFIX,
     'default_ns': "http://www.vocabs/{}/".format(VOCABS_DEFAULT_PEFIX),
-    'default_lang': "en"
+    'default_lang': "en",
+    'export_cache': 'exports',
+}
+
+# dumps of concept schemes for downloads are stored on disk, all processes share them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'exports': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'export-cache'),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
 }
 
 # Django guardian settings